@@ -1,20 +1,45 @@
-from flask import Flask, jsonify, request, send_file
+from flask import Flask, jsonify, request, send_file, send_from_directory
 from flask_cors import CORS
 import os
+import sys
 import subprocess
+import click
 import glob
 from dotenv import load_dotenv
-import io
-from models import db, Song, Playlist, SearchHistory, PlayHistory, DownloadQueue
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import is_resource_modified
+from werkzeug.utils import safe_join
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import joinedload
+from models import db, sync_schema, playlist_songs, Song, Playlist, SearchQueryStat, PlayHistory, DownloadQueue
 from services.video_search import VideoSearchService
-import asyncio
+from services.async_runtime import AsyncRuntime
+from services.file_info_cache import FileInfoCache
+from services.transcoder import DiskCache, Transcoder, TRANSCODE_PRESETS
+from services.hls import HlsSegmenter
+from services.library_indexer import LibraryIndexer
+from services.content_index import duplicate_groups, fast_hash, find_local_copy
+from services.library_search import search_library
+from services.search_history import SearchHistoryWriter, backfill_query_stats
+from services.video_metadata import VideoMetadataStore, parse_video_url
+from services.suggest_index import SuggestIndex
+from services.ytdlp_pool import YtDlpPool, YtDlpError
+from services.stream_url_cache import StreamUrlCache
+from services.relay import AudioRelay, RelayError
+from services.prefetcher import Prefetcher
+from services.song_resolver import SongResolver, merge_duplicate_songs, url_platform
+from services.download_scheduler import DownloadScheduler, PRIORITY_BULK, PRIORITY_USER
+from services.download_progress import DownloadProgress
 import json
+import base64
+import queue
+import time
 from datetime import datetime, UTC
 
 load_dotenv()
 
 app = Flask(__name__)
-CORS(app, resources={r"/*": {"origins": "*"}})
+CORS(app, resources={r"/*": {"origins": "*"}}, expose_headers=['X-Next-Cursor'])
 
 # 数据库配置
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///music_hub.db'
@@ -23,45 +48,207 @@ db.init_app(app)
 
 # 设置默认音乐目录
 app.config.setdefault('MUSIC_DIR', os.path.abspath(os.getenv("MUSIC_DIR", "./music")))
+# 串流回應的瀏覽器快取時間（秒），搭配 ETag / Last-Modified 驗證
+app.config.setdefault('STREAM_CACHE_MAX_AGE', int(os.getenv("STREAM_CACHE_MAX_AGE", "86400")))
+# 轉碼與 HLS 分段快取目錄與容量上限（位元組）
+app.config.setdefault('TRANSCODE_CACHE_DIR', os.path.abspath(os.getenv("TRANSCODE_CACHE_DIR", "./cache/transcode")))
+app.config.setdefault('TRANSCODE_CACHE_MAX_BYTES', int(os.getenv("TRANSCODE_CACHE_MAX_BYTES", str(2 * 1024 ** 3))))
+app.config.setdefault('HLS_SEGMENT_DURATION', int(os.getenv("HLS_SEGMENT_DURATION", "6")))
+# 未啟用檔案系統監看時輪詢音樂目錄的間隔（秒）
+app.config.setdefault('LIBRARY_POLL_INTERVAL', float(os.getenv("LIBRARY_POLL_INTERVAL", "60")))
+# 讀取標籤的工作行程數量（預設為 CPU 核心數）與封面存放目錄
+app.config.setdefault('LIBRARY_SCAN_WORKERS', int(os.getenv("LIBRARY_SCAN_WORKERS", "0")) or None)
+app.config.setdefault('COVER_DIR', os.path.abspath(os.getenv("COVER_DIR", "./cache/covers")))
+# /music 分頁的預設與最大每頁數量
+app.config.setdefault('MUSIC_PAGE_SIZE', int(os.getenv("MUSIC_PAGE_SIZE", "200")))
+app.config.setdefault('MUSIC_PAGE_MAX_SIZE', int(os.getenv("MUSIC_PAGE_MAX_SIZE", "1000")))
+app.config.setdefault('VIDEO_METADATA_MAX_AGE', int(os.getenv("VIDEO_METADATA_MAX_AGE", "86400")))
+# 自動完成索引的最大項目數與更新間隔（秒）
+app.config.setdefault('SUGGEST_MAX_ENTRIES', int(os.getenv("SUGGEST_MAX_ENTRIES", "100000")))
+app.config.setdefault('SUGGEST_REFRESH_INTERVAL', float(os.getenv("SUGGEST_REFRESH_INTERVAL", "10")))
+# yt-dlp 工作行程數量與每個工作的時限（秒）；下載使用獨立的行程池，不佔用解析網址的行程
+app.config.setdefault('YTDLP_WORKERS', int(os.getenv("YTDLP_WORKERS", "2")))
+app.config.setdefault('YTDLP_TIMEOUT', float(os.getenv("YTDLP_TIMEOUT", "30")))
+app.config.setdefault('YTDLP_DOWNLOAD_WORKERS', int(os.getenv("YTDLP_DOWNLOAD_WORKERS", "2")))
+app.config.setdefault('YTDLP_DOWNLOAD_TIMEOUT', float(os.getenv("YTDLP_DOWNLOAD_TIMEOUT", "1800")))
+# 下載排程：每個主機同時下載的數量、租約時間（秒）與中斷後重新下載的次數上限
+app.config.setdefault('DOWNLOAD_PER_HOST_LIMIT', int(os.getenv("DOWNLOAD_PER_HOST_LIMIT", "2")))
+app.config.setdefault('DOWNLOAD_LEASE_SECONDS', float(os.getenv("DOWNLOAD_LEASE_SECONDS", "60")))
+app.config.setdefault('DOWNLOAD_MAX_ATTEMPTS', int(os.getenv("DOWNLOAD_MAX_ATTEMPTS", "3")))
+# 下載進度寫入資料庫的最短間隔（秒），即時進度由 /downloads/events 推送
+app.config.setdefault('DOWNLOAD_PROGRESS_PERSIST_INTERVAL', float(os.getenv("DOWNLOAD_PROGRESS_PERSIST_INTERVAL", "5")))
+# 音訊串流網址快取：到期前保留的安全時間、網址沒有 expire 參數時的有效時間（秒）與最大項目數
+app.config.setdefault('STREAM_URL_SAFETY_MARGIN', float(os.getenv("STREAM_URL_SAFETY_MARGIN", "600")))
+app.config.setdefault('STREAM_URL_DEFAULT_TTL', float(os.getenv("STREAM_URL_DEFAULT_TTL", "1800")))
+app.config.setdefault('STREAM_URL_CACHE_SIZE', int(os.getenv("STREAM_URL_CACHE_SIZE", "1024")))
+# /relay 每首歌的記憶體環形緩衝區大小（位元組）、上游連線時限（秒），以及是否將轉送的音訊保存到磁碟快取
+app.config.setdefault('RELAY_BUFFER_BYTES', int(os.getenv("RELAY_BUFFER_BYTES", str(8 * 1024 ** 2))))
+app.config.setdefault('RELAY_TIMEOUT', float(os.getenv("RELAY_TIMEOUT", "30")))
+app.config.setdefault('RELAY_SPILL_TO_DISK', os.getenv("RELAY_SPILL_TO_DISK", "1") != "0")
+# 播放列表預取：預取接下來的歌曲數量、同時預取的數量，以及預先緩衝的音訊開頭大小（位元組）
+app.config.setdefault('PREFETCH_DEPTH', int(os.getenv("PREFETCH_DEPTH", "3")))
+app.config.setdefault('PREFETCH_WORKERS', int(os.getenv("PREFETCH_WORKERS", "2")))
+app.config.setdefault('PREFETCH_HEAD_BYTES', int(os.getenv("PREFETCH_HEAD_BYTES", str(256 * 1024))))
 ALLOWED_EXTENSIONS = ('.mp3', '.flac', '.wav', '.aac', '.m4a', '.mp4', '.mkv', '.avi', '.mov')
 current_process = None
 
-# 创建数据库表
-with app.app_context():
-    db.create_all()
-
 # 初始化服务
+video_metadata = VideoMetadataStore(app, max_age=app.config['VIDEO_METADATA_MAX_AGE'])
 video_search_service = VideoSearchService()
-
-def get_music_files():
-    music_files = []
-    music_dir = app.config['MUSIC_DIR']
-    for ext in ALLOWED_EXTENSIONS:
-        music_files.extend(glob.glob(os.path.join(music_dir, f'*{ext}')))
-    return music_files
+video_search_service.metadata = video_metadata
+search_runtime = AsyncRuntime(name='search-loop')
+search_history_writer = SearchHistoryWriter(
+    app, flush_interval=float(os.getenv('SEARCH_HISTORY_FLUSH_INTERVAL', '2'))
+)
+suggest_index = SuggestIndex(app, max_entries=app.config['SUGGEST_MAX_ENTRIES'],
+                             refresh_interval=app.config['SUGGEST_REFRESH_INTERVAL'])
+ytdlp_pool = YtDlpPool(workers=app.config['YTDLP_WORKERS'], timeout=app.config['YTDLP_TIMEOUT'])
+download_progress = DownloadProgress(app, persist_interval=app.config['DOWNLOAD_PROGRESS_PERSIST_INTERVAL'])
+download_pool = YtDlpPool(workers=app.config['YTDLP_DOWNLOAD_WORKERS'],
+                          timeout=app.config['YTDLP_DOWNLOAD_TIMEOUT'], name='yt-dlp download',
+                          on_progress=download_progress.on_ytdlp_progress)
+download_scheduler = DownloadScheduler(app, lambda download_id: process_download(download_id),
+                                       concurrency=app.config['YTDLP_DOWNLOAD_WORKERS'],
+                                       per_host=app.config['DOWNLOAD_PER_HOST_LIMIT'],
+                                       lease_seconds=app.config['DOWNLOAD_LEASE_SECONDS'],
+                                       max_attempts=app.config['DOWNLOAD_MAX_ATTEMPTS'])
+stream_url_cache = StreamUrlCache(max_entries=app.config['STREAM_URL_CACHE_SIZE'],
+                                  safety_margin=app.config['STREAM_URL_SAFETY_MARGIN'],
+                                  default_ttl=app.config['STREAM_URL_DEFAULT_TTL'])
+song_resolver = SongResolver(app, fetch_info=lambda platform, video_id, url: get_youtube_info(url))
+file_info_cache = FileInfoCache()
+media_cache = DiskCache(app.config['TRANSCODE_CACHE_DIR'], app.config['TRANSCODE_CACHE_MAX_BYTES'])
+transcoder = Transcoder(media_cache)
+hls_segmenter = HlsSegmenter(media_cache, segment_duration=app.config['HLS_SEGMENT_DURATION'])
+audio_relay = AudioRelay(media_cache if app.config['RELAY_SPILL_TO_DISK'] else None,
+                         buffer_bytes=app.config['RELAY_BUFFER_BYTES'], timeout=app.config['RELAY_TIMEOUT'])
+prefetcher = Prefetcher(lambda song, job: prefetch_song(song, job),
+                        release=lambda song: audio_relay.cancel(relay_key(song)),
+                        depth=app.config['PREFETCH_DEPTH'], workers=app.config['PREFETCH_WORKERS'])
+library_indexer = LibraryIndexer(app, ALLOWED_EXTENSIONS,
+                                 cover_dir=app.config['COVER_DIR'],
+                                 workers=app.config['LIBRARY_SCAN_WORKERS'],
+                                 poll_interval=app.config['LIBRARY_POLL_INTERVAL'])
+
+# /music 可用的排序欄位
+MUSIC_SORT_COLUMNS = {
+    'id': Song.id,
+    'title': Song.title,
+    'artist': Song.artist,
+    'added': Song.created_at,
+}
+
+def encode_cursor(value, song_id):
+    """將排序值與歌曲 ID 編碼為不透明的分頁游標"""
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([value, song_id], ensure_ascii=False).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor, sort_key):
+    raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+    value, song_id = json.loads(raw)
+    if sort_key == 'added' and value is not None:
+        value = datetime.fromisoformat(value)
+    return value, int(song_id)
 
 @app.route('/music')
 def list_music():
-    music_files = get_music_files()
-    print(f"Found music files: {music_files}")  # 添加调试信息
-    
-    # 将本地音乐文件同步到数据库
-    with app.app_context():
-        for file_path in music_files:
-            filename = os.path.basename(file_path)
-            existing_song = Song.query.filter_by(local_path=file_path).first()
-            if not existing_song:
-                new_song = Song(
-                    title=filename,
-                    source='local',
-                    local_path=file_path
-                )
-                db.session.add(new_song)
-        db.session.commit()
-        
-        # 返回所有本地音乐
-        local_songs = Song.query.filter_by(source='local').all()
-        return jsonify([song.to_dict() for song in local_songs])
+    """分頁獲取本地音樂
+
+    參數：limit 每頁數量、after 上一頁回傳的游標（依 ID 排序時即為歌曲 ID）、
+    sort 排序欄位（id/title/artist/added，前綴 - 表示倒序）、fields 回傳的欄位。
+    下一頁的游標放在 X-Next-Cursor 標頭中。
+    """
+    # 本地音樂由背景索引器同步到資料庫，這裡只讀取資料庫
+    sort = request.args.get('sort', 'id')
+    descending = sort.startswith('-')
+    sort_key = sort.lstrip('-')
+    if sort_key not in MUSIC_SORT_COLUMNS:
+        return jsonify({"error": f"Invalid sort field: {sort_key}"}), 400
+
+    fields = request.args.get('fields')
+    fields = [f.strip() for f in fields.split(',') if f.strip()] if fields else list(Song.DICT_FIELDS)
+    invalid = [f for f in fields if f not in Song.DICT_FIELDS]
+    if invalid:
+        return jsonify({"error": f"Invalid fields: {', '.join(invalid)}"}), 400
+
+    try:
+        limit = int(request.args.get('limit', app.config['MUSIC_PAGE_SIZE']))
+        after = request.args.get('after')
+        if after is None:
+            cursor = None
+        elif sort_key == 'id':
+            cursor = (int(after), int(after))
+        else:
+            cursor = decode_cursor(after, sort_key)
+    except (ValueError, TypeError):
+        return jsonify({"error": "Invalid limit or cursor"}), 400
+    limit = max(1, min(limit, app.config['MUSIC_PAGE_MAX_SIZE']))
+
+    column = MUSIC_SORT_COLUMNS[sort_key]
+    # 只查詢需要的欄位，另外加上產生游標所需的排序欄位與 ID
+    columns = [getattr(Song, f) for f in fields]
+    query = db.session.query(*columns, Song.id.label('_cursor_id'), column.label('_cursor_value')) \
+        .filter(Song.source == 'local')
+
+    if cursor is not None:
+        value, last_id = cursor
+        # 鍵集分頁：SQLite 排序時 NULL 視為最小值
+        if not descending:
+            if value is None:
+                query = query.filter(or_(and_(column.is_(None), Song.id > last_id), column.isnot(None)))
+            else:
+                query = query.filter(or_(column > value, and_(column == value, Song.id > last_id)))
+        else:
+            if value is None:
+                query = query.filter(column.is_(None), Song.id < last_id)
+            else:
+                query = query.filter(or_(column < value, and_(column == value, Song.id < last_id),
+                                         column.is_(None)))
+
+    if sort_key == 'id':
+        order = [Song.id.desc() if descending else Song.id]
+    else:
+        order = [column.desc(), Song.id.desc()] if descending else [column, Song.id]
+    rows = query.order_by(*order).limit(limit + 1).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    response = jsonify([{f: getattr(row, f) for f in fields} for row in rows])
+    if has_more:
+        last = rows[-1]
+        next_cursor = str(last._cursor_id) if sort_key == 'id' else encode_cursor(last._cursor_value, last._cursor_id)
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
+@app.route('/library/scan', methods=['GET'])
+def get_scan_progress():
+    """獲取音樂庫掃描進度與速度"""
+    return jsonify(library_indexer.progress)
+
+@app.route('/library/scan', methods=['POST'])
+def start_library_scan():
+    """要求重新掃描音樂庫"""
+    library_indexer.request_scan()
+    return jsonify(library_indexer.progress), 202
+
+@app.route('/library/duplicates')
+def list_duplicates():
+    """列出內容相同的重複歌曲"""
+    try:
+        limit = int(request.args.get('limit', 100))
+        return jsonify(duplicate_groups(limit=limit))
+    except ValueError:
+        return jsonify({"error": "Invalid limit"}), 400
+    except Exception as e:
+        return jsonify({"error": f"Failed to get duplicates: {str(e)}"}), 500
+
+@app.route('/covers/<path:name>')
+def get_cover(name):
+    """獲取從音樂檔案中擷取的封面"""
+    return send_from_directory(app.config['COVER_DIR'], name,
+                               max_age=app.config['STREAM_CACHE_MAX_AGE'])
 
 @app.route('/play', methods=['POST'])
 def play_music():
@@ -80,6 +267,11 @@ def play_music():
     print(f"play_music: full_path={full_path}")
     return jsonify({"audioUrl": f"/stream/{filename}"}), 200
 
+def resolve_audio(url, format_spec='bestaudio'):
+    """解析線上影片的音訊串流網址，同一部影片的不同網址形式共用快取"""
+    key = (parse_video_url(url) or ('url', url.strip()), format_spec)
+    return stream_url_cache.get(key, lambda: ytdlp_pool.audio_url(url, format_spec))
+
 @app.route('/play_youtube', methods=['POST'])
 def play_youtube():
     data = request.get_json()
@@ -88,16 +280,119 @@ def play_youtube():
 
     url = data['url']
     try:
-       command = ['yt-dlp', '-f', 'bestaudio', '-g', url]
-       process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-       stdout, stderr = process.communicate()
-       if stderr:
-           return jsonify({"error": f"Error getting audio url from youtube: {stderr.decode()}"}), 500
-       audio_url = stdout.decode().strip()
-       return jsonify({"audioUrl": audio_url}), 200
+        try:
+            audio = resolve_audio(url)
+        except YtDlpError as e:
+            return jsonify({"error": f"Error getting audio url from youtube: {str(e)}"}), 500
+        return jsonify({"audioUrl": audio['url']}), 200
     except Exception as e:
         return jsonify({"error": f"Error processing youtube: {str(e)}"}), 500
 
+@app.route('/play_youtube/cache')
+def get_stream_url_cache_stats():
+    """獲取音訊串流網址快取的命中統計與節省的解析時間"""
+    return jsonify(stream_url_cache.stats())
+
+def relay_key(song):
+    """歌曲在 /relay 使用的轉送與快取鍵"""
+    return f"{song['source']}:{song['source_id'] or song['url']}:bestaudio"
+
+@app.route('/relay/<int:song_id>')
+def relay_song(song_id):
+    """經由伺服器轉送線上歌曲的音訊，同一首歌的所有收聽者共用一個上游連線"""
+    song = db.session.get(Song, song_id)
+    if song is None or not song.url:
+        return jsonify({"error": "Song not found"}), 404
+    url = song.url
+    key = relay_key(song.to_dict())
+    max_age = app.config['STREAM_CACHE_MAX_AGE']
+
+    # 已轉送完成的歌曲直接以本地檔案回應
+    cached = audio_relay.cached(key)
+    if cached:
+        path, mimetype = cached
+        return send_file(path, mimetype=mimetype, conditional=True, max_age=max_age)
+
+    try:
+        session = audio_relay.open(key, lambda: resolve_audio(url))
+    except YtDlpError as e:
+        return jsonify({"error": f"Error getting audio url: {str(e)}"}), 502
+    except Exception as e:
+        print(f"relay_song: Error starting relay: {str(e)}")
+        return jsonify({"error": f"Error starting relay: {str(e)}"}), 500
+
+    if not session.wait_ready(app.config['RELAY_TIMEOUT']):
+        return jsonify({"error": "Upstream did not respond"}), 504
+    if session.error and not session.received:
+        return jsonify({"error": f"Upstream error: {session.error}"}), 502
+
+    # 只有上游提供長度時才能回應 Range 請求
+    start, stop, status = 0, session.length, 200
+    byte_range = request.range if session.length is not None else None
+    if byte_range is not None:
+        span = byte_range.range_for_length(session.length)
+        if span is None:
+            response = app.response_class(status=416)
+            response.headers['Content-Range'] = f"bytes */{session.length}"
+            return response
+        start, stop = span
+        status = 206
+    if start < session.available_from():
+        # 沒有磁碟快取且環形緩衝區已覆蓋請求的開頭，等這次轉送結束後重新轉送才能讀取
+        response = jsonify({"error": "Relay buffer exceeded, retry later"})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+
+    def generate():
+        try:
+            yield from session.iter_chunks(start, stop)
+        except RelayError as e:
+            print(f"relay_song: {str(e)}")
+
+    response = app.response_class(generate(), status=status, mimetype=session.mimetype)
+    if stop is not None:
+        response.headers['Content-Length'] = str(stop - start)
+        response.headers['Accept-Ranges'] = 'bytes'
+    if status == 206:
+        response.headers['Content-Range'] = f"bytes {start}-{stop - 1}/{session.length}"
+    return response
+
+@app.route('/relay/stats')
+def get_relay_stats():
+    """獲取音訊轉送的連線與收聽者統計"""
+    return jsonify(audio_relay.stats())
+
+def prefetch_song(song, job):
+    """預先準備即將播放的歌曲：本地檔案讀入開頭，線上歌曲解析網址、緩衝開頭的音訊並取得影片資訊"""
+    head_bytes = app.config['PREFETCH_HEAD_BYTES']
+    if song['local_path']:
+        if file_info_cache.get(song['local_path']):
+            with open(song['local_path'], 'rb') as f:
+                f.read(head_bytes)
+        return
+    if not song['url']:
+        return
+
+    audio = resolve_audio(song['url'])
+    job.check()
+    # 沒有磁碟快取時，轉送的開頭會被環形緩衝區覆蓋，只預先解析網址
+    key = relay_key(song)
+    if audio_relay.cache is not None and not audio_relay.cached(key):
+        session = audio_relay.open(key, lambda: audio)
+        for _ in session.iter_chunks(0, head_bytes):
+            if job.cancelled:
+                break
+        if job.cancelled:
+            audio_relay.cancel(key)
+        job.check()
+    if song['source'] == 'youtube':
+        get_youtube_info(song['url'])
+
+@app.route('/prefetch/stats')
+def get_prefetch_stats():
+    """獲取播放列表預取的統計"""
+    return jsonify(prefetcher.stats())
+
 @app.route('/stop', methods=['POST'])
 def stop_music():
     global current_process
@@ -111,39 +406,96 @@ def stop_music():
 
 @app.route('/stream/<path:filename>')
 def stream_music(filename):
-    full_path = os.path.join(app.config['MUSIC_DIR'], filename)
+    full_path = safe_join(app.config['MUSIC_DIR'], filename)
     print(f"stream_music: full_path={full_path}")
-    if not os.path.exists(full_path):
+    info = file_info_cache.get(full_path) if full_path else None
+    if info is None:
         print(f"stream_music: File not found at {full_path}")
         return jsonify({"error": "File not found"}), 404
+
+    quality = request.args.get('quality')
+    if quality and quality not in TRANSCODE_PRESETS:
+        return jsonify({"error": f"Unsupported quality: {quality}"}), 400
+
     try:
-        with open(full_path, 'rb') as f:
-            data = f.read()
-        print(f"stream_music: Read file length: {len(data)}")
-        mimetype = 'audio/mpeg'  # default
-        if filename.lower().endswith(('.flac', '.ogg')):
-            mimetype = 'audio/flac'
-        elif filename.lower().endswith('.wav'):
-             mimetype = 'audio/wav'
-        elif filename.lower().endswith('.aac'):
-             mimetype = 'audio/aac'
-        elif filename.lower().endswith('.m4a'):
-             mimetype = 'audio/mp4'
-        elif filename.lower().endswith('.mp4'):
-             mimetype = 'audio/mp4'
-        elif filename.lower().endswith('.mkv'):
-             mimetype = 'audio/x-matroska'
-        elif filename.lower().endswith('.avi'):
-             mimetype = 'video/avi'
-        elif filename.lower().endswith('.mov'):
-             mimetype = 'video/quicktime'
-
-        print(f"stream_music: mimetype={mimetype}")
-        return send_file(io.BytesIO(data), mimetype=mimetype)
+        max_age = app.config['STREAM_CACHE_MAX_AGE']
+        etag = f"{info.etag}-{quality}" if quality else info.etag
+        # 客戶端已有相同版本時直接回傳 304，只需一次 stat 而不必開啟檔案
+        if not is_resource_modified(request.environ, etag=etag, last_modified=info.last_modified):
+            response = app.response_class(status=304)
+            response.set_etag(etag)
+            response.last_modified = info.last_modified
+            response.cache_control.public = True
+            response.cache_control.max_age = max_age
+            return response
+
+        if quality:
+            return stream_transcoded(full_path, info, quality, etag, max_age)
+
+        print(f"stream_music: mimetype={info.mimetype}")
+        # 直接以檔案路徑回應：支援 Range (206) 請求，並透過 wsgi.file_wrapper
+        # (sendfile) 或分塊讀取傳送，每個連線的記憶體用量與檔案大小無關
+        return send_file(full_path, mimetype=info.mimetype, conditional=True,
+                         etag=etag, last_modified=info.last_modified, max_age=max_age)
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"stream_music: Error reading file: {str(e)}")
         return jsonify({"error": f"Error reading file: {str(e)}"}), 500
 
+def stream_transcoded(full_path, info, quality, etag, max_age):
+    """串流轉碼後的變體：已快取時直接送出檔案，否則邊轉碼邊傳送"""
+    mimetype = TRANSCODE_PRESETS[quality]['mimetype']
+    cached_path, job = transcoder.open(full_path, info.size, info.mtime_ns, quality)
+    if cached_path:
+        return send_file(cached_path, mimetype=mimetype, conditional=True,
+                         etag=etag, last_modified=info.last_modified, max_age=max_age)
+
+    print(f"stream_music: transcoding {full_path} to {quality}")
+    # 轉碼中的回應不帶 ETag 與 Last-Modified：轉碼中途失敗時內容不完整，
+    # 客戶端不能之後以 304 沿用；變體完成並保存到快取後的回應才帶驗證資訊
+    return app.response_class(job.iter_chunks(), mimetype=mimetype)
+
+@app.route('/hls/<int:song_id>/index.m3u8')
+def hls_playlist(song_id):
+    """取得本地歌曲的 HLS 播放清單"""
+    song = db.session.get(Song, song_id)
+    info = file_info_cache.get(song.local_path) if song and song.local_path else None
+    if info is None:
+        return jsonify({"error": "Song not found"}), 404
+    try:
+        playlist = hls_segmenter.playlist(song.local_path, info.size, info.mtime_ns)
+        response = app.response_class(playlist, mimetype='application/vnd.apple.mpegurl')
+        response.set_etag(info.etag)
+        return response.make_conditional(request)
+    except Exception as e:
+        print(f"hls_playlist: Error probing file: {str(e)}")
+        return jsonify({"error": f"Error creating playlist: {str(e)}"}), 500
+
+@app.route('/hls/<int:song_id>/<int:index>.ts')
+def hls_segment(song_id, index):
+    """取得 HLS 分段，尚未產生時即時產生"""
+    song = db.session.get(Song, song_id)
+    info = file_info_cache.get(song.local_path) if song and song.local_path else None
+    if info is None:
+        return jsonify({"error": "Song not found"}), 404
+    try:
+        segment_path = hls_segmenter.segment(song.local_path, info.size, info.mtime_ns, index)
+        return send_file(segment_path, mimetype='video/mp2t', conditional=True,
+                         max_age=app.config['STREAM_CACHE_MAX_AGE'])
+    except IndexError:
+        return jsonify({"error": "Segment not found"}), 404
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"hls_segment: Error creating segment: {str(e)}")
+        return jsonify({"error": f"Error creating segment: {str(e)}"}), 500
+
+def record_search(query):
+    """記錄搜索歷史並加入自動完成索引，搜索歷史由背景執行緒批次寫入，不阻塞搜索"""
+    search_history_writer.record(query)
+    suggest_index.record_query(query)
+
 @app.route('/search')
 def search_videos():
     query = request.args.get('q')
@@ -151,23 +503,121 @@ def search_videos():
         return jsonify({"error": "Query parameter 'q' is required"}), 400
 
     try:
-        # 使用 asyncio 运行异步搜索
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        results = loop.run_until_complete(video_search_service.search_all(query))
-        loop.close()
+        record_search(query)
+
+        # 在長期運行的事件循環中執行搜索，重複使用已建立的連線
+        results = search_runtime.run(video_search_service.search_all(query))
         return jsonify(results)
     except Exception as e:
         return jsonify({"error": f"Search failed: {str(e)}"}), 500
 
+def sse_event(event, data):
+    """格式化一個 Server-Sent Events 事件"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.route('/search/stream')
+def search_videos_stream():
+    """以 Server-Sent Events 串流搜索結果
+
+    每個平台完成時送出一個 results 事件（platform、results、status），
+    所有平台完成後送出 done 事件（各平台狀態、結果數量與合併排序的結果）。
+    """
+    query = request.args.get('q')
+    if not query:
+        return jsonify({"error": "Query parameter 'q' is required"}), 400
+
+    record_search(query)
+    events = queue.Queue()
+    started = time.monotonic()
+
+    def on_result(platform, results, status):
+        events.put(sse_event('results', {'platform': platform, 'results': results, 'status': status}))
+
+    future = search_runtime.submit(video_search_service.search_each(query, on_result))
+    future.add_done_callback(lambda f: events.put(None))
+    # 各平台都有自己的時限，這裡只是避免連線永遠等待
+    wait_timeout = max(video_search_service.youtube_timeout, video_search_service.bilibili_timeout) + 10
+
+    def generate():
+        while True:
+            try:
+                item = events.get(timeout=wait_timeout)
+            except queue.Empty:
+                yield sse_event('error', {'error': 'Search timed out'})
+                return
+            if item is None:
+                break
+            yield item
+        try:
+            results = future.result()
+        except Exception as e:
+            print(f"Error in search_videos_stream: {str(e)}")
+            yield sse_event('error', {'error': f"Search failed: {str(e)}"})
+            return
+        yield sse_event('done', {
+            'status': results['status'],
+            'counts': {platform: len(results[platform]) for platform in results['status']},
+            'merged': results['merged'],
+            'elapsed': round(time.monotonic() - started, 3)
+        })
+
+    return app.response_class(generate(), mimetype='text/event-stream',
+                              headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/search/local')
+def search_local():
+    """以全文索引搜索本地歌曲與播放列表，支援前綴比對與中日韓文字"""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({"error": "Query parameter 'q' is required"}), 400
+    try:
+        limit = max(1, min(int(request.args.get('limit', 50)), 200))
+    except ValueError:
+        return jsonify({"error": "Invalid limit"}), 400
+
+    try:
+        return jsonify(search_library(query, limit=limit))
+    except Exception as e:
+        print(f"Error in search_local: {str(e)}")
+        return jsonify({"error": f"Local search failed: {str(e)}"}), 500
+
+@app.route('/search/suggest')
+def search_suggest():
+    """依前綴回傳自動完成建議，來源為搜索歷史與曲庫中的標題及歌手"""
+    prefix = request.args.get('prefix', '')
+    try:
+        limit = max(1, min(int(request.args.get('limit', 10)), 50))
+    except ValueError:
+        return jsonify({"error": "Invalid limit"}), 400
+    suggest_index.refresh_if_due()
+    return jsonify(suggest_index.suggest(prefix, limit=limit))
+
+@app.route('/search/cache')
+def get_search_cache_stats():
+    """獲取搜索結果快取的命中統計"""
+    return jsonify(video_search_service.cache_stats())
+
 @app.route('/search/history')
 def get_search_history():
+    """獲取搜索歷史，預設依最後搜索時間排序，sort=popular 時依搜索次數排序"""
     try:
-        history = db.session.query(SearchHistory).order_by(SearchHistory.created_at.desc()).limit(10).all()
+        limit = max(1, min(int(request.args.get('limit', 10)), 100))
+    except ValueError:
+        return jsonify({"error": "Invalid limit"}), 400
+
+    try:
+        query = db.session.query(SearchQueryStat)
+        if request.args.get('sort') == 'popular':
+            query = query.order_by(SearchQueryStat.count.desc(), SearchQueryStat.last_seen.desc())
+        else:
+            query = query.order_by(SearchQueryStat.last_seen.desc())
+        # created_at 保留舊版回應的欄位，為該查詢最後一次搜索的時間
         result = [{
-            'query': h.query,
-            'created_at': h.created_at.isoformat()
-        } for h in history]
+            'query': stat.display or stat.query,
+            'created_at': stat.last_seen.isoformat(),
+            'count': stat.count,
+            'last_seen': stat.last_seen.isoformat()
+        } for stat in query.limit(limit)]
         return jsonify(result)
     except Exception as e:
         import traceback
@@ -237,6 +687,37 @@ def get_playlist(playlist_id):
     except Exception as e:
         return jsonify({"error": f"Failed to get playlist: {str(e)}"}), 500
 
+@app.route('/playlists/<int:playlist_id>/now_playing', methods=['POST'])
+def playlist_now_playing(playlist_id):
+    """通知播放列表開始播放某首歌，在背景預取接下來的歌曲；repeat 為真時播放到結尾後從頭預取"""
+    data = request.get_json(silent=True) or {}
+    if 'song_id' not in data:
+        return jsonify({"error": "song_id is required"}), 400
+
+    try:
+        playlist = db.session.get(Playlist, playlist_id)
+        if not playlist:
+            return jsonify({"error": "Playlist not found"}), 404
+
+        # 與 GET /playlists/<id> 相同的歌曲順序
+        songs = [song.to_dict() for song in playlist.songs]
+        ids = [song['id'] for song in songs]
+        if data['song_id'] not in ids:
+            return jsonify({"error": "Song not in playlist"}), 404
+
+        index = ids.index(data['song_id'])
+        upcoming = songs[index + 1:]
+        if data.get('repeat'):
+            upcoming += songs[:index]
+        scheduled = prefetcher.now_playing(playlist_id, upcoming, current_id=data['song_id'])
+        return jsonify({
+            "song_id": data['song_id'],
+            "upcoming": [song['id'] for song in upcoming[:prefetcher.depth]],
+            "prefetching": scheduled
+        }), 202
+    except Exception as e:
+        return jsonify({"error": f"Failed to prefetch playlist: {str(e)}"}), 500
+
 @app.route('/playlists/<int:playlist_id>', methods=['DELETE'])
 def delete_playlist(playlist_id):
     """刪除指定的播放列表"""
@@ -252,6 +733,32 @@ def delete_playlist(playlist_id):
         db.session.rollback()
         return jsonify({"error": f"Failed to delete playlist: {str(e)}"}), 500
 
+def get_youtube_info(url):
+    """取得 YouTube 影片資訊，保存的資訊未過期時不執行 yt-dlp"""
+    parsed = parse_video_url(url)
+    if parsed and parsed[0] == 'youtube':
+        stored = video_metadata.get(*parsed)
+        if stored:
+            return stored
+
+    info = ytdlp_pool.extract_info(url)
+    print(f"Video info: {info.get('id')} {info.get('title')}")
+    return video_metadata.put_ytdlp_info('youtube', info)
+
+def ensure_song_response(url, bilibili_message):
+    """依網址取得或建立歌曲，失敗時回傳錯誤回應"""
+    if url_platform(url) == 'bilibili':
+        # TODO: 實現 Bilibili 視頻信息獲取
+        return jsonify({"error": bilibili_message}), 501
+    try:
+        song_id = song_resolver.ensure_song(url)
+    except ValueError:
+        return jsonify({"error": "Unsupported URL"}), 400
+    except RuntimeError as e:
+        print(f"Error getting video info: {str(e)}")
+        return jsonify({"error": "Failed to get video info"}), 500
+    return db.session.get(Song, song_id)
+
 @app.route('/playlists/<int:playlist_id>/songs', methods=['POST'])
 def add_song_to_playlist(playlist_id):
     """添加歌曲到播放列表"""
@@ -270,44 +777,15 @@ def add_song_to_playlist(playlist_id):
             if not song:
                 return jsonify({"error": "Song not found"}), 404
         else:
-            # 從 URL 創建新歌曲
-            url = data['url']
-            existing_song = db.session.query(Song).filter_by(url=url).first()
-            if existing_song:
-                song = existing_song
-            else:
-                # 獲取視頻信息
-                if 'youtube.com' in url or 'youtu.be' in url:
-                    command = ['yt-dlp', '--dump-json', url]
-                    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                    stdout, stderr = process.communicate()
-                    if stderr:
-                        print(f"Error getting video info: {stderr.decode()}")
-                        return jsonify({"error": "Failed to get video info"}), 500
-                    
-                    try:
-                        info = json.loads(stdout.decode())
-                        print(f"Video info: {info}")
-                        song = Song(
-                            title=info['title'],
-                            source='youtube',
-                            source_id=info['id'],
-                            thumbnail_url=info.get('thumbnail'),
-                            duration=info.get('duration'),
-                            url=url
-                        )
-                    except Exception as e:
-                        print(f"Error parsing video info: {str(e)}")
-                        return jsonify({"error": f"Error parsing video info: {str(e)}"}), 500
-                elif 'bilibili.com' in url:
-                    # TODO: 實現 Bilibili 視頻信息獲取
-                    return jsonify({"error": "Bilibili support coming soon"}), 501
-                else:
-                    return jsonify({"error": "Unsupported URL"}), 400
-
-                db.session.add(song)
-                
-        playlist.songs.append(song)
+            # 從 URL 取得或創建歌曲
+            response = ensure_song_response(data['url'], "Bilibili support coming soon")
+            if not isinstance(response, Song):
+                return response
+            song = response
+
+        # 歌曲已在播放列表中時不重複添加
+        if not playlist.songs.filter(Song.id == song.id).first():
+            playlist.songs.append(song)
         db.session.commit()
         
         return jsonify(song.to_dict())
@@ -341,6 +819,43 @@ def remove_song_from_playlist(playlist_id, song_id):
         db.session.rollback()
         return jsonify({"error": f"Failed to remove song from playlist: {str(e)}"}), 500
 
+@app.route('/playlists/<int:playlist_id>/download', methods=['POST'])
+def download_playlist(playlist_id):
+    """將播放列表中尚未下載的歌曲加入下載隊列，優先順序低於個別加入的下載"""
+    try:
+        playlist = db.session.get(Playlist, playlist_id)
+        if not playlist:
+            return jsonify({"error": "Playlist not found"}), 404
+
+        queued_ids = {song_id for (song_id,) in db.session.query(DownloadQueue.song_id).filter(
+            DownloadQueue.status.in_(['pending', 'downloading'])
+        )}
+        downloads = []
+        skipped = 0
+        for song in playlist.songs:
+            if song.local_path or not song.url or song.id in queued_ids or \
+                    find_local_copy(song.title, song.duration, song.source, song.source_id):
+                skipped += 1
+                continue
+            download = DownloadQueue(song=song, status='pending', priority=PRIORITY_BULK)
+            db.session.add(download)
+            downloads.append(download)
+            queued_ids.add(song.id)
+        db.session.commit()
+        for download in downloads:
+            download_progress.update(download.id, 'pending', song_id=download.song_id)
+        download_scheduler.wake()
+
+        return jsonify({
+            'playlist_id': playlist.id,
+            'queued': len(downloads),
+            'skipped': skipped,
+            'download_ids': [download.id for download in downloads]
+        })
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": f"Failed to queue playlist download: {str(e)}"}), 500
+
 @app.route('/playlists/import', methods=['POST'])
 def import_playlist():
     """導入 YouTube 或 Bilibili 播放列表"""
@@ -352,42 +867,42 @@ def import_playlist():
         url = data['url']
         if 'youtube.com/playlist' in url:
             # 獲取 YouTube 播放列表信息
-            command = ['yt-dlp', '--dump-json', '--flat-playlist', url]
-            process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            stdout, stderr = process.communicate()
-            if stderr:
-                print(f"Error getting playlist info: {stderr.decode()}")
+            try:
+                playlist_info = ytdlp_pool.extract_info(url, flat=True)
+            except YtDlpError as e:
+                print(f"Error getting playlist info: {str(e)}")
                 return jsonify({"error": "Failed to get playlist info"}), 500
 
             try:
+                # 以 (source, source_id) 批次寫入歌曲，已存在的歌曲直接使用
+                entries = []
+                for info in playlist_info.get('entries') or []:
+                    if not info or not info.get('id'):
+                        continue
+                    print(f"Song info: {info.get('id')} {info.get('title')}")
+                    thumbnails = info.get('thumbnails') or []
+                    entries.append({
+                        'video_id': info['id'],
+                        'title': info.get('title'),
+                        'thumbnail_url': info.get('thumbnail') or (thumbnails[-1]['url'] if thumbnails else None),
+                        'duration': info.get('duration')
+                    })
+                song_ids = song_resolver.upsert('youtube', entries)
+
                 # 創建播放列表
                 playlist = Playlist(
                     name=data['name'],
                     description=data.get('description', '')
                 )
                 db.session.add(playlist)
-
-                # 添加歌曲
-                for line in stdout.decode().split('\n'):
-                    if not line:
-                        continue
-                    try:
-                        info = json.loads(line)
-                        print(f"Song info: {info}")
-                        song = Song(
-                            title=info['title'],
-                            source='youtube',
-                            source_id=info['id'],
-                            thumbnail_url=info.get('thumbnail'),
-                            duration=info.get('duration'),
-                            url=f"https://www.youtube.com/watch?v={info['id']}"
-                        )
-                        db.session.add(song)
-                        playlist.songs.append(song)
-                    except Exception as e:
-                        print(f"Error processing song: {str(e)}")
-                        continue
-
+                db.session.flush()
+
+                # 添加歌曲，同一首歌在播放列表中只出現一次
+                ordered_ids = dict.fromkeys(song_ids[entry['video_id']] for entry in entries)
+                if ordered_ids:
+                    db.session.execute(playlist_songs.insert(), [
+                        {'playlist_id': playlist.id, 'song_id': song_id} for song_id in ordered_ids
+                    ])
                 db.session.commit()
                 return jsonify({
                     'id': playlist.id,
@@ -411,15 +926,28 @@ def import_playlist():
         db.session.rollback()
         return jsonify({"error": f"Failed to import playlist: {str(e)}"}), 500
 
+def download_progress_field(download):
+    """下載的進度百分比：進行中的下載使用記憶體中的即時進度，其餘使用資料庫中保存的值"""
+    live = download_progress.get(download.id)
+    if live and 'percent' in live:
+        return live['percent']
+    return 100.0 if download.status == 'completed' else download.progress
+
 @app.route('/downloads', methods=['GET'])
 def list_downloads():
     """獲取下載隊列"""
     try:
-        downloads = db.session.query(DownloadQueue).order_by(DownloadQueue.created_at.desc()).all()
+        # 一次載入所有歌曲，避免每筆下載各查詢一次
+        downloads = db.session.query(DownloadQueue) \
+            .options(joinedload(DownloadQueue.song)) \
+            .order_by(DownloadQueue.created_at.desc()) \
+            .all()
         return jsonify([{
             'id': d.id,
             'song': d.song.to_dict(),
             'status': d.status,
+            'priority': d.priority,
+            'progress': download_progress_field(d),
             'created_at': d.created_at.isoformat(),
             'completed_at': d.completed_at.isoformat() if d.completed_at else None,
             'error_message': d.error_message
@@ -440,33 +968,22 @@ def add_download():
             if not song:
                 return jsonify({"error": "Song not found"}), 404
         else:
-            # 從 URL 創建新歌曲
-            url = data['url']
-            existing_song = db.session.query(Song).filter_by(url=url).first()
-            if existing_song:
-                song = existing_song
-            else:
-                if 'youtube.com' in url or 'youtu.be' in url:
-                    command = ['yt-dlp', '--dump-json', url]
-                    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                    stdout, stderr = process.communicate()
-                    if stderr:
-                        return jsonify({"error": "Failed to get video info"}), 500
-
-                    info = json.loads(stdout.decode())
-                    song = Song(
-                        title=info['title'],
-                        source='youtube',
-                        source_id=info['id'],
-                        thumbnail_url=info.get('thumbnail'),
-                        duration=info.get('duration'),
-                        url=url
-                    )
-                    db.session.add(song)
-                elif 'bilibili.com' in url:
-                    return jsonify({"error": "Bilibili download not supported yet"}), 501
-                else:
-                    return jsonify({"error": "Unsupported URL"}), 400
+            # 從 URL 取得或創建歌曲
+            response = ensure_song_response(data['url'], "Bilibili download not supported yet")
+            if not isinstance(response, Song):
+                return response
+            song = response
+
+        # 本地已有相同音訊時不必再下載
+        local_copy = find_local_copy(song.title, song.duration, song.source, song.source_id)
+        if local_copy:
+            db.session.commit()
+            return jsonify({
+                'id': None,
+                'song': song.to_dict(),
+                'status': 'skipped',
+                'duplicate_of': local_copy.to_dict()
+            })
 
         # 檢查是否已經在下載隊列中
         existing_download = db.session.query(DownloadQueue).filter_by(song_id=song.id).first()
@@ -476,13 +993,15 @@ def add_download():
         # 創建下載任務
         download = DownloadQueue(
             song=song,
-            status='pending'
+            status='pending',
+            priority=PRIORITY_USER
         )
         db.session.add(download)
         db.session.commit()
+        download_progress.update(download.id, 'pending', song_id=song.id)
 
-        # 啟動下載處理（異步）
-        asyncio.run_coroutine_threadsafe(process_download(download.id), asyncio.get_event_loop())
+        # 通知下載排程器立即選取
+        download_scheduler.wake()
 
         return jsonify({
             'id': download.id,
@@ -494,6 +1013,38 @@ def add_download():
         db.session.rollback()
         return jsonify({"error": f"Failed to add download: {str(e)}"}), 500
 
+@app.route('/downloads/events')
+def download_events():
+    """以 Server-Sent Events 推送下載進度
+
+    連線時送出 snapshot 事件（所有進行中下載的進度），之後每次狀態或進度
+    變更送出 progress 事件，欄位包含 status、phase、downloaded_bytes、
+    total_bytes、speed、eta 與 percent。
+    """
+    subscriber = download_progress.subscribe()
+
+    def generate():
+        try:
+            yield sse_event('snapshot', download_progress.snapshot())
+            while True:
+                try:
+                    event = subscriber.get(timeout=15)
+                except queue.Empty:
+                    # 定期送出註解，讓代理伺服器保持連線並偵測已斷線的客戶端
+                    yield ": keep-alive\n\n"
+                    continue
+                yield sse_event('progress', event)
+        finally:
+            download_progress.unsubscribe(subscriber)
+
+    return app.response_class(generate(), mimetype='text/event-stream',
+                              headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/downloads/scheduler')
+def get_download_scheduler_stats():
+    """獲取下載排程器的執行狀態"""
+    return jsonify(download_scheduler.stats())
+
 @app.route('/downloads/<int:download_id>', methods=['DELETE'])
 def cancel_download(download_id):
     """取消下載任務"""
@@ -507,6 +1058,9 @@ def cancel_download(download_id):
 
         download.status = 'cancelled'
         db.session.commit()
+        download_progress.update(download.id, 'cancelled')
+        # 中止執行中的下載，不等待下載完成
+        download_scheduler.cancel(download.id)
 
         return jsonify({"message": "Download cancelled successfully"})
     except Exception as e:
@@ -518,11 +1072,13 @@ async def process_download(download_id):
     try:
         with app.app_context():
             download = db.session.get(DownloadQueue, download_id)
-            if not download or download.status != 'pending':
+            # 下載排程器選取任務時已改為 downloading
+            if not download or download.status not in ('pending', 'downloading'):
                 return
 
             download.status = 'downloading'
             db.session.commit()
+            download_progress.update(download_id, 'downloading', song_id=download.song_id)
 
             song = download.song
             if not song.url:
@@ -534,74 +1090,128 @@ async def process_download(download_id):
             # 設置下載選項
             output_template = os.path.join(app.config['MUSIC_DIR'], '%(title)s.%(ext)s')
             if 'youtube.com' in song.url or 'youtu.be' in song.url:
-                command = [
-                    'yt-dlp',
-                    '-f', 'bestaudio',
-                    '-x',  # 提取音頻
-                    '--audio-format', 'mp3',  # 轉換為 mp3
-                    '--audio-quality', '0',  # 最高音質
-                    '-o', output_template,
-                    song.url
-                ]
+                options = {
+                    'format': 'bestaudio',
+                    'outtmpl': output_template,
+                    # 提取音頻並轉換為最高音質的 mp3
+                    'postprocessors': [{
+                        'key': 'FFmpegExtractAudio',
+                        'preferredcodec': 'mp3',
+                        'preferredquality': '0'
+                    }]
+                }
             else:
                 raise ValueError("Unsupported URL type")
 
             # 執行下載
-            process = await asyncio.create_subprocess_exec(
-                *command,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            stdout, stderr = await process.communicate()
-
-            if process.returncode != 0:
-                raise Exception(f"Download failed: {stderr.decode()}")
+            try:
+                info = await download_pool.download_async(song.url, options, progress_key=download_id)
+            except YtDlpError as e:
+                raise Exception(f"Download failed: {str(e)}")
+
+            # 下載期間任務被取消時不更新狀態，並刪除沒有歌曲使用的下載檔案
+            db.session.refresh(download)
+            if download.status != 'downloading':
+                filepath = info.get('filepath')
+                if filepath and os.path.exists(filepath) and \
+                        not db.session.query(Song.id).filter(Song.local_path == filepath).first():
+                    os.remove(filepath)
+                return
 
             # 更新歌曲本地路徑
-            downloaded_files = glob.glob(os.path.join(app.config['MUSIC_DIR'], f"{song.title}.*"))
+            downloaded_files = [info['filepath']] if info.get('filepath') and os.path.exists(info['filepath']) \
+                else glob.glob(os.path.join(app.config['MUSIC_DIR'], f"{glob.escape(song.title)}.*"))
             if downloaded_files:
-                song.local_path = downloaded_files[0]
+                downloaded_path = downloaded_files[0]
+                # 與既有檔案內容相同時刪除新檔案，改用既有檔案
+                content_hash = fast_hash(downloaded_path)
+                duplicate = db.session.query(Song).filter(
+                    Song.content_hash == content_hash,
+                    Song.local_path.isnot(None),
+                    Song.local_path != downloaded_path
+                ).first() if content_hash else None
+                if duplicate and os.path.exists(duplicate.local_path):
+                    os.remove(downloaded_path)
+                    downloaded_path = duplicate.local_path
+                song.local_path = downloaded_path
+                song.content_hash = content_hash
                 download.status = 'completed'
                 download.completed_at = datetime.now(UTC)
             else:
                 raise Exception("Downloaded file not found")
 
             db.session.commit()
+            download_progress.update(download_id, 'completed')
 
     except Exception as e:
         with app.app_context():
             download = db.session.get(DownloadQueue, download_id)
-            if download:
+            if download and download.status != 'cancelled':
                 download.status = 'failed'
                 download.error_message = str(e)
                 db.session.commit()
+                download_progress.update(download_id, 'failed', error_message=str(e))
 
-# 初始化下載處理器
-async def init_download_processor():
-    """初始化下載處理器，處理未完成的下載任務"""
-    try:
-        with app.app_context():
-            pending_downloads = db.session.query(DownloadQueue).filter(
-                DownloadQueue.status.in_(['pending', 'downloading'])
-            ).all()
-            
-            for download in pending_downloads:
-                asyncio.create_task(process_download(download.id))
-    except Exception as e:
-        print(f"Error initializing download processor: {str(e)}")
-
-# 在應用啟動時初始化下載處理器
-def init_app():
+def init_db():
+    """建立資料表並補上新增的欄位與索引"""
     with app.app_context():
-        db.create_all()
-        try:
-            loop = asyncio.get_running_loop()
-        except RuntimeError:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-        loop.create_task(init_download_processor())
+        # 唯一索引建立前先合併重複的歌曲
+        merge_duplicate_songs()
+        sync_schema()
+        backfill_query_stats()
 
-init_app()
+# 應用啟動步驟：匯入 app 不會建立資料表或啟動背景工作，由啟動程式顯式呼叫
+def init_app():
+    init_db()
+    # 在背景建立自動完成索引
+    suggest_index.refresh_if_due()
+
+@app.cli.command('init-db')
+def init_db_command():
+    """建立或更新資料庫結構"""
+    init_db()
+    print('Database initialized')
+
+@app.cli.command('startup-report')
+@click.option('--budget', default=1.0, show_default=True, help='匯入 app 的時間上限（秒）')
+@click.option('--top', default=15, show_default=True, help='列出最慢的模組數量')
+def startup_report_command(budget, top):
+    """以 python -X importtime 量測匯入 app 的時間並列出最慢的模組"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import app'],
+        cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True
+    )
+    # 每行格式：import time: self [us] | cumulative | imported package，套件名稱前的縮排表示巢狀層級
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        modules.append((int(cumulative_us), int(self_us), depth, name.strip()))
+    app_module = next((m for m in modules if m[2] == 0 and m[3] == 'app'), None)
+    if result.returncode != 0 or app_module is None:
+        print(result.stderr)
+        raise SystemExit(1)
+
+    total = app_module[0] / 1e6
+    # 列出 app 直接匯入的模組中最慢的幾個
+    direct = sorted((m for m in modules if m[2] == 1), reverse=True)
+    print(f"{'cumulative':>12} {'self':>10}  module")
+    for cumulative, self_us, _, name in direct[:top]:
+        print(f"{cumulative / 1e3:10.1f}ms {self_us / 1e3:8.1f}ms  {name}")
+    print(f'import app: {total:.3f}s (budget {budget:.3f}s)')
+    if total > budget:
+        raise SystemExit(1)
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=os.getenv("PORT", 5000), debug=True)
+    init_app()
+    app.debug = os.getenv("FLASK_DEBUG", "1") != "0"
+    # debug 模式下 reloader 會啟動兩個行程，只在實際處理請求的子行程中啟動背景索引、yt-dlp 工作行程與下載排程器；
+    # 非 debug 模式只有一個行程，直接啟動
+    if not app.debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        library_indexer.start()
+        ytdlp_pool.warm()
+        # 下載排程器啟動時會接手上次中斷的下載
+        download_scheduler.start()
+    app.run(host='0.0.0.0', port=os.getenv("PORT", 5000), debug=app.debug)
@@ -1,8 +1,33 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import inspect
 from datetime import datetime, UTC
 
 db = SQLAlchemy()
 
+# 新增栏位时既有数据为 NULL，查询需要按默认值排序的栏位：(资料表, 栏位)
+BACKFILL_DEFAULTS = (('download_queue', 'priority'),)
+
+def sync_schema():
+    """建立缺少的資料表，並為既有資料表補上新增的欄位與索引
+
+    SQLite 沒有遷移工具時，db.create_all() 不會修改既有資料表；
+    這裡只處理新增可為空欄位與索引的情況，並為 BACKFILL_DEFAULTS 中的欄位補上預設值。
+    """
+    db.create_all()
+    inspector = inspect(db.engine)
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    column_type = column.type.compile(dialect=db.engine.dialect)
+                    conn.exec_driver_sql(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}')
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+        for table_name, column_name in BACKFILL_DEFAULTS:
+            column = db.metadata.tables[table_name].c[column_name]
+            conn.execute(column.table.update().where(column.is_(None)).values({column: column.default.arg}))
+
 # 播放列表和歌曲的关联表
 playlist_songs = db.Table('playlist_songs',
     db.Column('playlist_id', db.Integer, db.ForeignKey('playlist.id'), primary_key=True),
@@ -19,35 +44,76 @@ class Playlist(db.Model):
                           backref=db.backref('playlists', lazy=True))
 
 class Song(db.Model):
+    # 音乐列表的排序与分页索引
+    __table_args__ = (
+        db.Index('ix_song_source_title', 'source', 'title', 'id'),
+        db.Index('ix_song_source_artist', 'source', 'artist', 'id'),
+        db.Index('ix_song_source_created_at', 'source', 'created_at', 'id'),
+        # 同一平台的同一个视频只保存一首歌曲，本地歌曲的 source_id 为空不受限制
+        db.Index('uq_song_source_source_id', 'source', 'source_id', unique=True),
+    )
+    # to_dict() 输出的字段，也是 /music 的 fields 参数可选择的字段
+    DICT_FIELDS = ('id', 'title', 'artist', 'album', 'duration', 'bitrate', 'source',
+                   'source_id', 'thumbnail_url', 'url', 'local_path')
+
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     artist = db.Column(db.String(200))
+    album = db.Column(db.String(200))
     duration = db.Column(db.Integer)  # 持续时间（秒）
+    bitrate = db.Column(db.Integer)  # 比特率（kbps）
     source = db.Column(db.String(20))  # 'local', 'youtube', 'bilibili'
     source_id = db.Column(db.String(100))  # 对于在线视频，存储视频ID
     thumbnail_url = db.Column(db.String(500))  # 缩略图URL
     url = db.Column(db.String(500))  # 视频URL
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(UTC))
-    local_path = db.Column(db.String(500))  # 本地文件路径（如果已下载）
+    local_path = db.Column(db.String(500), index=True)  # 本地文件路径（如果已下载）
+    file_size = db.Column(db.BigInteger)  # 本地文件大小（字节），供索引器判断文件是否变更
+    file_mtime = db.Column(db.BigInteger)  # 本地文件修改时间（纳秒）
+    content_hash = db.Column(db.String(32), index=True)  # 本地文件的快速内容哈希，用于查找重复文件
     
     def to_dict(self):
-        return {
-            'id': self.id,
-            'title': self.title,
-            'artist': self.artist,
-            'duration': self.duration,
-            'source': self.source,
-            'source_id': self.source_id,
-            'thumbnail_url': self.thumbnail_url,
-            'url': self.url,
-            'local_path': self.local_path
-        }
+        return {field: getattr(self, field) for field in self.DICT_FIELDS}
 
 class SearchHistory(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     query = db.Column(db.String(200), nullable=False)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(UTC))
 
+class SearchQueryStat(db.Model):
+    # 按查询字符串汇总的搜索次数，由搜索历史写入器批量更新
+    id = db.Column(db.Integer, primary_key=True)
+    query = db.Column(db.String(200), nullable=False, unique=True)  # 正规化后的查询字符串
+    display = db.Column(db.String(200))  # 最近一次用户输入的原始查询字符串，用于显示
+    count = db.Column(db.Integer, nullable=False, default=0, index=True)
+    last_seen = db.Column(db.DateTime, index=True)
+
+class VideoMetadata(db.Model):
+    # 在线视频信息的持久缓存，按 (平台, 视频ID) 唯一
+    __table_args__ = (
+        db.UniqueConstraint('platform', 'video_id', name='uq_video_metadata_platform_video_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    platform = db.Column(db.String(20), nullable=False)  # 'youtube', 'bilibili'
+    video_id = db.Column(db.String(100), nullable=False)
+    title = db.Column(db.String(200), nullable=False)
+    duration = db.Column(db.Integer)  # 持续时间（秒）
+    thumbnail_url = db.Column(db.String(500))
+    view_count = db.Column(db.BigInteger)
+    fetched_at = db.Column(db.DateTime, nullable=False)  # 从平台获取信息的时间
+
+    def to_dict(self):
+        return {
+            'platform': self.platform,
+            'video_id': self.video_id,
+            'title': self.title,
+            'duration': self.duration,
+            'thumbnail_url': self.thumbnail_url,
+            'view_count': self.view_count,
+            'fetched_at': self.fetched_at.isoformat()
+        }
+
 class PlayHistory(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     song_id = db.Column(db.Integer, db.ForeignKey('song.id'), nullable=False)
@@ -55,10 +121,22 @@ class PlayHistory(db.Model):
     song = db.relationship('Song', backref=db.backref('play_history', lazy=True))
 
 class DownloadQueue(db.Model):
+    # 下载调度器按状态、优先级（从高到低）与加入顺序选取任务，索引的排序方向与查询一致
+    __table_args__ = (
+        db.Index('ix_download_queue_pending_order', 'status', db.text('priority DESC'), 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     song_id = db.Column(db.Integer, db.ForeignKey('song.id'), nullable=False)
-    status = db.Column(db.String(20), default='pending')  # pending, downloading, completed, failed
+    status = db.Column(db.String(20), default='pending')  # pending, downloading, completed, failed, cancelled
+    priority = db.Column(db.Integer, default=0)  # 数值越大越先下载
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(UTC))
     completed_at = db.Column(db.DateTime)
     error_message = db.Column(db.String(500))
+    lease_owner = db.Column(db.String(100))  # 正在执行下载的调度器
+    lease_expires_at = db.Column(db.DateTime)  # 租约到期后任务回到队列
+    attempts = db.Column(db.Integer, default=0)  # 开始下载的次数
+    progress = db.Column(db.Float)  # 下载进度百分比，由进度追踪器定期写入
+    downloaded_bytes = db.Column(db.BigInteger)
+    total_bytes = db.Column(db.BigInteger)
     song = db.relationship('Song', backref=db.backref('download_queue', lazy=True)) 
\ No newline at end of file
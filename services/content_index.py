@@ -0,0 +1,108 @@
+import hashlib
+import os
+import re
+from typing import Dict, List, Optional
+
+from sqlalchemy import func
+
+from models import db, Song
+
+# 快速雜湊讀取的區塊大小：檔案開頭、中間與結尾各讀一塊
+HASH_CHUNK_SIZE = 256 * 1024
+# 比對本地檔案時允許的長度誤差（秒）
+DURATION_TOLERANCE = 3
+# 線上標題中與歌曲本身無關的括號標記，例如 (Official Video)、【MV】
+TITLE_TAG_PATTERN = re.compile(
+    r'[(\[（【][^)\]）】]*(?:official|video|audio|lyrics?|m/?v|hd|hq|4k|官方|歌詞|歌词|高音質|高音质)'
+    r'[^)\]）】]*[)\]）】]',
+    re.IGNORECASE
+)
+
+
+def fast_hash(path: str, chunk_size: int = HASH_CHUNK_SIZE) -> Optional[str]:
+    """以檔案大小加上開頭、中間、結尾三個區塊計算內容雜湊
+
+    只讀取固定大小的資料，與檔案長度無關；較小的檔案會完整讀取。
+    """
+    try:
+        size = os.path.getsize(path)
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(str(size).encode())
+        with open(path, 'rb') as f:
+            if size <= chunk_size * 3:
+                digest.update(f.read())
+            else:
+                for offset in (0, (size - chunk_size) // 2, size - chunk_size):
+                    f.seek(offset)
+                    digest.update(f.read(chunk_size))
+        return digest.hexdigest()
+    except OSError:
+        return None
+
+
+def normalize_title(title: Optional[str]) -> str:
+    """移除標點與空白並轉為小寫，保留中日韓文字"""
+    return re.sub(r'[\W_]+', '', (title or '').lower())
+
+
+def duplicate_groups(limit: int = 100) -> List[Dict]:
+    """列出內容雜湊相同且有本地檔案的歌曲群組"""
+    hashes = db.session.query(Song.content_hash) \
+        .filter(Song.content_hash.isnot(None), Song.local_path.isnot(None)) \
+        .group_by(Song.content_hash) \
+        .having(func.count(Song.id) > 1) \
+        .order_by(Song.content_hash) \
+        .limit(limit) \
+        .subquery()
+    songs = db.session.query(Song) \
+        .filter(Song.content_hash.in_(db.select(hashes.c.content_hash)), Song.local_path.isnot(None)) \
+        .order_by(Song.content_hash, Song.id) \
+        .all()
+
+    groups: Dict[str, List[Song]] = {}
+    for song in songs:
+        groups.setdefault(song.content_hash, []).append(song)
+    return [{
+        'content_hash': content_hash,
+        'size': members[0].file_size,
+        'songs': [song.to_dict() for song in members]
+    } for content_hash, members in groups.items()]
+
+
+def find_local_copy(title: Optional[str], duration: Optional[int],
+                    source: Optional[str] = None, source_id: Optional[str] = None) -> Optional[Song]:
+    """在下載前尋找已經存在於本地的相同音訊
+
+    先以來源與影片 ID 比對已下載的歌曲，再比對長度相近、且有歌手資訊的
+    本地歌曲：線上標題去除 (Official Video) 等標記後，必須與「歌手 標題」
+    或「標題 歌手」完全相同。只有部分標題相同（例如本地的 Intro）不視為
+    同一首歌。
+    """
+    if source and source_id:
+        song = db.session.query(Song).filter(
+            Song.source == source,
+            Song.source_id == source_id,
+            Song.local_path.isnot(None)
+        ).first()
+        if song and os.path.exists(song.local_path):
+            return song
+
+    if not title or not duration:
+        return None
+    remote_title = normalize_title(TITLE_TAG_PATTERN.sub('', title))
+    candidates = db.session.query(Song).filter(
+        Song.local_path.isnot(None),
+        Song.artist.isnot(None),
+        Song.duration.between(duration - DURATION_TOLERANCE, duration + DURATION_TOLERANCE)
+    ).all()
+    for song in candidates:
+        local_title = normalize_title(os.path.splitext(song.title)[0]
+                                      if song.title == os.path.basename(song.local_path) else song.title)
+        artist = normalize_title(song.artist)
+        if not local_title or not artist:
+            continue
+        if remote_title not in (artist + local_title, local_title + artist):
+            continue
+        if os.path.exists(song.local_path):
+            return song
+    return None
@@ -0,0 +1,108 @@
+import queue
+import threading
+import time
+from typing import Dict, List, Optional
+
+from sqlalchemy import update
+
+from models import db, DownloadQueue
+
+# 下載結束的狀態，回報後即從記憶體中移除
+FINAL_STATUSES = ('completed', 'failed', 'cancelled')
+PROGRESS_FIELDS = ('downloaded_bytes', 'total_bytes', 'speed', 'eta')
+
+
+class DownloadProgress:
+    """保存在記憶體中的下載進度，並推送給訂閱者
+
+    yt-dlp 的進度與任務狀態變更以 update() 記錄，立即送到每個訂閱者的
+    佇列；寫入資料庫的次數以 persist_interval 秒限制，結束狀態一定寫入。
+    訂閱者處理太慢、佇列已滿時捨棄事件，下一次更新會帶有最新的完整進度。
+    """
+
+    def __init__(self, app, persist_interval: float = 5, subscriber_queue_size: int = 1000):
+        self.app = app
+        self.persist_interval = persist_interval
+        self.subscriber_queue_size = subscriber_queue_size
+        self._progress: Dict[int, Dict] = {}
+        self._persisted_at: Dict[int, float] = {}
+        self._subscribers: List[queue.Queue] = []
+        self._lock = threading.Lock()
+
+    def update(self, download_id: int, status: Optional[str] = None, **fields) -> Optional[Dict]:
+        """記錄進度並通知訂閱者；yt-dlp 回報的 downloading/finished 等狀態放在 phase 欄位
+
+        沒有狀態的更新只套用到進行中的下載：結束後才從工作行程送達的進度會被捨棄，
+        回傳 None，避免已結束的下載以 pending 重新出現。
+        """
+        now = time.monotonic()
+        with self._lock:
+            if status is None and download_id not in self._progress:
+                return None
+            progress = self._progress.setdefault(download_id, {'id': download_id, 'status': 'pending'})
+            if status:
+                progress['status'] = status
+            progress.update((key, value) for key, value in fields.items() if value is not None)
+            downloaded, total = progress.get('downloaded_bytes'), progress.get('total_bytes')
+            if status == 'completed':
+                progress['percent'] = 100.0
+            elif downloaded is not None and total:
+                progress['percent'] = round(min(downloaded / total, 1.0) * 100, 1)
+            progress['updated_at'] = time.time()
+            event = dict(progress)
+            final = progress['status'] in FINAL_STATUSES
+            # 尚無進度時不寫入，也不開始計算寫入間隔
+            persist = 'percent' in event and (
+                final or now - self._persisted_at.get(download_id, 0) >= self.persist_interval)
+            if persist:
+                self._persisted_at[download_id] = now
+            if final:
+                self._progress.pop(download_id, None)
+                self._persisted_at.pop(download_id, None)
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(event)
+            except queue.Full:
+                pass
+        if persist:
+            self._persist(event)
+        return event
+
+    def on_ytdlp_progress(self, download_id: int, data: Dict):
+        """YtDlpPool 的 on_progress 回呼"""
+        self.update(download_id, phase=data.get('status'),
+                    **{key: data.get(key) for key in PROGRESS_FIELDS})
+
+    def _persist(self, event: Dict):
+        values = {'progress': event['percent']}
+        for key in ('downloaded_bytes', 'total_bytes'):
+            if event.get(key) is not None:
+                values[key] = int(event[key])
+        try:
+            with self.app.app_context():
+                db.session.execute(update(DownloadQueue).where(DownloadQueue.id == event['id']).values(**values))
+                db.session.commit()
+        except Exception as e:
+            print(f"Failed to save download progress {event['id']}: {str(e)}")
+
+    def get(self, download_id: int) -> Optional[Dict]:
+        with self._lock:
+            progress = self._progress.get(download_id)
+            return dict(progress) if progress else None
+
+    def snapshot(self) -> List[Dict]:
+        """所有進行中的下載的最新進度"""
+        with self._lock:
+            return [dict(progress) for progress in self._progress.values()]
+
+    def subscribe(self) -> queue.Queue:
+        subscriber = queue.Queue(maxsize=self.subscriber_queue_size)
+        with self._lock:
+            self._subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: queue.Queue):
+        with self._lock:
+            if subscriber in self._subscribers:
+                self._subscribers.remove(subscriber)
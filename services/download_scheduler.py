@@ -0,0 +1,231 @@
+import asyncio
+import os
+import socket
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta, UTC
+from typing import Awaitable, Callable, Dict, Optional
+from urllib.parse import urlparse
+
+from sqlalchemy import func, update
+
+from models import db, DownloadQueue, Song
+from services.async_runtime import AsyncRuntime
+
+# 使用者直接加入的下載優先於整個播放列表的批次下載
+PRIORITY_USER = 10
+PRIORITY_BULK = 0
+# 每次選取租約時檢查的候選數量，用於跳過已達主機上限的下載
+LEASE_CANDIDATES = 200
+# 同一服務的不同主機名稱
+HOST_ALIASES = {'youtu.be': 'youtube.com'}
+
+
+def download_host(url: Optional[str]) -> str:
+    """下載來源的主機，用於限制同一服務同時進行的下載數量"""
+    host = (urlparse(url or '').hostname or '').lower()
+    for prefix in ('www.', 'm.', 'music.'):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+            break
+    return HOST_ALIASES.get(host, host)
+
+
+class DownloadScheduler:
+    """在專用事件循環中執行 DownloadQueue 的下載任務
+
+    以租約取得 pending 的任務：在一個條件更新中把狀態改為 downloading 並記錄
+    擁有者與到期時間，多個行程同時選取也不會重複執行。執行中的任務定期延長
+    租約；行程結束後未延長的租約到期，任務回到 pending 重新執行，超過
+    max_attempts 次時標記為失敗。依優先順序與加入順序選取，同時執行的數量
+    以 concurrency 及每個主機的 per_host 限制。
+    """
+
+    def __init__(self, app, run_download: Callable[[int], Awaitable], concurrency: int = 2, per_host: int = 2,
+                 lease_seconds: float = 60, poll_interval: float = 5, max_attempts: int = 3):
+        self.app = app
+        self.run_download = run_download
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self._runtime = AsyncRuntime(name='download-scheduler')
+        self._wakeup: Optional[asyncio.Event] = None
+        # 下載 ID -> (主機, 任務)
+        self._running: Dict[int, tuple] = {}
+        self._stats = {'started': 0, 'finished': 0, 'recovered': 0}
+        self._started = False
+        self._main = None
+
+    def start(self):
+        if self._started:
+            return
+        self._started = True
+        self._main = self._runtime.submit(self._run())
+
+    def stop(self, timeout: float = 5):
+        """停止選取新的任務並取消執行中的下載，未完成的任務在租約到期後由其他排程器接手"""
+        if not self._started:
+            return
+        self._started = False
+        self.wake_loop()
+        try:
+            self._main.result(timeout)
+        except Exception as e:
+            print(f"Download scheduler did not stop cleanly: {str(e)}")
+        self._runtime.stop()
+
+    def wake(self):
+        """有新的任務時立即選取，不等待下次輪詢；排程器未啟動時不做任何事"""
+        if self._started:
+            self.wake_loop()
+
+    def cancel(self, download_id: int):
+        """取消執行中的下載任務，任務取消時下載工作行程隨之中止；排程器未啟動時不做任何事"""
+        if self._started:
+            self._runtime.loop.call_soon_threadsafe(self._cancel, download_id)
+
+    def _cancel(self, download_id: int):
+        running = self._running.get(download_id)
+        if running is not None:
+            running[1].cancel()
+
+    def wake_loop(self):
+        if self._wakeup is not None:
+            self._runtime.loop.call_soon_threadsafe(self._wakeup.set)
+
+    def _now(self) -> datetime:
+        # SQLite 讀回的時間沒有時區資訊
+        return datetime.now(UTC).replace(tzinfo=None)
+
+    async def _run(self):
+        self._wakeup = asyncio.Event()
+        renew_interval = self.lease_seconds / 3
+        last_renewal = 0.0
+        loop = asyncio.get_running_loop()
+        while self._started:
+            try:
+                now = loop.time()
+                if now - last_renewal >= renew_interval:
+                    self.renew_leases()
+                    self.recover_expired()
+                    last_renewal = now
+                self.fill_slots()
+            except Exception as e:
+                print(f"Download scheduler error: {str(e)}")
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), min(self.poll_interval, renew_interval))
+            except asyncio.TimeoutError:
+                pass
+        tasks = [task for _, task in self._running.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def fill_slots(self) -> int:
+        """選取可執行的任務直到達到同時下載的上限，回傳新開始的數量"""
+        slots = self.concurrency - len(self._running)
+        if slots <= 0:
+            return 0
+        hosts = Counter(host for host, _ in self._running.values())
+        started = 0
+        with self.app.app_context():
+            for download_id, url in self.candidates().all():
+                host = download_host(url)
+                if hosts[host] >= self.per_host or not self._lease(download_id):
+                    continue
+                hosts[host] += 1
+                task = asyncio.get_running_loop().create_task(self._execute(download_id))
+                self._running[download_id] = (host, task)
+                self._stats['started'] += 1
+                started += 1
+                if started >= slots:
+                    break
+        return started
+
+    def candidates(self):
+        """依優先順序與加入順序排列的 pending 任務，由 ix_download_queue_pending_order 索引排序"""
+        return db.session.query(DownloadQueue.id, Song.url) \
+            .join(Song, DownloadQueue.song_id == Song.id) \
+            .filter(DownloadQueue.status == 'pending') \
+            .order_by(DownloadQueue.priority.desc(), DownloadQueue.id) \
+            .limit(LEASE_CANDIDATES)
+
+    def _lease(self, download_id: int) -> bool:
+        result = db.session.execute(
+            update(DownloadQueue)
+            .where(DownloadQueue.id == download_id, DownloadQueue.status == 'pending')
+            .values(status='downloading', lease_owner=self.owner,
+                    lease_expires_at=self._now() + timedelta(seconds=self.lease_seconds),
+                    attempts=func.coalesce(DownloadQueue.attempts, 0) + 1)
+        )
+        db.session.commit()
+        return result.rowcount == 1
+
+    async def _execute(self, download_id: int):
+        try:
+            await self.run_download(download_id)
+        except Exception as e:
+            print(f"Download {download_id} failed: {str(e)}")
+        finally:
+            self._running.pop(download_id, None)
+            self._stats['finished'] += 1
+            try:
+                with self.app.app_context():
+                    db.session.execute(
+                        update(DownloadQueue)
+                        .where(DownloadQueue.id == download_id, DownloadQueue.lease_owner == self.owner)
+                        .values(lease_owner=None, lease_expires_at=None)
+                    )
+                    db.session.commit()
+            except Exception as e:
+                print(f"Failed to release download lease {download_id}: {str(e)}")
+            self._wakeup.set()
+
+    def renew_leases(self):
+        if not self._running:
+            return
+        with self.app.app_context():
+            db.session.execute(
+                update(DownloadQueue)
+                .where(DownloadQueue.id.in_(list(self._running)), DownloadQueue.lease_owner == self.owner)
+                .values(lease_expires_at=self._now() + timedelta(seconds=self.lease_seconds))
+            )
+            db.session.commit()
+
+    def recover_expired(self) -> int:
+        """將租約已到期（擁有者已結束）的下載放回隊列，回傳處理的數量"""
+        with self.app.app_context():
+            expired = (DownloadQueue.status == 'downloading') & (
+                DownloadQueue.lease_expires_at.is_(None) | (DownloadQueue.lease_expires_at < self._now())
+            )
+            if self._running:
+                expired &= DownloadQueue.id.notin_(list(self._running))
+            attempts = func.coalesce(DownloadQueue.attempts, 0)
+            failed = db.session.execute(
+                update(DownloadQueue)
+                .where(expired, attempts >= self.max_attempts)
+                .values(status='failed', error_message='Download interrupted too many times',
+                        lease_owner=None, lease_expires_at=None)
+            ).rowcount
+            requeued = db.session.execute(
+                update(DownloadQueue)
+                .where(expired)
+                .values(status='pending', lease_owner=None, lease_expires_at=None)
+            ).rowcount
+            db.session.commit()
+        if failed or requeued:
+            print(f"Recovered interrupted downloads: {requeued} requeued, {failed} failed")
+            self._stats['recovered'] += failed + requeued
+        return failed + requeued
+
+    def stats(self) -> Dict:
+        stats = dict(self._stats)
+        stats['running'] = len(self._running)
+        stats['hosts'] = dict(Counter(host for host, _ in list(self._running.values())))
+        stats['concurrency'] = self.concurrency
+        stats['per_host'] = self.per_host
+        return stats
@@ -0,0 +1,79 @@
+import os
+from stat import S_ISREG
+import threading
+from collections import OrderedDict
+from datetime import datetime, UTC
+from typing import NamedTuple, Optional
+
+# 副檔名對應的 MIME 類型
+MIMETYPES = {
+    '.mp3': 'audio/mpeg',
+    '.flac': 'audio/flac',
+    '.ogg': 'audio/ogg',
+    '.wav': 'audio/wav',
+    '.aac': 'audio/aac',
+    '.m4a': 'audio/mp4',
+    '.mp4': 'audio/mp4',
+    '.mkv': 'audio/x-matroska',
+    '.avi': 'video/avi',
+    '.mov': 'video/quicktime',
+}
+DEFAULT_MIMETYPE = 'audio/mpeg'
+
+
+class FileInfo(NamedTuple):
+    size: int
+    last_modified: datetime
+    mtime_ns: int
+    mimetype: str
+    etag: str
+
+
+class FileInfoCache:
+    """以路徑為鍵快取檔案的大小、修改時間、MIME 類型與 ETag
+
+    每次查詢只做一次 os.stat，檔案大小或修改時間改變時自動重新計算。
+    """
+
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[str, FileInfo]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def guess_mimetype(path: str) -> str:
+        return MIMETYPES.get(os.path.splitext(path)[1].lower(), DEFAULT_MIMETYPE)
+
+    def get(self, path: str) -> Optional[FileInfo]:
+        """取得檔案資訊，檔案不存在或不是一般檔案時回傳 None"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            self.invalidate(path)
+            return None
+        if not S_ISREG(st.st_mode):
+            return None
+
+        with self._lock:
+            info = self._entries.get(path)
+            if info and info.mtime_ns == st.st_mtime_ns and info.size == st.st_size:
+                self._entries.move_to_end(path)
+                return info
+
+        info = FileInfo(
+            size=st.st_size,
+            last_modified=datetime.fromtimestamp(int(st.st_mtime), UTC),
+            mtime_ns=st.st_mtime_ns,
+            mimetype=self.guess_mimetype(path),
+            etag=f'{st.st_mtime_ns:x}-{st.st_size:x}'
+        )
+        with self._lock:
+            self._entries[path] = info
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return info
+
+    def invalidate(self, path: str) -> None:
+        with self._lock:
+            self._entries.pop(path, None)
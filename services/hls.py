@@ -0,0 +1,202 @@
+import hashlib
+import math
+import os
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from services.transcoder import DiskCache
+
+
+class _Encode:
+    """一次連續編碼，依序產生 [start, stop) 範圍的分段"""
+
+    def __init__(self, key: str, start: int, stop: int):
+        self.key = key
+        self.start = start
+        self.stop = stop
+        # 下一個尚未完成的分段
+        self.next = start
+        self.error: Optional[str] = None
+        self.done = False
+
+
+class HlsSegmenter:
+    """將本地檔案的音軌按需切成 HLS 分段
+
+    分段只在被請求時產生：從請求的分段開始以一個 ffmpeg 行程連續編碼到檔案
+    結尾（或另一個編碼的起點），由 segment muxer 切成分段，每完成一段就保存
+    到磁碟快取。同一次編碼的分段之間 AAC 的時間戳與取樣連續，不會因為每段
+    各自編碼的 encoder priming 在分段邊界產生間隙；只有跳轉到尚未產生的位置
+    時，新的編碼與先前的分段之間才有接縫。
+    """
+
+    def __init__(self, cache: DiskCache, segment_duration: int = 6, ffmpeg: str = 'ffmpeg',
+                 ffprobe: str = 'ffprobe', max_durations: int = 1024, poll_interval: float = 0.05):
+        self.cache = cache
+        self.segment_duration = segment_duration
+        self.ffmpeg = ffmpeg
+        self.ffprobe = ffprobe
+        self.poll_interval = poll_interval
+        # 檔案版本 -> 進行中的編碼
+        self._encodes: Dict[str, List[_Encode]] = {}
+        # 檔案路徑 -> (大小, 修改時間, 長度)，同一個檔案只保留最新版本，以 LRU 限制數量
+        self.max_durations = max_durations
+        self._durations: 'OrderedDict[str, Tuple[int, int, float]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+
+    def probe_duration(self, src_path: str) -> float:
+        """以 ffprobe 取得檔案長度（秒）"""
+        command = [
+            self.ffprobe, '-v', 'error',
+            '-show_entries', 'format=duration',
+            '-of', 'default=noprint_wrappers=1:nokey=1',
+            src_path
+        ]
+        result = subprocess.run(command, stdin=subprocess.DEVNULL, capture_output=True, timeout=30)
+        if result.returncode != 0:
+            raise RuntimeError(f"ffprobe failed: {result.stderr.decode(errors='replace').strip()}")
+        return float(result.stdout.decode().strip())
+
+    def duration(self, src_path: str, size: int, mtime_ns: int) -> float:
+        with self._lock:
+            cached = self._durations.get(src_path)
+            if cached and cached[:2] == (size, mtime_ns):
+                self._durations.move_to_end(src_path)
+                return cached[2]
+        duration = self.probe_duration(src_path)
+        with self._lock:
+            self._durations[src_path] = (size, mtime_ns, duration)
+            self._durations.move_to_end(src_path)
+            while len(self._durations) > self.max_durations:
+                self._durations.popitem(last=False)
+        return duration
+
+    def segment_count(self, duration: float) -> int:
+        return max(1, math.ceil(duration / self.segment_duration))
+
+    def playlist(self, src_path: str, size: int, mtime_ns: int) -> str:
+        """產生 VOD 類型的 m3u8 播放清單，分段以相對路徑 `<index>.ts` 表示"""
+        duration = self.duration(src_path, size, mtime_ns)
+        count = self.segment_count(duration)
+        lines = [
+            '#EXTM3U',
+            '#EXT-X-VERSION:3',
+            f'#EXT-X-TARGETDURATION:{self.segment_duration}',
+            '#EXT-X-MEDIA-SEQUENCE:0',
+            '#EXT-X-PLAYLIST-TYPE:VOD',
+        ]
+        for index in range(count):
+            length = min(self.segment_duration, duration - index * self.segment_duration)
+            lines.append(f'#EXTINF:{length:.3f},')
+            lines.append(f'{index}.ts')
+        lines.append('#EXT-X-ENDLIST')
+        return '\n'.join(lines) + '\n'
+
+    def file_key(self, src_path: str, size: int, mtime_ns: int) -> str:
+        key = f'{src_path}:{size}:{mtime_ns}:{self.segment_duration}'
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    def segment_name(self, src_path: str, size: int, mtime_ns: int, index: int) -> str:
+        return f'{self.file_key(src_path, size, mtime_ns)}-{index:05d}.ts'
+
+    def build_encode_command(self, src_path: str, dest_pattern: str, start: int, stop: int) -> List[str]:
+        """連續編碼 [start, stop) 範圍的分段，第 i 段寫入 dest_pattern % i"""
+        offset = start * self.segment_duration
+        return [
+            self.ffmpeg, '-nostdin', '-v', 'error', '-y',
+            '-ss', f'{offset:.3f}', '-t', f'{(stop - start) * self.segment_duration:.3f}',
+            '-i', src_path,
+            '-map', '0:a:0', '-vn',
+            '-c:a', 'aac', '-b:a', '160k',
+            '-output_ts_offset', f'{offset:.3f}',
+            '-muxdelay', '0',
+            '-f', 'segment',
+            '-segment_format', 'mpegts',
+            '-segment_time', str(self.segment_duration),
+            '-segment_start_number', str(start),
+            dest_pattern
+        ]
+
+    def segment(self, src_path: str, size: int, mtime_ns: int, index: int, timeout: float = 60) -> str:
+        """取得分段檔案路徑，尚未產生時從這個分段開始連續編碼並等待其完成"""
+        count = self.segment_count(self.duration(src_path, size, mtime_ns))
+        if not 0 <= index < count:
+            raise IndexError(f"Segment {index} out of range")
+
+        key = self.file_key(src_path, size, mtime_ns)
+        name = self.segment_name(src_path, size, mtime_ns, index)
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                cached = self.cache.get(name)
+                if cached:
+                    return cached
+                encodes = self._encodes.setdefault(key, [])
+                encode = next((e for e in encodes if e.next <= index < e.stop), None)
+                if encode is None:
+                    # 編碼到下一個已產生或由進行中的編碼負責的分段為止，不重複產生
+                    stop = index + 1
+                    while stop < count and not self.cache.get(self.segment_name(src_path, size, mtime_ns, stop)) \
+                            and not any(e.next <= stop < e.stop for e in encodes):
+                        stop += 1
+                    encode = _Encode(key, index, stop)
+                    encodes.append(encode)
+                    threading.Thread(target=self._run, args=(src_path, encode),
+                                     name='hls-encode', daemon=True).start()
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"Segment {index} was not ready in {timeout} seconds")
+                self._cond.wait(remaining)
+                if encode.error and encode.next <= index:
+                    raise RuntimeError(f"Segment generation failed: {encode.error}")
+
+    def _run(self, src_path: str, encode: _Encode):
+        pattern = self.cache.temp_path(f'{encode.key}-{uuid.uuid4().hex[:12]}-%05d.ts')
+        try:
+            command = self.build_encode_command(src_path, pattern, encode.start, encode.stop)
+            with tempfile.TemporaryFile() as stderr:
+                process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                           stderr=stderr)
+                # segment muxer 關閉一個分段後才建立下一個，下一個檔案出現即表示前一個已完成
+                while process.poll() is None:
+                    while encode.next + 1 < encode.stop and os.path.exists(pattern % (encode.next + 1)):
+                        self._publish(encode, pattern)
+                    time.sleep(self.poll_interval)
+                if process.returncode != 0:
+                    stderr.seek(0)
+                    raise RuntimeError(stderr.read().decode(errors='replace').strip()
+                                       or f'exit code {process.returncode}')
+            while encode.next < encode.stop and os.path.exists(pattern % encode.next):
+                self._publish(encode, pattern)
+            if encode.next < encode.stop:
+                raise RuntimeError(f'encoder stopped before segment {encode.next}')
+        except Exception as e:
+            encode.error = str(e)
+            print(f"HLS encode failed for {src_path}: {encode.error}")
+        finally:
+            # 未完成的分段，以及 ffmpeg 可能在 -t 結束處多建立的一個空分段
+            for index in range(encode.next, encode.stop + 1):
+                try:
+                    os.remove(pattern % index)
+                except OSError:
+                    pass
+            with self._cond:
+                encode.done = True
+                encodes = self._encodes.get(encode.key, [])
+                if encode in encodes:
+                    encodes.remove(encode)
+                if not encodes:
+                    self._encodes.pop(encode.key, None)
+                self._cond.notify_all()
+
+    def _publish(self, encode: _Encode, pattern: str):
+        self.cache.put(f'{encode.key}-{encode.next:05d}.ts', pattern % encode.next)
+        with self._cond:
+            encode.next += 1
+            self._cond.notify_all()
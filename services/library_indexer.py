@@ -0,0 +1,369 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from sqlalchemy import delete, insert, update
+
+from models import db, Song, PlayHistory, playlist_songs
+from services.content_index import fast_hash
+from services.library_search import index_songs, remove_songs
+from services.tag_reader import read_tags
+from services.ytdlp_pool import start_method
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:  # 未安裝 watchdog 時只使用定期輪詢
+    FileSystemEventHandler = object
+    Observer = None
+
+# 每批次寫入資料庫的筆數
+BATCH_SIZE = 500
+# 需要讀取標籤的檔案少於此數量時不啟動工作行程
+PARALLEL_THRESHOLD = 64
+
+
+def analyze_file(path: str, cover_dir: Optional[str] = None) -> Dict:
+    """在工作行程中讀取檔案標籤並計算內容雜湊"""
+    result = read_tags(path, cover_dir)
+    result['content_hash'] = fast_hash(path)
+    return result
+
+
+class _ChangeHandler(FileSystemEventHandler):
+    """將檔案系統事件轉交給索引器"""
+
+    def __init__(self, indexer: 'LibraryIndexer'):
+        super().__init__()
+        self.indexer = indexer
+
+    def on_any_event(self, event):
+        if event.event_type in ('opened', 'closed_no_write'):
+            return
+        if event.is_directory:
+            # 目錄被移入、移動或刪除時無法得知受影響的檔案，改做完整掃描
+            if event.event_type in ('created', 'moved', 'deleted'):
+                self.indexer.request_scan()
+            return
+        paths = [event.src_path]
+        if getattr(event, 'dest_path', None):
+            paths.append(event.dest_path)
+        self.indexer.notify_changed(paths)
+
+
+class LibraryIndexer:
+    """讓 Song 資料表與 MUSIC_DIR 保持同步的背景索引器
+
+    每首本地歌曲保存 (local_path, file_size, file_mtime) 作為持久化快照，
+    重新掃描時只寫入新增、變更或已刪除的檔案。有 watchdog 時依檔案系統
+    事件增量更新，並以較長的間隔做完整掃描；否則定期輪詢。新增或變更的
+    檔案在工作行程中讀取標籤、長度、位元率與封面，再分批寫回資料庫。
+    """
+
+    def __init__(self, app, extensions: Iterable[str], cover_dir: Optional[str] = None,
+                 workers: Optional[int] = None, poll_interval: float = 60,
+                 watch_poll_interval: float = 3600, debounce: float = 1.0):
+        self.app = app
+        self.extensions = tuple(ext.lower() for ext in extensions)
+        self.cover_dir = cover_dir
+        self.workers = workers or os.cpu_count() or 1
+        self.poll_interval = poll_interval
+        self.watch_poll_interval = watch_poll_interval
+        self.debounce = debounce
+        self._changed: Set[str] = set()
+        self._full_scan = False
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._scan_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._observer = None
+        self._progress = {
+            'state': 'idle',
+            'phase': None,
+            'total': 0,
+            'processed': 0,
+            'started_at': None,
+            'finished_at': None,
+            'last_result': None
+        }
+
+    @property
+    def music_dir(self) -> str:
+        return self.app.config['MUSIC_DIR']
+
+    def is_music_file(self, path: str) -> bool:
+        return path.lower().endswith(self.extensions)
+
+    def start(self):
+        """啟動背景索引執行緒"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._start_observer()
+        self._thread = threading.Thread(target=self._run, name='library-indexer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer = None
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _start_observer(self):
+        if Observer is None or not os.path.isdir(self.music_dir):
+            return
+        try:
+            observer = Observer()
+            observer.schedule(_ChangeHandler(self), self.music_dir, recursive=True)
+            observer.start()
+            self._observer = observer
+        except OSError as e:
+            # 例如 inotify watch 數量達到上限
+            print(f"Library watcher unavailable, falling back to polling: {str(e)}")
+            self._observer = None
+
+    def notify_changed(self, paths: Iterable[str]):
+        with self._lock:
+            self._changed.update(paths)
+        self._wakeup.set()
+
+    def request_scan(self):
+        """要求完整掃描；背景執行緒未啟動時另開一次性的執行緒"""
+        if self._thread and self._thread.is_alive():
+            with self._lock:
+                self._full_scan = True
+            self._wakeup.set()
+        elif not self._scan_lock.locked():
+            threading.Thread(target=self._safe, args=(self.scan,), name='library-scan', daemon=True).start()
+
+    def _run(self):
+        self._safe(self.scan)
+        while not self._stop.is_set():
+            interval = self.poll_interval if self._observer is None else self.watch_poll_interval
+            woke = self._wakeup.wait(interval)
+            if self._stop.is_set():
+                break
+            if woke:
+                # 合併短時間內連續發生的事件（例如複製大量檔案）
+                time.sleep(self.debounce)
+            self._wakeup.clear()
+            with self._lock:
+                paths, self._changed = self._changed, set()
+                full_scan, self._full_scan = self._full_scan, False
+            if woke and paths and not full_scan:
+                self._safe(self.scan_paths, paths)
+            else:
+                self._safe(self.scan)
+
+    def _safe(self, func, *args):
+        try:
+            return func(*args)
+        except Exception as e:
+            print(f"Library indexer error: {str(e)}")
+
+    def _walk(self) -> Dict[str, Tuple[int, int]]:
+        """遞迴列出音樂目錄中的音樂檔案及其大小與修改時間
+
+        任何目錄無法讀取（音樂目錄不存在、磁碟未掛載、權限不足）時引發 OSError，
+        不回傳不完整的結果，以免其中的檔案被當成已刪除。
+        """
+        found = {}
+        pending = [self.music_dir]
+        while pending:
+            directory = pending.pop()
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.name.startswith('.'):
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append(entry.path)
+                    elif entry.is_file() and self.is_music_file(entry.name):
+                        stat = entry.stat()
+                        found[entry.path] = (stat.st_size, stat.st_mtime_ns)
+        return found
+
+    def scan(self) -> Dict[str, int]:
+        """完整掃描音樂目錄並與資料庫中的快照比對"""
+        with self._scan_lock, self.app.app_context():
+            self._begin('walking')
+            try:
+                on_disk = self._walk()
+            except OSError as e:
+                return self._abort(e)
+            prefix = os.path.join(self.music_dir, '')
+            known = db.session.query(
+                Song.id, Song.local_path, Song.source, Song.file_size, Song.file_mtime, Song.content_hash
+            ).filter(Song.local_path.startswith(prefix, autoescape=True)).all()
+            return self._sync(on_disk, known)
+
+    def _abort(self, error: OSError) -> Dict[str, int]:
+        """無法讀取音樂目錄時放棄這次同步，不刪除任何歌曲"""
+        print(f"Library scan aborted, cannot read music directory: {str(error)}")
+        stats = {'added': 0, 'updated': 0, 'removed': 0, 'total': 0, 'error': str(error)}
+        self._update_progress(state='idle', phase=None, finished_at=time.time(), last_result=stats)
+        return stats
+
+    def scan_paths(self, paths: Iterable[str]) -> Dict[str, int]:
+        """只重新檢查指定的路徑"""
+        paths = {os.path.abspath(path) for path in paths}
+        with self._scan_lock, self.app.app_context():
+            self._begin('walking')
+            # 音樂目錄本身消失時（例如磁碟未掛載）無法區分檔案是否被刪除
+            if not os.path.isdir(self.music_dir):
+                return self._abort(FileNotFoundError(f"No such directory: '{self.music_dir}'"))
+            on_disk = {}
+            for path in paths:
+                if not self.is_music_file(path):
+                    continue
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                on_disk[path] = (stat.st_size, stat.st_mtime_ns)
+            known = []
+            path_list = list(paths)
+            for i in range(0, len(path_list), BATCH_SIZE):
+                known.extend(db.session.query(
+                    Song.id, Song.local_path, Song.source, Song.file_size, Song.file_mtime, Song.content_hash
+                ).filter(Song.local_path.in_(path_list[i:i + BATCH_SIZE])).all())
+            return self._sync(on_disk, known)
+
+    @property
+    def progress(self) -> Dict:
+        """目前或最近一次掃描的進度與速度"""
+        with self._lock:
+            progress = dict(self._progress)
+        if progress['started_at']:
+            elapsed = (progress['finished_at'] or time.time()) - progress['started_at']
+            progress['elapsed'] = round(elapsed, 3)
+            progress['files_per_second'] = round(progress['processed'] / elapsed, 1) if elapsed > 0 else None
+        return progress
+
+    def _begin(self, phase: str):
+        with self._lock:
+            self._progress.update({
+                'state': 'scanning',
+                'phase': phase,
+                'total': 0,
+                'processed': 0,
+                'started_at': time.time(),
+                'finished_at': None
+            })
+
+    def _update_progress(self, **values):
+        with self._lock:
+            self._progress.update(values)
+
+    def _extract(self, paths: List[str]) -> Iterator[Tuple[str, Dict]]:
+        """讀取標籤與內容雜湊；檔案數量較多時分配到多個工作行程平行處理"""
+        self._update_progress(phase='extracting', total=len(paths), processed=0)
+        reader = partial(analyze_file, cover_dir=self.cover_dir)
+        if len(paths) < PARALLEL_THRESHOLD or self.workers <= 1:
+            results = map(reader, paths)
+            executor = None
+        else:
+            # 與 yt-dlp 工作行程相同，不以 fork 從多執行緒的伺服器行程建立工作行程
+            executor = ProcessPoolExecutor(max_workers=self.workers,
+                                           mp_context=multiprocessing.get_context(start_method()))
+            results = executor.map(reader, paths, chunksize=16)
+        try:
+            for processed, (path, tags) in enumerate(zip(paths, results), start=1):
+                if processed % 100 == 0 or processed == len(paths):
+                    self._update_progress(processed=processed)
+                yield path, tags
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+
+    def _flush(self, inserts: List[Dict], updates: List[Dict]):
+        # 批次寫入不會觸發 ORM 事件，需要自行更新全文索引
+        if inserts:
+            ids = db.session.scalars(insert(Song).returning(Song.id), inserts).all()
+            index_songs(ids)
+            inserts.clear()
+        if updates:
+            db.session.execute(update(Song), updates)
+            index_songs(row['id'] for row in updates if 'title' in row)
+            updates.clear()
+        db.session.commit()
+
+    def _sync(self, on_disk: Dict[str, Tuple[int, int]], known) -> Dict[str, int]:
+        # 同一個檔案可能對應多首歌曲（例如下載的歌曲與本地重複檔案共用）
+        known_paths = {row.local_path for row in known}
+        added = [path for path in on_disk if path not in known_paths]
+        # 快照不同或尚未計算內容雜湊的檔案都需要重新分析
+        changed: Dict[str, List] = {}
+        for row in known:
+            path = row.local_path
+            if path in on_disk and ((row.file_size, row.file_mtime) != on_disk[path] or row.content_hash is None):
+                changed.setdefault(path, []).append(row)
+        removed = [row for row in known if row.local_path not in on_disk]
+
+        # 新增與變更的檔案讀取標籤後分批寫回
+        inserts, updates = [], []
+        for path, tags in self._extract(added + list(changed)):
+            size, mtime = on_disk[path]
+            values = {
+                'title': tags.get('title') or os.path.basename(path),
+                'artist': tags.get('artist'),
+                'album': tags.get('album'),
+                'duration': tags.get('duration'),
+                'bitrate': tags.get('bitrate'),
+                'thumbnail_url': f"/covers/{tags['cover']}" if tags.get('cover') else None,
+                'content_hash': tags.get('content_hash'),
+                'file_size': size,
+                'file_mtime': mtime
+            }
+            if path not in changed:
+                inserts.append({'source': 'local', 'local_path': path, **values})
+            for row in changed.get(path, []):
+                if row.source == 'local':
+                    updates.append({'id': row.id, **values})
+                else:
+                    # 下載的歌曲保留原本的標題等資訊，只更新檔案快照與雜湊
+                    updates.append({
+                        'id': row.id,
+                        'file_size': size,
+                        'file_mtime': mtime,
+                        'content_hash': values['content_hash']
+                    })
+            if len(inserts) + len(updates) >= BATCH_SIZE:
+                self._flush(inserts, updates)
+        self._flush(inserts, updates)
+
+        # 本地歌曲的檔案被刪除時移除整筆記錄；下載的歌曲只清除本地路徑
+        local_ids = [row.id for row in removed if row.source == 'local']
+        downloaded_ids = [row.id for row in removed if row.source != 'local']
+        for i in range(0, len(local_ids), BATCH_SIZE):
+            ids = local_ids[i:i + BATCH_SIZE]
+            db.session.execute(playlist_songs.delete().where(playlist_songs.c.song_id.in_(ids)))
+            db.session.execute(delete(PlayHistory).where(PlayHistory.song_id.in_(ids)))
+            db.session.execute(delete(Song).where(Song.id.in_(ids)))
+            remove_songs(ids)
+        for i in range(0, len(downloaded_ids), BATCH_SIZE):
+            db.session.execute(
+                update(Song)
+                .where(Song.id.in_(downloaded_ids[i:i + BATCH_SIZE]))
+                .values(local_path=None, file_size=None, file_mtime=None, content_hash=None)
+            )
+        db.session.commit()
+
+        stats = {
+            'added': len(added),
+            'updated': sum(len(rows) for rows in changed.values()),
+            'removed': len(removed),
+            'total': len(on_disk)
+        }
+        self._update_progress(state='idle', phase=None, finished_at=time.time(), last_result=stats)
+        if added or changed or removed:
+            print(f"Library index updated: {stats}")
+        return stats
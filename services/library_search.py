@@ -0,0 +1,180 @@
+import re
+import unicodedata
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import event, inspect, text
+
+from models import db, Song, Playlist
+
+# 中日韓文字之間沒有空白，unicode61 分詞器會把整段文字當成一個詞；
+# 寫入索引前在每個字的前後加上空白，讓每個字成為一個詞，查詢時以片語比對連續的字
+CJK_PATTERN = re.compile(
+    r'([\u2e80-\u2fdf\u3040-\u30ff\u3100-\u312f\u3190-\u31ff\u3400-\u4dbf'
+    r'\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff\uff66-\uff9f])'
+)
+# 與 unicode61 分詞器相同：字母與數字以外的字元都是分隔符號
+TOKEN_PATTERN = re.compile(r'[^\W_]+')
+# 標題的權重高於歌手
+SONG_WEIGHTS = (10.0, 5.0)
+
+SONG_FTS_DDL = ("CREATE VIRTUAL TABLE IF NOT EXISTS song_fts USING fts5("
+                "title, artist, tokenize = 'unicode61 remove_diacritics 2')")
+PLAYLIST_FTS_DDL = ("CREATE VIRTUAL TABLE IF NOT EXISTS playlist_fts USING fts5("
+                    "name, tokenize = 'unicode61 remove_diacritics 2')")
+
+
+def fts_text(value: Optional[str]) -> str:
+    """正規化文字並將中日韓文字拆成單字"""
+    value = unicodedata.normalize('NFKC', value or '').lower()
+    return CJK_PATTERN.sub(r' \1 ', value)
+
+
+def build_match_query(query: str) -> Optional[str]:
+    """將使用者輸入轉成 FTS5 查詢
+
+    以空白分隔的每個詞轉成一個片語，所有片語都必須符合；最後一個字不是
+    中日韓文字時使用前綴比對，例如 `jay cho` 可以找到 `Jay Chou`。
+    """
+    phrases = []
+    for term in query.split():
+        tokens = TOKEN_PATTERN.findall(fts_text(term))
+        if not tokens:
+            continue
+        phrase = '"' + ' '.join(tokens) + '"'
+        if not CJK_PATTERN.fullmatch(tokens[-1]):
+            phrase += '*'
+        phrases.append(phrase)
+    return ' AND '.join(phrases) or None
+
+
+def create_search_index(connection):
+    """建立全文索引資料表，新建立時從現有資料填入"""
+    existing = {row[0] for row in connection.exec_driver_sql(
+        "SELECT name FROM sqlite_master WHERE name IN ('song_fts', 'playlist_fts')")}
+    connection.exec_driver_sql(SONG_FTS_DDL)
+    connection.exec_driver_sql(PLAYLIST_FTS_DDL)
+    if 'song_fts' not in existing:
+        _index_songs(connection, None)
+    if 'playlist_fts' not in existing:
+        _index_playlists(connection, None)
+
+
+def rebuild_search_index():
+    """清空並重新建立全文索引"""
+    connection = db.session.connection()
+    connection.exec_driver_sql('DELETE FROM song_fts')
+    connection.exec_driver_sql('DELETE FROM playlist_fts')
+    _index_songs(connection, None)
+    _index_playlists(connection, None)
+    db.session.commit()
+
+
+def index_songs(ids: Iterable[int]):
+    """更新指定歌曲的索引，供不經過 ORM 事件的批次寫入使用"""
+    ids = list(ids)
+    if ids:
+        _index_songs(db.session.connection(), ids)
+
+
+def remove_songs(ids: Iterable[int]):
+    ids = list(ids)
+    if ids:
+        _delete(db.session.connection(), 'song_fts', ids)
+
+
+def _index_songs(connection, ids: Optional[List[int]]):
+    query = db.select(Song.id, Song.title, Song.artist)
+    if ids is not None:
+        query = query.where(Song.id.in_(ids))
+    rows = [{'id': row.id, 'title': fts_text(row.title), 'artist': fts_text(row.artist)}
+            for row in connection.execute(query)]
+    if rows:
+        connection.execute(text('INSERT OR REPLACE INTO song_fts (rowid, title, artist) '
+                                'VALUES (:id, :title, :artist)'), rows)
+
+
+def _index_playlists(connection, ids: Optional[List[int]]):
+    query = db.select(Playlist.id, Playlist.name)
+    if ids is not None:
+        query = query.where(Playlist.id.in_(ids))
+    rows = [{'id': row.id, 'name': fts_text(row.name)} for row in connection.execute(query)]
+    if rows:
+        connection.execute(text('INSERT OR REPLACE INTO playlist_fts (rowid, name) VALUES (:id, :name)'), rows)
+
+
+def _delete(connection, table: str, ids: List[int]):
+    connection.execute(text(f'DELETE FROM {table} WHERE rowid = :id'), [{'id': i} for i in ids])
+
+
+def search_library(query: str, limit: int = 50) -> Dict[str, List[Dict]]:
+    """在本地歌曲與播放列表中搜索，依 bm25 相關度排序"""
+    match = build_match_query(query)
+    if match is None:
+        return {'songs': [], 'playlists': []}
+
+    rows = db.session.execute(text(
+        'SELECT rowid, bm25(song_fts, :title_weight, :artist_weight) AS score FROM song_fts '
+        'WHERE song_fts MATCH :match ORDER BY score LIMIT :limit'
+    ), {'match': match, 'limit': limit,
+        'title_weight': SONG_WEIGHTS[0], 'artist_weight': SONG_WEIGHTS[1]}).all()
+    scores = {row.rowid: row.score for row in rows}
+    songs = {song.id: song for song in db.session.query(Song).filter(Song.id.in_(scores))}
+
+    playlist_rows = db.session.execute(text(
+        'SELECT rowid, bm25(playlist_fts) AS score FROM playlist_fts '
+        'WHERE playlist_fts MATCH :match ORDER BY score LIMIT :limit'
+    ), {'match': match, 'limit': limit}).all()
+    playlists = {p.id: p for p in db.session.query(Playlist).filter(Playlist.id.in_([r.rowid for r in playlist_rows]))}
+
+    return {
+        # bm25 分數越小越相關，回傳時取負值讓分數越大越相關
+        'songs': [{**songs[row.rowid].to_dict(), 'score': round(-row.score, 4)}
+                  for row in rows if row.rowid in songs],
+        'playlists': [{
+            'id': row.rowid,
+            'name': playlists[row.rowid].name,
+            'description': playlists[row.rowid].description,
+            'score': round(-row.score, 4)
+        } for row in playlist_rows if row.rowid in playlists]
+    }
+
+
+# 全文索引資料表隨 db.create_all() / db.drop_all() 建立與刪除
+@event.listens_for(db.metadata, 'after_create')
+def _after_create(target, connection, **kw):
+    create_search_index(connection)
+
+
+@event.listens_for(db.metadata, 'before_drop')
+def _before_drop(target, connection, **kw):
+    connection.exec_driver_sql('DROP TABLE IF EXISTS song_fts')
+    connection.exec_driver_sql('DROP TABLE IF EXISTS playlist_fts')
+
+
+# 透過 ORM 寫入的歌曲與播放列表在同一個交易中更新索引
+@event.listens_for(Song, 'after_insert')
+@event.listens_for(Song, 'after_update')
+def _song_saved(mapper, connection, target):
+    state = inspect(target)
+    if state.attrs.title.history.has_changes() or state.attrs.artist.history.has_changes():
+        connection.execute(text('INSERT OR REPLACE INTO song_fts (rowid, title, artist) '
+                                'VALUES (:id, :title, :artist)'),
+                           {'id': target.id, 'title': fts_text(target.title), 'artist': fts_text(target.artist)})
+
+
+@event.listens_for(Song, 'after_delete')
+def _song_deleted(mapper, connection, target):
+    _delete(connection, 'song_fts', [target.id])
+
+
+@event.listens_for(Playlist, 'after_insert')
+@event.listens_for(Playlist, 'after_update')
+def _playlist_saved(mapper, connection, target):
+    if inspect(target).attrs.name.history.has_changes():
+        connection.execute(text('INSERT OR REPLACE INTO playlist_fts (rowid, name) VALUES (:id, :name)'),
+                           {'id': target.id, 'name': fts_text(target.name)})
+
+
+@event.listens_for(Playlist, 'after_delete')
+def _playlist_deleted(mapper, connection, target):
+    _delete(connection, 'playlist_fts', [target.id])
@@ -0,0 +1,130 @@
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Hashable, List, Optional
+
+
+class PrefetchCancelled(Exception):
+    """預取工作在執行途中被取消"""
+
+
+class PrefetchJob:
+    def __init__(self, song: Dict):
+        self.song = song
+        self.future: Future = None
+        self._cancelled = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def check(self):
+        """在預取步驟之間呼叫，工作已取消時中止"""
+        if self._cancelled.is_set():
+            raise PrefetchCancelled()
+
+    def cancel(self):
+        self._cancelled.set()
+        self.future.cancel()
+
+
+class Prefetcher:
+    """依播放列表順序在背景預先準備接下來的歌曲
+
+    每個播放來源（例如播放列表）維持一個預取視窗：now_playing() 傳入目前
+    歌曲之後的 depth 首歌，不在新視窗內的工作被取消，並以 release(song)
+    釋放已預取的資源；已在進行或最近完成的歌曲不重複處理。實際的準備步驟
+    由 warm(song, job) 執行，可在步驟之間呼叫 job.check() 以便盡早停止；
+    同時執行的數量以 workers 限制。
+    """
+
+    def __init__(self, warm: Callable[[Dict, PrefetchJob], None], release: Callable[[Dict], None] = None,
+                 depth: int = 3, workers: int = 2, ttl: float = 600):
+        self.warm = warm
+        self.release = release
+        self.depth = depth
+        self.workers = workers
+        self.ttl = ttl
+        self._executor = None
+        # 播放來源 -> {歌曲 ID: 工作}
+        self._windows: Dict[Hashable, Dict[int, PrefetchJob]] = {}
+        # 歌曲 ID -> 完成時間
+        self._warmed: Dict[int, float] = {}
+        self._lock = threading.Lock()
+        self._stats = {'scheduled': 0, 'completed': 0, 'cancelled': 0, 'failed': 0, 'skipped': 0}
+
+    def _ensure_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='prefetch')
+        return self._executor
+
+    def now_playing(self, source: Hashable, upcoming: List[Dict], current_id: Optional[int] = None) -> List[int]:
+        """更新 source 的預取視窗，upcoming 為目前歌曲之後依序排列的歌曲，回傳排入預取的歌曲 ID
+
+        離開視窗的歌曲中，current_id（開始播放的歌曲）保留已預取的資源，其餘的被取消並釋放。
+        """
+        upcoming = upcoming[:self.depth]
+        wanted = {song['id'] for song in upcoming}
+        now = time.monotonic()
+        released = []
+        with self._lock:
+            self._warmed = {song_id: warmed_at for song_id, warmed_at in self._warmed.items()
+                            if now - warmed_at < self.ttl}
+            window = self._windows.get(source, {})
+            for song_id in list(window):
+                if song_id in wanted:
+                    continue
+                job = window.pop(song_id)
+                if song_id == current_id:
+                    continue
+                if not job.future.done():
+                    job.cancel()
+                    self._stats['cancelled'] += 1
+                self._warmed.pop(song_id, None)
+                released.append(job.song)
+            scheduled = []
+            for song in upcoming:
+                if song['id'] in window:
+                    continue
+                if song['id'] in self._warmed:
+                    self._stats['skipped'] += 1
+                    continue
+                job = PrefetchJob(song)
+                job.future = self._ensure_executor().submit(self._run, job)
+                window[song['id']] = job
+                scheduled.append(song['id'])
+                self._stats['scheduled'] += 1
+            self._windows[source] = window
+        if self.release:
+            for song in released:
+                self.release(song)
+        return scheduled
+
+    def stop(self, source: Hashable):
+        """停止 source 的所有預取"""
+        self.now_playing(source, [])
+        with self._lock:
+            self._windows.pop(source, None)
+
+    def _run(self, job: PrefetchJob):
+        if job.cancelled:
+            return
+        try:
+            self.warm(job.song, job)
+        except PrefetchCancelled:
+            return
+        except Exception as e:
+            print(f"Prefetch failed for song {job.song['id']}: {str(e)}")
+            with self._lock:
+                self._stats['failed'] += 1
+            return
+        with self._lock:
+            self._warmed[job.song['id']] = time.monotonic()
+            self._stats['completed'] += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['pending'] = sum(not job.future.done() for window in self._windows.values()
+                                   for job in window.values())
+            return stats
@@ -0,0 +1,274 @@
+import hashlib
+import os
+import threading
+import uuid
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+import requests
+
+from services.transcoder import DiskCache
+
+# 上游 Content-Type 與快取檔案副檔名的對應
+RELAY_EXTENSIONS = {
+    'audio/webm': '.webm',
+    'audio/mp4': '.m4a',
+    'audio/mpeg': '.mp3',
+    'audio/ogg': '.ogg',
+    'audio/aac': '.aac',
+}
+DEFAULT_MIMETYPE = 'application/octet-stream'
+
+
+class RelayError(RuntimeError):
+    """上游連線失敗，或收聽者落後超出緩衝區而無法繼續"""
+
+
+class RelaySession:
+    """單一曲目的上游連線，所有收聽者共享
+
+    背景執行緒從上游讀取資料並寫入固定大小的環形緩衝區，收聽者各自記錄
+    讀取位置。啟用 spill_path 時同時寫入磁碟，落後超出緩衝區的收聽者改從
+    檔案讀取；傳輸完成後由 on_finish 將檔案登記到快取。
+    """
+
+    def __init__(self, key: str, url: str, headers: Optional[Dict] = None, buffer_bytes: int = 8 * 1024 * 1024,
+                 chunk_size: int = 64 * 1024, timeout: float = 30, spill_path: Optional[str] = None,
+                 on_finish: Optional[Callable[['RelaySession'], None]] = None):
+        self.key = key
+        self.url = url
+        self.headers = headers or {}
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.spill_path = spill_path
+        self.output_path: Optional[str] = None
+        self.mimetype = DEFAULT_MIMETYPE
+        # 上游回報的總長度，未知時為 None
+        self.length: Optional[int] = None
+        # 已從上游接收的位元組數
+        self.received = 0
+        self.listeners = 0
+        self.error: Optional[str] = None
+        self.done = False
+        self._ring = bytearray(buffer_bytes)
+        self._on_finish = on_finish
+        self._headers_ready = threading.Event()
+        self._cancelled = threading.Event()
+        self._cond = threading.Condition()
+
+    @property
+    def buffer_start(self) -> int:
+        """環形緩衝區中最早一個位元組的位置"""
+        return max(0, self.received - len(self._ring))
+
+    def start(self):
+        threading.Thread(target=self._run, name=f'relay-{self.key}', daemon=True).start()
+
+    def cancel(self):
+        """停止讀取上游，已接收的部分不保存"""
+        self._cancelled.set()
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        """等待上游回應標頭，之後 mimetype 與 length 才有意義"""
+        return self._headers_ready.wait(timeout)
+
+    def _run(self):
+        spill = None
+        try:
+            with requests.get(self.url, headers=self.headers, stream=True, timeout=self.timeout) as response:
+                response.raise_for_status()
+                self.mimetype = response.headers.get('Content-Type', DEFAULT_MIMETYPE).split(';')[0].strip()
+                if 'Content-Length' in response.headers and 'Content-Encoding' not in response.headers:
+                    self.length = int(response.headers['Content-Length'])
+                if self.spill_path:
+                    spill = open(self.spill_path, 'wb')
+                self._headers_ready.set()
+                for chunk in response.iter_content(self.chunk_size):
+                    if self._cancelled.is_set():
+                        raise RelayError('relay cancelled')
+                    if spill:
+                        spill.write(chunk)
+                        spill.flush()
+                    self._append(chunk)
+            if self.length is not None and self.received != self.length:
+                raise RelayError(f'upstream closed after {self.received} of {self.length} bytes')
+        except Exception as e:
+            self.error = str(e)
+            print(f"Relay failed for {self.key}: {self.error}")
+        finally:
+            if spill:
+                spill.close()
+            try:
+                if self._on_finish:
+                    self._on_finish(self)
+            finally:
+                self._headers_ready.set()
+                with self._cond:
+                    self.done = True
+                    self._cond.notify_all()
+
+    def _append(self, chunk: bytes):
+        capacity = len(self._ring)
+        # 比緩衝區大的區塊只保留最後 capacity 個位元組
+        skipped = max(0, len(chunk) - capacity)
+        view = memoryview(chunk)[skipped:]
+        with self._cond:
+            position = (self.received + skipped) % capacity
+            first = min(len(view), capacity - position)
+            self._ring[position:position + first] = view[:first]
+            self._ring[:len(view) - first] = view[first:]
+            self.received += len(chunk)
+            self._cond.notify_all()
+
+    def _read_ring(self, offset: int, size: int) -> bytes:
+        capacity = len(self._ring)
+        position = offset % capacity
+        size = min(size, self.received - offset, capacity - position)
+        return bytes(self._ring[position:position + size])
+
+    def _open_spill(self):
+        try:
+            return open(self.spill_path, 'rb')
+        except FileNotFoundError:
+            # 傳輸已完成並移入快取
+            with self._cond:
+                while not self.done:
+                    self._cond.wait()
+            if self.output_path is None:
+                raise
+            return open(self.output_path, 'rb')
+
+    def iter_chunks(self, offset: int = 0, stop: Optional[int] = None) -> Iterator[bytes]:
+        """讀取 [offset, stop) 範圍，追上上游後等待新的資料，直到傳輸結束"""
+        with self._cond:
+            self.listeners += 1
+        spill = None
+        try:
+            while stop is None or offset < stop:
+                with self._cond:
+                    while offset >= self.received and not self.done:
+                        self._cond.wait()
+                    if offset >= self.received:
+                        if self.error:
+                            raise RelayError(self.error)
+                        return
+                    behind = offset < self.buffer_start
+                    chunk = None if behind else self._read_ring(offset, self.chunk_size)
+                if behind:
+                    if not self.spill_path:
+                        raise RelayError(f'listener fell behind the relay buffer of {self.key}')
+                    if spill is None:
+                        spill = self._open_spill()
+                    spill.seek(offset)
+                    chunk = spill.read(min(self.chunk_size, self.buffer_start - offset))
+                    if not chunk:
+                        raise RelayError(f'relay spill file of {self.key} is truncated')
+                if stop is not None:
+                    chunk = chunk[:stop - offset]
+                offset += len(chunk)
+                yield chunk
+        finally:
+            if spill:
+                spill.close()
+            with self._cond:
+                self.listeners -= 1
+
+    def available_from(self) -> int:
+        """可以開始讀取的最早位置，供 Range 請求判斷"""
+        return 0 if self.spill_path else self.buffer_start
+
+
+class AudioRelay:
+    """伺服器端轉送遠端音訊，同一曲目的收聽者共用一個上游連線
+
+    上游頻寬與不同曲目的數量成正比，而不是收聽者數量。cache 不為 None 時
+    傳輸完成的音訊保存到磁碟快取，之後直接以本地檔案回應。
+    """
+
+    def __init__(self, cache: Optional[DiskCache] = None, buffer_bytes: int = 8 * 1024 * 1024,
+                 timeout: float = 30):
+        self.cache = cache
+        self.buffer_bytes = buffer_bytes
+        self.timeout = timeout
+        self._sessions: Dict[str, RelaySession] = {}
+        self._lock = threading.Lock()
+        self._stats = {'sessions': 0, 'joined': 0, 'cancelled': 0, 'cache_hits': 0, 'upstream_bytes': 0}
+
+    def cache_name(self, key: str, mimetype: str) -> str:
+        return 'relay-' + hashlib.sha1(key.encode()).hexdigest() + RELAY_EXTENSIONS.get(mimetype, '.bin')
+
+    def cached(self, key: str) -> Optional[Tuple[str, str]]:
+        """回傳已保存的 (檔案路徑, mimetype)，沒有時回傳 None"""
+        if self.cache is None:
+            return None
+        for mimetype in (*RELAY_EXTENSIONS, DEFAULT_MIMETYPE):
+            path = self.cache.get(self.cache_name(key, mimetype))
+            if path:
+                with self._lock:
+                    self._stats['cache_hits'] += 1
+                return path, mimetype
+        return None
+
+    def session(self, key: str) -> Optional[RelaySession]:
+        with self._lock:
+            return self._sessions.get(key)
+
+    def open(self, key: str, resolve: Callable[[], Dict]) -> RelaySession:
+        """取得 key 進行中的轉送，沒有時以 resolve() 回傳的 url 與 http_headers 建立"""
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is not None:
+                self._stats['joined'] += 1
+                return session
+        # 解析網址可能需要數秒，不持有鎖；同時建立的轉送只保留第一個
+        audio = resolve()
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is not None:
+                self._stats['joined'] += 1
+                return session
+            spill_path = None
+            if self.cache is not None:
+                # 每個轉送使用自己的暫存檔；取消後立即重新開啟的轉送不會與
+                # 正在停止的舊轉送寫入或刪除同一個檔案
+                spill_path = self.cache.temp_path(
+                    f'relay-{hashlib.sha1(key.encode()).hexdigest()}-{uuid.uuid4().hex[:12]}')
+            session = RelaySession(key, audio['url'].splitlines()[0], headers=audio.get('http_headers'),
+                                   buffer_bytes=self.buffer_bytes, timeout=self.timeout,
+                                   spill_path=spill_path, on_finish=self._finish)
+            self._sessions[key] = session
+            self._stats['sessions'] += 1
+        session.start()
+        return session
+
+    def cancel(self, key: str) -> bool:
+        """取消沒有收聽者的轉送，回傳是否已取消"""
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None or session.listeners:
+                return False
+            # 立即移除，之後的請求建立新的轉送而不會加入正在停止的轉送
+            del self._sessions[key]
+            self._stats['cancelled'] += 1
+        session.cancel()
+        return True
+
+    def _finish(self, session: RelaySession):
+        # 先登記快取檔案再移除轉送，之後的請求不會在兩者之間重新連線上游
+        if session.spill_path and os.path.exists(session.spill_path):
+            if session.error is None and session.received:
+                session.output_path = self.cache.put(self.cache_name(session.key, session.mimetype),
+                                                     session.spill_path)
+            else:
+                os.remove(session.spill_path)
+        with self._lock:
+            self._stats['upstream_bytes'] += session.received
+            if self._sessions.get(session.key) is session:
+                del self._sessions[session.key]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['active'] = len(self._sessions)
+            stats['listeners'] = sum(session.listeners for session in self._sessions.values())
+            stats['upstream_bytes'] += sum(session.received for session in self._sessions.values())
+            return stats
@@ -0,0 +1,71 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, NamedTuple, Optional, Tuple
+
+
+class _Entry(NamedTuple):
+    value: Any
+    stored_at: float
+
+
+class SearchCache:
+    """搜索結果快取：容量上限 (LRU)、存活時間 (TTL) 與過期後仍可使用的時間
+
+    lookup() 回傳 (值, 狀態)，狀態為 'fresh'、'stale' 或 'miss'；
+    'stale' 表示可以先回傳舊結果，同時在背景重新整理。
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: float = 600, stale_ttl: float = 3600,
+                 clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._clock = clock
+        self._entries: 'OrderedDict[Hashable, _Entry]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'stale_hits': 0, 'misses': 0, 'evictions': 0, 'refreshes': 0}
+
+    def lookup(self, key: Hashable) -> Tuple[Optional[Any], str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None, 'miss'
+            age = self._clock() - entry.stored_at
+            if age > self.ttl + self.stale_ttl:
+                del self._entries[key]
+                self._stats['misses'] += 1
+                return None, 'miss'
+            self._entries.move_to_end(key)
+            if age > self.ttl:
+                self._stats['stale_hits'] += 1
+                return entry.value, 'stale'
+            self._stats['hits'] += 1
+            return entry.value, 'fresh'
+
+    def store(self, key: Hashable, value: Any):
+        with self._lock:
+            self._entries[key] = _Entry(value, self._clock())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def record_refresh(self):
+        with self._lock:
+            self._stats['refreshes'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            for key in self._stats:
+                self._stats[key] = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+        lookups = stats['hits'] + stats['stale_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['hits'] + stats['stale_hits']) / lookups, 3) if lookups else None
+        return stats
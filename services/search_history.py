@@ -0,0 +1,116 @@
+import atexit
+import threading
+import unicodedata
+from datetime import datetime, UTC
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import case, func, insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from models import db, SearchHistory, SearchQueryStat
+
+
+def normalize_query(query: str) -> str:
+    """統計用的查詢字串：NFKC 正規化、轉小寫並合併空白"""
+    return ' '.join(unicodedata.normalize('NFKC', query).lower().split())[:200]
+
+
+def aggregate_queries(entries: Iterable[Tuple[str, datetime]]) -> List[Dict]:
+    """依正規化後的查詢字串合併 (原始查詢, 時間)，顯示用的字串取最近一次的輸入"""
+    stats: Dict[str, Dict] = {}
+    for query, seen_at in entries:
+        key = normalize_query(query)
+        if not key:
+            continue
+        stat = stats.get(key)
+        if stat is None:
+            stats[key] = {'query': key, 'display': query.strip(), 'count': 1, 'last_seen': seen_at}
+            continue
+        stat['count'] += 1
+        if seen_at >= stat['last_seen']:
+            stat['display'], stat['last_seen'] = query.strip(), seen_at
+    return list(stats.values())
+
+
+def backfill_query_stats():
+    """統計表為空時，從既有的原始搜索記錄建立統計"""
+    if db.session.query(SearchQueryStat.id).first() is not None:
+        return
+    rows = aggregate_queries(db.session.query(SearchHistory.query, SearchHistory.created_at)
+                             .order_by(SearchHistory.id).yield_per(1000))
+    if rows:
+        db.session.execute(insert(SearchQueryStat), rows)
+        db.session.commit()
+
+
+class SearchHistoryWriter:
+    """在背景執行緒中批次寫入搜索歷史
+
+    record() 只把查詢放進記憶體緩衝區，不等待資料庫；背景執行緒每隔
+    flush_interval 秒或緩衝區達到 max_batch 筆時，在一個交易中寫入原始記錄
+    並累加 SearchQueryStat 的次數。
+    """
+
+    def __init__(self, app, flush_interval: float = 2.0, max_batch: int = 200):
+        self.app = app
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._buffer: List[Tuple[str, datetime]] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def record(self, query: str):
+        with self._lock:
+            self._buffer.append((query[:200], datetime.now(UTC)))
+            full = len(self._buffer) >= self.max_batch
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='search-history', daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+        if full:
+            self._wakeup.set()
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._buffer)
+
+    def flush(self) -> int:
+        """立即寫入緩衝區中的記錄，回傳寫入筆數"""
+        with self._flush_lock:
+            with self._lock:
+                entries, self._buffer = self._buffer, []
+            if not entries:
+                return 0
+
+            stats = aggregate_queries(entries)
+            try:
+                with self.app.app_context():
+                    db.session.execute(insert(SearchHistory),
+                                       [{'query': query, 'created_at': seen_at} for query, seen_at in entries])
+                    if stats:
+                        stmt = sqlite_insert(SearchQueryStat).values(stats)
+                        # 顯示用的字串只由較新的輸入取代
+                        newer = stmt.excluded.last_seen >= func.coalesce(SearchQueryStat.last_seen,
+                                                                         stmt.excluded.last_seen)
+                        db.session.execute(stmt.on_conflict_do_update(
+                            index_elements=[SearchQueryStat.query],
+                            set_={
+                                'count': SearchQueryStat.count + stmt.excluded.count,
+                                'last_seen': func.max(SearchQueryStat.last_seen, stmt.excluded.last_seen),
+                                'display': case((newer, stmt.excluded.display), else_=SearchQueryStat.display)
+                            }
+                        ))
+                    db.session.commit()
+            except Exception as e:
+                # 搜索歷史不影響搜索本身，寫入失敗時捨棄這一批
+                print(f"Failed to write search history: {str(e)}")
+                return 0
+            return len(entries)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
@@ -0,0 +1,151 @@
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import func, inspect, literal, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from models import db, DownloadQueue, PlayHistory, Song, playlist_songs
+from services.library_search import index_songs, remove_songs
+from services.single_flight import SingleFlight
+from services.video_metadata import BATCH_SIZE, parse_video_url
+
+# 可以依網址建立歌曲的平台
+SUPPORTED_PLATFORMS = ('youtube',)
+SONG_URL_FORMATS = {
+    'youtube': 'https://www.youtube.com/watch?v={}',
+}
+
+
+def song_url(platform: str, video_id: str) -> str:
+    """歌曲保存的標準網址，同一部影片的不同網址形式都保存為相同的網址"""
+    return SONG_URL_FORMATS[platform].format(video_id)
+
+
+def url_platform(url: str) -> Optional[str]:
+    """網址所屬的平台，無法從網址取得影片 ID 時也能判斷"""
+    if 'youtube.com' in url or 'youtu.be' in url:
+        return 'youtube'
+    if 'bilibili.com' in url:
+        return 'bilibili'
+    return None
+
+
+def merge_duplicate_songs() -> int:
+    """建立 (source, source_id) 唯一索引前，合併既有資料中的重複歌曲，回傳刪除的筆數
+
+    保留已下載到本地的一筆（都沒有時保留最早建立的一筆），播放列表、播放記錄
+    與下載隊列改為指向保留的歌曲。
+    """
+    if not inspect(db.engine).has_table('song'):
+        return 0
+    groups = db.session.query(Song.source, Song.source_id) \
+        .filter(Song.source_id.isnot(None)) \
+        .group_by(Song.source, Song.source_id) \
+        .having(func.count(Song.id) > 1) \
+        .all()
+    removed = []
+    for source, source_id in groups:
+        rows = db.session.query(Song.id, Song.local_path) \
+            .filter(Song.source == source, Song.source_id == source_id) \
+            .order_by(Song.local_path.is_(None), Song.id) \
+            .all()
+        keep_id = rows[0].id
+        duplicate_ids = [row.id for row in rows[1:]]
+        db.session.execute(sqlite_insert(playlist_songs).from_select(
+            ['playlist_id', 'song_id'],
+            select(playlist_songs.c.playlist_id, literal(keep_id))
+            .where(playlist_songs.c.song_id.in_(duplicate_ids))
+        ).on_conflict_do_nothing())
+        db.session.execute(playlist_songs.delete().where(playlist_songs.c.song_id.in_(duplicate_ids)))
+        for model in (PlayHistory, DownloadQueue):
+            db.session.query(model).filter(model.song_id.in_(duplicate_ids)) \
+                .update({model.song_id: keep_id}, synchronize_session=False)
+        db.session.query(Song).filter(Song.id.in_(duplicate_ids)).delete(synchronize_session=False)
+        removed.extend(duplicate_ids)
+    if removed:
+        # 從舊版升級時全文索引資料表尚未建立，sync_schema() 建立時會從合併後的資料填入
+        if inspect(db.engine).has_table('song_fts'):
+            remove_songs(removed)
+        db.session.commit()
+        print(f"Merged {len(removed)} duplicate songs")
+    return len(removed)
+
+
+class SongResolver:
+    """依影片網址取得或建立歌曲
+
+    網址先正規化為 (平台, 影片 ID)；已有歌曲時直接回傳，否則以 fetch_info
+    取得影片資訊後寫入。同一部影片的並行請求只取得一次資訊，寫入以
+    (source, source_id) 唯一索引去重，多個行程同時寫入也不會產生重複的歌曲。
+    """
+
+    def __init__(self, app, fetch_info: Callable[[str, str, str], Dict]):
+        self.app = app
+        self.fetch_info = fetch_info
+        self._flight = SingleFlight()
+
+    def ensure_song(self, url: str) -> int:
+        """回傳網址對應的歌曲 ID；無法辨識或不支援的網址拋出 ValueError"""
+        parsed = parse_video_url(url)
+        if parsed is None:
+            platform = url_platform(url)
+            if platform not in SUPPORTED_PLATFORMS:
+                raise ValueError(f'Unsupported URL: {url}')
+            # 網址中沒有可辨識的影片 ID，以網址合併請求並由影片資訊取得 ID
+            return self._flight.do(('url', url.strip()), lambda: self._create(platform, None, url))
+        if parsed[0] not in SUPPORTED_PLATFORMS:
+            raise ValueError(f'Unsupported URL: {url}')
+        song_id = self._find(*parsed)
+        if song_id is not None:
+            return song_id
+        return self._flight.do(parsed, lambda: self._create(*parsed, song_url(*parsed)))
+
+    def _find(self, platform: str, video_id: str):
+        with self.app.app_context():
+            return db.session.query(Song.id) \
+                .filter(Song.source == platform, Song.source_id == video_id) \
+                .scalar()
+
+    def _create(self, platform: str, video_id: Optional[str], url: str) -> int:
+        if video_id is not None:
+            # 等待期間可能已由其他請求建立
+            song_id = self._find(platform, video_id)
+            if song_id is not None:
+                return song_id
+        info = self.fetch_info(platform, video_id, url)
+        video_id = video_id or info['video_id']
+        with self.app.app_context():
+            return self.upsert(platform, [{**info, 'video_id': video_id}])[video_id]
+
+    @staticmethod
+    def upsert(platform: str, items: List[Dict]) -> Dict[str, int]:
+        """在目前的 session 中批次寫入歌曲，已存在的歌曲不修改，回傳 {影片 ID: 歌曲 ID}
+
+        items 的欄位與 VideoMetadataStore 相同：video_id、title、duration、thumbnail_url。
+        """
+        rows = list({item['video_id']: {
+            'title': (item.get('title') or item['video_id'])[:200],
+            'source': platform,
+            'source_id': item['video_id'],
+            'thumbnail_url': item.get('thumbnail_url'),
+            'duration': int(item['duration']) if item.get('duration') is not None else None,
+            'url': song_url(platform, item['video_id'])
+        } for item in items}.values())
+        song_ids = {}
+        created = []
+        for i in range(0, len(rows), BATCH_SIZE):
+            batch = rows[i:i + BATCH_SIZE]
+            result = db.session.execute(
+                sqlite_insert(Song).values(batch)
+                .on_conflict_do_nothing(index_elements=[Song.source, Song.source_id])
+                .returning(Song.id)
+            )
+            created.extend(result.scalars())
+            existing = db.session.query(Song.source_id, Song.id).filter(
+                Song.source == platform,
+                Song.source_id.in_([row['source_id'] for row in batch])
+            )
+            song_ids.update(existing)
+        # 不經過 ORM 的寫入需要自行更新全文索引
+        index_songs(created)
+        db.session.commit()
+        return song_ids
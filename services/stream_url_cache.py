@@ -0,0 +1,108 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from services.single_flight import SingleFlight
+
+# googlevideo 的 DASH/HLS 網址把參數放在路徑中，例如 /expire/1700000000/
+PATH_EXPIRE_PATTERN = re.compile(r'/expire/(\d+)')
+
+
+def parse_expire(url: str) -> Optional[float]:
+    """取得串流網址中 expire 參數表示的到期時間（Unix 時間）；多行網址取最早的到期時間"""
+    expires = []
+    for line in url.splitlines():
+        parsed = urlparse(line)
+        values = parse_qs(parsed.query).get('expire')
+        match = PATH_EXPIRE_PATTERN.search(parsed.path)
+        try:
+            if values:
+                expires.append(float(values[0]))
+            elif match:
+                expires.append(float(match.group(1)))
+        except ValueError:
+            continue
+    return min(expires) if expires else None
+
+
+class StreamUrlCache:
+    """已解析的音訊串流網址快取
+
+    以 (影片 ID, 格式) 為鍵，依網址中的 expire 參數減去 safety_margin 秒
+    判斷是否仍可使用；網址沒有 expire 時使用 default_ttl。同時請求相同鍵時
+    只解析一次。統計命中率與命中時省下的解析時間（以平均解析時間估算）。
+    """
+
+    def __init__(self, max_entries: int = 1024, safety_margin: float = 600, default_ttl: float = 1800,
+                 clock: Callable[[], float] = time.time):
+        self.max_entries = max_entries
+        self.safety_margin = safety_margin
+        self.default_ttl = default_ttl
+        self._clock = clock
+        # 鍵 -> (值, 可使用到的時間)
+        self._entries: 'OrderedDict[Hashable, Tuple[Dict, float]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._flight = SingleFlight()
+        self._stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0, 'resolved': 0}
+        self._resolve_seconds = 0.0
+        self._saved_seconds = 0.0
+
+    def get(self, key: Hashable, resolve: Callable[[], Dict]) -> Dict:
+        """取得快取的值；不存在或即將到期時呼叫 resolve()，resolve 回傳的 dict 需包含 url"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, valid_until = entry
+                if self._clock() < valid_until:
+                    self._entries.move_to_end(key)
+                    self._stats['hits'] += 1
+                    self._saved_seconds += self._average_resolve_seconds()
+                    return value
+                del self._entries[key]
+                self._stats['expired'] += 1
+            self._stats['misses'] += 1
+        return self._flight.do(key, lambda: self._resolve(key, resolve))
+
+    def _resolve(self, key: Hashable, resolve: Callable[[], Dict]) -> Dict:
+        started = time.monotonic()
+        value = resolve()
+        elapsed = time.monotonic() - started
+        now = self._clock()
+        expire = parse_expire(value['url'])
+        valid_until = expire - self.safety_margin if expire else now + self.default_ttl
+        with self._lock:
+            self._resolve_seconds += elapsed
+            self._stats['resolved'] += 1
+            if valid_until > now:
+                self._entries[key] = (value, valid_until)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self._stats['evictions'] += 1
+        return value
+
+    def _average_resolve_seconds(self) -> float:
+        resolved = self._stats['resolved']
+        return self._resolve_seconds / resolved if resolved else 0.0
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            lookups = stats['hits'] + stats['misses']
+            stats['size'] = len(self._entries)
+            stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+            stats['coalesced'] = self._flight.shared
+            stats['avg_resolve_seconds'] = round(self._average_resolve_seconds(), 3)
+            stats['time_saved_seconds'] = round(self._saved_seconds, 3)
+            return stats
@@ -0,0 +1,189 @@
+import bisect
+import heapq
+import threading
+import time
+import unicodedata
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from models import db, SearchQueryStat, Song
+
+# 搜索過的查詢比歌曲標題與歌手更可能是使用者想輸入的內容
+QUERY_WEIGHT = 3
+# 不超過此長度的前綴保留前 TOP_K 名，很短的前綴不必掃描大量項目；
+# 較長的前綴範圍較小，直接對整個範圍計分
+SHORT_PREFIX_LENGTH = 2
+TOP_K = 50
+# 保留最近查詢結果的數量，索引變更時清空
+RESULT_CACHE_SIZE = 1024
+
+
+def normalize(text: str) -> str:
+    return ' '.join(unicodedata.normalize('NFKC', text).lower().split())
+
+
+class SuggestIndex:
+    """搜索框自動完成用的記憶體前綴索引
+
+    正規化後的文字保存在排序好的串列中，以 bisect 找出前綴範圍。每個項目
+    記錄搜索次數與出現在曲庫中的次數，依加權分數排序；長度不超過
+    SHORT_PREFIX_LENGTH 的前綴另外保留分數最高的 TOP_K 個項目，隨項目的
+    新增與分數變化更新，較長的前綴則對整個範圍計分。資料來源為
+    SearchQueryStat 以及歌曲的標題與歌手；refresh() 只讀取上次之後新增的
+    歌曲與更新的查詢統計。項目超過 max_entries 時淘汰分數最低的項目。
+    """
+
+    def __init__(self, app, max_entries: int = 100000, refresh_interval: float = 10):
+        self.app = app
+        self.max_entries = max_entries
+        self.refresh_interval = refresh_interval
+        self._keys: List[str] = []
+        # 正規化文字 -> [顯示文字, 搜索次數, 曲庫中出現次數]
+        self._entries: Dict[str, List] = {}
+        self._results: Dict = {}
+        # 短前綴 -> 分數最高的項目，依 _rank() 由低到高排列；None 表示需要重新計算
+        self._top: Dict[str, Optional[List[Tuple]]] = {}
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._last_song_id = 0
+        self._last_query_seen: Optional[datetime] = None
+        self._refreshed_at: Optional[float] = None
+
+    def __len__(self):
+        return len(self._keys)
+
+    def suggest(self, prefix: str, limit: int = 10) -> List[Dict]:
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        with self._lock:
+            cached = self._results.get((prefix, limit))
+            if cached is not None:
+                return cached
+            if len(prefix) <= SHORT_PREFIX_LENGTH and limit <= TOP_K:
+                ranked = self._top.get(prefix)
+                if ranked is None:
+                    ranked = self._scan(prefix, TOP_K)
+                    if prefix in self._top:
+                        self._top[prefix] = ranked
+            else:
+                ranked = self._scan(prefix, limit)
+            result = [{'text': display, 'score': score}
+                      for score, _, display, _ in reversed(ranked[-limit:])]
+            if len(self._results) >= RESULT_CACHE_SIZE:
+                self._results.clear()
+            self._results[(prefix, limit)] = result
+            return result
+
+    def _rank(self, key: str) -> Tuple:
+        display, searches, occurrences = self._entries[key]
+        # 分數相同時較短的文字優先
+        return searches * QUERY_WEIGHT + occurrences, -len(display), display, key
+
+    def _scan(self, prefix: str, limit: int) -> List[Tuple]:
+        """對前綴範圍內的所有項目計分，回傳分數最高的 limit 個（由低到高）"""
+        start = bisect.bisect_left(self._keys, prefix)
+        end = bisect.bisect_left(self._keys, prefix + '\U0010ffff', start)
+        return sorted(heapq.nlargest(limit, map(self._rank, self._keys[start:end])))
+
+    def _update_top(self, key: str, old: Optional[Tuple], new: Tuple):
+        for length in range(1, min(len(key), SHORT_PREFIX_LENGTH) + 1):
+            prefix = key[:length]
+            if prefix not in self._top:
+                # 第一個以此為前綴的項目
+                self._top[prefix] = [new]
+                continue
+            ranked = self._top[prefix]
+            if ranked is None:
+                continue
+            if old is not None and old in ranked:
+                if new < old and len(ranked) >= TOP_K:
+                    # 分數降低，名單外的項目可能超過它，查詢時重新計算
+                    self._top[prefix] = None
+                    continue
+                ranked.remove(old)
+            if len(ranked) < TOP_K or new > ranked[0]:
+                bisect.insort(ranked, new)
+                if len(ranked) > TOP_K:
+                    del ranked[0]
+
+    def record_query(self, query: str):
+        """新的搜索立即加入索引，不等待下次 refresh()"""
+        with self._lock:
+            self._add(query, searches=1)
+
+    def refresh_if_due(self):
+        """距離上次更新超過 refresh_interval 秒時在背景執行緒中更新，不阻塞查詢"""
+        if self._refresh_lock.locked():
+            return
+        if self._refreshed_at is None or time.monotonic() - self._refreshed_at >= self.refresh_interval:
+            threading.Thread(target=self.refresh, name='suggest-refresh', daemon=True).start()
+
+    def refresh(self):
+        """讀取上次之後新增的歌曲與更新的查詢統計；第一次呼叫時建立完整索引"""
+        if not self._refresh_lock.acquire(blocking=False):
+            # 另一個執行緒正在更新，沿用目前的索引
+            return
+        try:
+            with self.app.app_context():
+                stats = db.session.query(SearchQueryStat.query, SearchQueryStat.count, SearchQueryStat.last_seen)
+                if self._last_query_seen is not None:
+                    stats = stats.filter(SearchQueryStat.last_seen > self._last_query_seen)
+                stats = stats.all()
+                songs = db.session.query(Song.id, Song.title, Song.artist) \
+                    .filter(Song.id > self._last_song_id) \
+                    .order_by(Song.id) \
+                    .all()
+
+            with self._lock:
+                # 新的項目最後一次合併排序，避免逐一插入排序串列
+                new_keys = []
+                for query, count, last_seen in stats:
+                    # 統計表中的次數包含 record_query() 已加入的次數
+                    self._add(query, searches=count, replace=True, new_keys=new_keys)
+                    if self._last_query_seen is None or last_seen > self._last_query_seen:
+                        self._last_query_seen = last_seen
+                for song_id, title, artist in songs:
+                    self._add(title, occurrences=1, new_keys=new_keys)
+                    if artist:
+                        self._add(artist, occurrences=1, new_keys=new_keys)
+                    self._last_song_id = song_id
+                if new_keys:
+                    self._keys = sorted(self._keys + new_keys)
+                if len(self._keys) > self.max_entries:
+                    self._evict()
+            self._refreshed_at = time.monotonic()
+        finally:
+            self._refresh_lock.release()
+
+    def _add(self, text: Optional[str], searches: int = 0, occurrences: int = 0, replace: bool = False,
+             new_keys: Optional[List[str]] = None):
+        key = normalize(text or '')
+        if not key:
+            return
+        self._results.clear()
+        entry = self._entries.get(key)
+        if entry is None:
+            self._entries[key] = [text.strip(), searches, occurrences]
+            if new_keys is None:
+                bisect.insort(self._keys, key)
+            else:
+                new_keys.append(key)
+            self._update_top(key, None, self._rank(key))
+            return
+        old = self._rank(key)
+        entry[1] = searches if replace else entry[1] + searches
+        entry[2] += occurrences
+        self._update_top(key, old, self._rank(key))
+
+    def _evict(self):
+        # 一次淘汰到容量的九成，避免每次新增都重新排序
+        keep = int(self.max_entries * 0.9)
+        ranked = heapq.nlargest(keep, self._entries.items(),
+                                key=lambda item: item[1][1] * QUERY_WEIGHT + item[1][2])
+        self._entries = dict(ranked)
+        self._keys = sorted(self._entries)
+        self._results.clear()
+        self._top = {}
+        for key in self._keys:
+            self._update_top(key, None, self._rank(key))
@@ -0,0 +1,103 @@
+import hashlib
+import os
+from typing import Dict, Optional, Tuple
+
+try:
+    import mutagen
+except ImportError:  # 未安裝 mutagen 時只使用檔名
+    mutagen = None
+
+# 各種標籤格式的欄位名稱：ID3、Vorbis comment / APE、MP4
+TAG_KEYS = {
+    'title': ('TIT2', 'title', '\xa9nam'),
+    'artist': ('TPE1', 'artist', '\xa9ART'),
+    'album': ('TALB', 'album', '\xa9alb'),
+}
+
+
+def _text(value) -> Optional[str]:
+    if isinstance(value, list):
+        value = value[0] if value else None
+    if hasattr(value, 'text'):
+        value = value.text[0] if value.text else None
+    if value is None:
+        return None
+    return str(value).strip() or None
+
+
+def _cover(audio) -> Optional[Tuple[bytes, str]]:
+    """取得內嵌封面的資料與副檔名"""
+    pictures = getattr(audio, 'pictures', None)
+    if pictures:
+        return pictures[0].data, '.png' if pictures[0].mime == 'image/png' else '.jpg'
+    tags = audio.tags
+    if tags is None:
+        return None
+    if hasattr(tags, 'getall'):
+        # ID3
+        frames = tags.getall('APIC')
+        if frames:
+            return frames[0].data, '.png' if frames[0].mime == 'image/png' else '.jpg'
+        return None
+    # MP4
+    covers = tags.get('covr')
+    if covers:
+        cover = covers[0]
+        is_png = cover.imageformat == cover.FORMAT_PNG
+        return bytes(cover), '.png' if is_png else '.jpg'
+    return None
+
+
+def read_tags(path: str, cover_dir: Optional[str] = None) -> Dict:
+    """讀取音樂檔案的標籤、長度、位元率與封面
+
+    在索引器的工作行程中執行，讀取失敗時回傳空 dict。封面以內容雜湊命名
+    存入 cover_dir，同一張專輯的歌曲共用同一個檔案。
+    """
+    if mutagen is None:
+        return {}
+    try:
+        audio = mutagen.File(path)
+    except Exception:
+        return {}
+    if audio is None:
+        return {}
+
+    result = {}
+    tags = audio.tags
+    if tags is not None:
+        for field, keys in TAG_KEYS.items():
+            for key in keys:
+                try:
+                    value = _text(tags.get(key))
+                except (KeyError, ValueError, TypeError):
+                    value = None
+                if value:
+                    result[field] = value[:200]
+                    break
+
+    info = getattr(audio, 'info', None)
+    if info is not None:
+        if getattr(info, 'length', None):
+            result['duration'] = int(round(info.length))
+        if getattr(info, 'bitrate', None):
+            result['bitrate'] = int(info.bitrate // 1000)
+
+    if cover_dir:
+        try:
+            cover = _cover(audio)
+        except Exception:
+            cover = None
+        if cover:
+            data, ext = cover
+            name = hashlib.sha1(data).hexdigest() + ext
+            cover_path = os.path.join(cover_dir, name)
+            if not os.path.exists(cover_path):
+                os.makedirs(cover_dir, exist_ok=True)
+                temp_path = f'{cover_path}.{os.getpid()}.part'
+                with open(temp_path, 'wb') as f:
+                    f.write(data)
+                os.replace(temp_path, cover_path)
+            result['cover'] = name
+
+    return result
@@ -0,0 +1,238 @@
+import hashlib
+import os
+import subprocess
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+# 可用的轉碼規格：名稱 -> ffmpeg 編碼器、位元率、容器格式
+TRANSCODE_PRESETS = {
+    'opus64': {'codec': 'libopus', 'bitrate': '64k', 'format': 'ogg', 'ext': '.ogg', 'mimetype': 'audio/ogg'},
+    'opus96': {'codec': 'libopus', 'bitrate': '96k', 'format': 'ogg', 'ext': '.ogg', 'mimetype': 'audio/ogg'},
+    'opus128': {'codec': 'libopus', 'bitrate': '128k', 'format': 'ogg', 'ext': '.ogg', 'mimetype': 'audio/ogg'},
+    'aac128': {'codec': 'aac', 'bitrate': '128k', 'format': 'adts', 'ext': '.aac', 'mimetype': 'audio/aac'},
+    'aac160': {'codec': 'aac', 'bitrate': '160k', 'format': 'adts', 'ext': '.aac', 'mimetype': 'audio/aac'},
+    'mp3192': {'codec': 'libmp3lame', 'bitrate': '192k', 'format': 'mp3', 'ext': '.mp3', 'mimetype': 'audio/mpeg'},
+}
+
+
+class DiskCache:
+    """以總位元組數為上限的 LRU 磁碟快取
+
+    只追蹤已完成的檔案；寫入中的檔案使用 `.part` 後綴，完成後以 put() 登記。
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._entries: 'OrderedDict[str, int]' = OrderedDict()
+        self._total = 0
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _load(self):
+        """首次使用時載入目錄中既有的快取檔案（依存取時間排序）"""
+        if self._loaded:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        files = []
+        for entry in os.scandir(self.directory):
+            if not entry.is_file():
+                continue
+            if entry.name.endswith('.part'):
+                # 上次中斷留下的半成品
+                os.remove(entry.path)
+                continue
+            stat = entry.stat()
+            files.append((max(stat.st_atime, stat.st_mtime), entry.path, stat.st_size))
+        for _, path, size in sorted(files):
+            self._entries[path] = size
+            self._total += size
+        self._loaded = True
+        self._evict()
+
+    @property
+    def total_bytes(self) -> int:
+        with self._lock:
+            self._load()
+            return self._total
+
+    def path_for(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def temp_path(self, name: str) -> str:
+        with self._lock:
+            self._load()
+        return self.path_for(name) + '.part'
+
+    def get(self, name: str) -> Optional[str]:
+        """取得快取檔案路徑並標記為最近使用，不存在時回傳 None"""
+        path = self.path_for(name)
+        with self._lock:
+            self._load()
+            if path not in self._entries:
+                return None
+            if not os.path.exists(path):
+                self._total -= self._entries.pop(path)
+                return None
+            self._entries.move_to_end(path)
+            return path
+
+    def put(self, name: str, temp_path: str) -> str:
+        """將寫入完成的暫存檔登記到快取中，必要時淘汰最久未使用的檔案"""
+        path = self.path_for(name)
+        os.replace(temp_path, path)
+        size = os.path.getsize(path)
+        with self._lock:
+            self._load()
+            if path in self._entries:
+                self._total -= self._entries.pop(path)
+            self._entries[path] = size
+            self._total += size
+            self._evict()
+        return path
+
+    def _evict(self):
+        # 保留最新登記的檔案，即使它本身超過上限
+        while self._total > self.max_bytes and len(self._entries) > 1:
+            path, size = self._entries.popitem(last=False)
+            self._total -= size
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+class TranscodeJob:
+    """單一轉碼變體的 ffmpeg 行程，所有請求相同變體的客戶端共享"""
+
+    def __init__(self, name: str, command: List[str], part_path: str,
+                 on_finish: Callable[['TranscodeJob'], None]):
+        self.name = name
+        self.command = command
+        self.part_path = part_path
+        self.output_path: Optional[str] = None
+        self.error: Optional[str] = None
+        self.process: Optional[subprocess.Popen] = None
+        self._on_finish = on_finish
+        self._done = threading.Event()
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def start(self):
+        # 先建立空檔案，讓讀取端可以立即開始追蹤輸出
+        open(self.part_path, 'wb').close()
+        self.process = subprocess.Popen(
+            self.command,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE
+        )
+        threading.Thread(target=self._wait, daemon=True).start()
+
+    def _wait(self):
+        _, stderr = self.process.communicate()
+        if self.process.returncode != 0:
+            self.error = stderr.decode(errors='replace').strip() or f'exit code {self.process.returncode}'
+            print(f"Transcode failed for {self.name}: {self.error}")
+        try:
+            self._on_finish(self)
+        finally:
+            self._done.set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._done.wait(timeout)
+
+    def _open_output(self):
+        try:
+            return open(self.part_path, 'rb')
+        except FileNotFoundError:
+            # 轉碼已完成並移入快取
+            self._done.wait()
+            if self.output_path is None:
+                raise
+            return open(self.output_path, 'rb')
+
+    def iter_chunks(self, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+        """邊轉碼邊讀取輸出檔，轉碼結束後讀完剩餘內容"""
+        with self._open_output() as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if chunk:
+                    yield chunk
+                    continue
+                if self._done.is_set():
+                    if self.error is None:
+                        while chunk := f.read(chunk_size):
+                            yield chunk
+                    return
+                self._done.wait(0.05)
+
+
+class Transcoder:
+    """按需轉碼並將結果保存於大小受限的磁碟快取"""
+
+    def __init__(self, cache: DiskCache, ffmpeg: str = 'ffmpeg'):
+        self.cache = cache
+        self.ffmpeg = ffmpeg
+        self._jobs: Dict[str, TranscodeJob] = {}
+        self._lock = threading.Lock()
+
+    def variant_name(self, src_path: str, size: int, mtime_ns: int, preset_name: str) -> str:
+        """以來源檔案的路徑、大小、修改時間與轉碼規格產生快取檔名"""
+        key = f'{src_path}:{size}:{mtime_ns}:{preset_name}'
+        return hashlib.sha1(key.encode()).hexdigest() + TRANSCODE_PRESETS[preset_name]['ext']
+
+    def build_command(self, src_path: str, dest_path: str, preset: Dict) -> List[str]:
+        return [
+            self.ffmpeg, '-nostdin', '-v', 'error', '-y',
+            '-i', src_path,
+            '-map', '0:a:0', '-vn',
+            '-c:a', preset['codec'],
+            '-b:a', preset['bitrate'],
+            '-f', preset['format'],
+            dest_path
+        ]
+
+    def open(self, src_path: str, size: int, mtime_ns: int,
+             preset_name: str) -> Tuple[Optional[str], Optional[TranscodeJob]]:
+        """取得轉碼結果
+
+        已快取時回傳 (檔案路徑, None)，否則回傳 (None, 進行中的轉碼工作)；
+        相同變體的並行請求共用同一個 ffmpeg 行程。
+        """
+        name = self.variant_name(src_path, size, mtime_ns, preset_name)
+        cached = self.cache.get(name)
+        if cached:
+            return cached, None
+
+        with self._lock:
+            job = self._jobs.get(name)
+            if job is None:
+                # 取得鎖後再檢查一次，避免與剛完成的工作競爭
+                cached = self.cache.get(name)
+                if cached:
+                    return cached, None
+                part_path = self.cache.temp_path(name)
+                command = self.build_command(src_path, part_path, TRANSCODE_PRESETS[preset_name])
+                job = TranscodeJob(name, command, part_path, self._finish)
+                try:
+                    job.start()
+                except Exception:
+                    if os.path.exists(part_path):
+                        os.remove(part_path)
+                    raise
+                self._jobs[name] = job
+        return None, job
+
+    def _finish(self, job: TranscodeJob):
+        try:
+            if job.error is None:
+                job.output_path = self.cache.put(job.name, job.part_path)
+            elif os.path.exists(job.part_path):
+                os.remove(job.part_path)
+        finally:
+            with self._lock:
+                self._jobs.pop(job.name, None)
@@ -0,0 +1,106 @@
+import re
+from datetime import datetime, timedelta, UTC
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from models import db, VideoMetadata
+
+YOUTUBE_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{11}$')
+BILIBILI_ID_PATTERN = re.compile(r'/video/(BV[0-9A-Za-z]{10}|av\d+)')
+# 每次查詢或寫入的最大 ID 數量，避免超過 SQLite 的參數上限
+BATCH_SIZE = 500
+
+
+def parse_video_url(url: str) -> Optional[Tuple[str, str]]:
+    """從影片網址取得 (平台, 影片 ID)，無法辨識時回傳 None"""
+    try:
+        parsed = urlparse(url.strip())
+    except ValueError:
+        return None
+    host = (parsed.hostname or '').lower()
+    if host == 'youtu.be':
+        video_id = parsed.path.lstrip('/').split('/')[0]
+    elif host == 'youtube.com' or host.endswith('.youtube.com'):
+        if parsed.path == '/watch':
+            video_id = parse_qs(parsed.query).get('v', [''])[0]
+        else:
+            parts = parsed.path.strip('/').split('/')
+            video_id = parts[1] if len(parts) > 1 and parts[0] in ('shorts', 'embed', 'live') else ''
+    elif host == 'bilibili.com' or host.endswith('.bilibili.com'):
+        match = BILIBILI_ID_PATTERN.search(parsed.path)
+        return ('bilibili', match.group(1)) if match else None
+    else:
+        return None
+    return ('youtube', video_id) if YOUTUBE_ID_PATTERN.match(video_id) else None
+
+
+class VideoMetadataStore:
+    """以 (平台, 影片 ID) 保存影片資訊的持久快取
+
+    搜索與 yt-dlp 取得的影片資訊都寫入資料庫，max_age 秒內再次需要時
+    直接使用，只有未知或過期的 ID 才需要連線到平台。搜索在執行緒池中
+    呼叫，因此每個方法都在自己的應用程式上下文中存取資料庫。
+    """
+
+    def __init__(self, app, max_age: float = 86400):
+        self.app = app
+        self.max_age = max_age
+
+    def get_many(self, platform: str, video_ids: Iterable[str]) -> Dict[str, Dict]:
+        """批次取得未過期的影片資訊，回傳 {影片 ID: 資訊}"""
+        video_ids = list(dict.fromkeys(video_ids))
+        if not video_ids:
+            return {}
+        # SQLite 讀回的時間沒有時區資訊
+        cutoff = (datetime.now(UTC) - timedelta(seconds=self.max_age)).replace(tzinfo=None)
+        result = {}
+        with self.app.app_context():
+            for i in range(0, len(video_ids), BATCH_SIZE):
+                rows = db.session.query(VideoMetadata).filter(
+                    VideoMetadata.platform == platform,
+                    VideoMetadata.video_id.in_(video_ids[i:i + BATCH_SIZE]),
+                    VideoMetadata.fetched_at >= cutoff
+                )
+                result.update((row.video_id, row.to_dict()) for row in rows)
+        return result
+
+    def get(self, platform: str, video_id: str) -> Optional[Dict]:
+        return self.get_many(platform, [video_id]).get(video_id)
+
+    def put_many(self, platform: str, items: List[Dict]):
+        """寫入或更新影片資訊，items 的欄位與 VideoMetadata.to_dict() 相同"""
+        if not items:
+            return
+        now = datetime.now(UTC)
+        rows = list({item['video_id']: {
+            'platform': platform,
+            'video_id': item['video_id'],
+            'title': (item.get('title') or '')[:200],
+            'duration': item.get('duration'),
+            'thumbnail_url': item.get('thumbnail_url'),
+            'view_count': item.get('view_count'),
+            'fetched_at': now
+        } for item in items}.values())
+        with self.app.app_context():
+            for i in range(0, len(rows), BATCH_SIZE):
+                stmt = sqlite_insert(VideoMetadata).values(rows[i:i + BATCH_SIZE])
+                db.session.execute(stmt.on_conflict_do_update(
+                    index_elements=[VideoMetadata.platform, VideoMetadata.video_id],
+                    set_={column: stmt.excluded[column]
+                          for column in ('title', 'duration', 'thumbnail_url', 'view_count', 'fetched_at')}
+                ))
+            db.session.commit()
+
+    def put_ytdlp_info(self, platform: str, info: Dict) -> Dict:
+        """保存 yt-dlp --dump-json 的輸出，回傳保存的欄位"""
+        item = {
+            'video_id': info['id'],
+            'title': info['title'],
+            'duration': int(info['duration']) if info.get('duration') is not None else None,
+            'thumbnail_url': info.get('thumbnail'),
+            'view_count': info.get('view_count')
+        }
+        self.put_many(platform, [item])
+        return item
@@ -1,21 +1,72 @@
 import os
-from typing import List, Dict, Optional
-from googleapiclient.discovery import build
-from bilibili_api import search, sync
+from typing import Callable, List, Dict, Optional, Tuple
 import asyncio
+import html
+import math
+import re
+import threading
+import time
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+from services.search_cache import SearchCache
+from services.single_flight import SingleFlight
+
+PLATFORMS = ('youtube', 'bilibili')
+# Bilibili 搜索每頁的結果數量
+BILIBILI_PAGE_SIZE = 20
+HTML_TAG_PATTERN = re.compile(r'<[^>]+>')
+# 合併排序時平台內排名與觀看次數的權重
+RANK_WEIGHT = 0.7
+POPULARITY_WEIGHT = 0.3
+
 class VideoSearchService:
     def __init__(self):
-        self.youtube = build('youtube', 'v3', 
-                           developerKey=os.getenv('YOUTUBE_API_KEY'))
+        # googleapiclient 的 HTTP 連線不是執行緒安全的，每個搜索執行緒保留一個
+        # 長期使用的客戶端，讓 keep-alive 連線可以跨請求重複使用
+        self._local = threading.local()
         self.min_duration = int(os.getenv('MIN_VIDEO_DURATION', '60'))
         self.max_duration = int(os.getenv('MAX_VIDEO_DURATION', '1800'))
         self.max_results = int(os.getenv('MAX_SEARCH_RESULTS', '30'))
+        # 各平台的搜索時限（秒），逾時時回傳其他平台的部分結果
+        self.youtube_timeout = float(os.getenv('YOUTUBE_SEARCH_TIMEOUT', '5'))
+        self.bilibili_timeout = float(os.getenv('BILIBILI_SEARCH_TIMEOUT', '5'))
+        # googleapiclient 是阻塞式的，放到執行緒池中執行以免阻塞事件循環
+        self._executor = ThreadPoolExecutor(max_workers=int(os.getenv('SEARCH_THREADS', '4')),
+                                            thread_name_prefix='search')
+        # 搜索結果快取，相同查詢的並行請求只會搜索一次
+        self.cache = SearchCache(
+            max_entries=int(os.getenv('SEARCH_CACHE_SIZE', '256')),
+            ttl=float(os.getenv('SEARCH_CACHE_TTL', '600')),
+            stale_ttl=float(os.getenv('SEARCH_CACHE_STALE_TTL', '3600'))
+        )
+        self._flight = SingleFlight()
+        # 同時進行的 Bilibili 請求上限，在事件循環中第一次使用時建立
+        self.bilibili_concurrency = int(os.getenv('BILIBILI_SEARCH_CONCURRENCY', '8'))
+        self._bilibili_slots: Optional[asyncio.Semaphore] = None
+        # 每次搜索最多同時請求的 Bilibili 頁數
+        self.bilibili_max_pages = int(os.getenv('BILIBILI_SEARCH_MAX_PAGES', '3'))
+        self._background_tasks = set()
+        # 持久的影片資訊快取（VideoMetadataStore），由應用程式設定
+        self.metadata = None
+
+    @property
+    def youtube(self):
+        """取得目前執行緒的 YouTube 客戶端"""
+        client = getattr(self._local, 'youtube', None)
+        if client is None:
+            # googleapiclient 載入較慢，第一次搜索時才匯入
+            import httplib2
+            from googleapiclient.discovery import build
+            http = httplib2.Http(timeout=self.youtube_timeout)
+            client = build('youtube', 'v3', developerKey=os.getenv('YOUTUBE_API_KEY'),
+                           http=http, cache_discovery=False)
+            self._local.youtube = client
+        return client
 
     def _parse_youtube_duration(self, duration: str) -> int:
         """將 YouTube 的 duration 格式轉換為秒數"""
-        import re
         hours = minutes = seconds = 0
         if match := re.search(r'PT(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?', duration):
             hours = int(match.group(1) or 0)
@@ -24,94 +75,268 @@ class VideoSearchService:
         return hours * 3600 + minutes * 60 + seconds
 
     def search_youtube(self, query: str) -> List[Dict]:
-        """搜索 YouTube 視頻"""
-        try:
-            # 執行搜索
-            search_response = self.youtube.search().list(
-                q=query,
-                part='id,snippet',
-                maxResults=self.max_results,
-                type='video'
-            ).execute()
+        """搜索 YouTube 視頻，失敗時拋出例外，由 _with_deadline 記錄為 error 狀態"""
+        # 執行搜索
+        search_response = self.youtube.search().list(
+            q=query,
+            part='id,snippet',
+            maxResults=self.max_results,
+            type='video'
+        ).execute()
 
-            video_ids = [item['id']['videoId'] for item in search_response['items']]
-            
-            # 獲取視頻詳細信息
+        video_ids = [item['id']['videoId'] for item in search_response['items']]
+
+        # 已知且未過期的影片直接使用保存的資訊，只查詢其餘影片的詳細信息
+        videos = self._stored_metadata('youtube', video_ids)
+        missing = [video_id for video_id in video_ids if video_id not in videos]
+        if missing:
             videos_response = self.youtube.videos().list(
-                id=','.join(video_ids),
+                id=','.join(missing),
                 part='contentDetails,statistics,snippet'
             ).execute()
+            fetched = [{
+                'video_id': video['id'],
+                'title': video['snippet']['title'],
+                'thumbnail_url': video['snippet']['thumbnails']['high']['url'],
+                'duration': self._parse_youtube_duration(video['contentDetails']['duration']),
+                'view_count': int(video['statistics'].get('viewCount', 0))
+            } for video in videos_response['items']]
+            self._store_metadata('youtube', fetched)
+            videos.update((video['video_id'], video) for video in fetched)
 
-            results = []
-            for video in videos_response['items']:
-                duration = self._parse_youtube_duration(video['contentDetails']['duration'])
-                
-                # 過濾視頻時長
-                if not (self.min_duration <= duration <= self.max_duration):
-                    continue
+        results = []
+        for video_id in video_ids:
+            video = videos.get(video_id)
+            if video is None:
+                continue
+            duration = video['duration'] or 0
+            
+            # 過濾視頻時長
+            if not (self.min_duration <= duration <= self.max_duration):
+                continue
 
-                results.append({
-                    'platform': 'youtube',
-                    'id': video['id'],
-                    'title': video['snippet']['title'],
-                    'thumbnail': video['snippet']['thumbnails']['high']['url'],
-                    'duration': duration,
-                    'view_count': int(video['statistics'].get('viewCount', 0)),
-                    'url': f'https://www.youtube.com/watch?v={video["id"]}'
-                })
+            results.append({
+                'platform': 'youtube',
+                'id': video_id,
+                'title': video['title'],
+                'thumbnail': video['thumbnail_url'],
+                'duration': duration,
+                'view_count': video['view_count'] or 0,
+                'url': f'https://www.youtube.com/watch?v={video_id}'
+            })
+
+        return results
 
-            return results
+    def _stored_metadata(self, platform: str, video_ids: List[str]) -> Dict[str, Dict]:
+        if self.metadata is None:
+            return {}
+        try:
+            return self.metadata.get_many(platform, video_ids)
         except Exception as e:
-            print(f"YouTube search error: {str(e)}")
-            return []
+            print(f"Failed to read video metadata: {str(e)}")
+            return {}
 
-    async def search_bilibili(self, query: str) -> List[Dict]:
-        """搜索 Bilibili 視頻"""
+    def _store_metadata(self, platform: str, videos: List[Dict]):
+        if self.metadata is None:
+            return
         try:
-            # 執行搜索
-            search_result = await search.search_by_type(
-                keyword=query,
-                search_type=search.SearchObjectType.VIDEO,
-                page=1
-            )
-
-            results = []
-            for item in search_result['result'][:self.max_results]:
+            self.metadata.put_many(platform, videos)
+        except Exception as e:
+            print(f"Failed to store video metadata: {str(e)}")
+
+    def _parse_bilibili_duration(self, duration) -> int:
+        """將 Bilibili 搜索結果的長度（秒數或 `MM:SS`、`H:MM:SS`）轉換為秒數"""
+        if isinstance(duration, (int, float)):
+            return int(duration)
+        seconds = 0
+        for part in str(duration).split(':'):
+            seconds = seconds * 60 + int(part or 0)
+        return seconds
+
+    async def search_bilibili(self, query: str) -> List[Dict]:
+        """搜索 Bilibili 視頻
+
+        一頁的結果經過時長過濾後常常不足，因此同時請求多頁（最多
+        bilibili_max_pages 頁），依頁碼順序合併並以 bvid 去除重複，
+        收集到 max_results 筆為止。第一頁失敗時拋出例外，由 _with_deadline
+        記錄為 error 狀態；其餘頁面失敗時只略過該頁。
+        """
+        # bilibili_api 匯入時會載入大量模組，第一次搜索時才匯入
+        from bilibili_api import search
+        if self._bilibili_slots is None:
+            self._bilibili_slots = asyncio.Semaphore(self.bilibili_concurrency)
+
+        async def fetch_page(page: int) -> Dict:
+            async with self._bilibili_slots:
+                return await search.search_by_type(
+                    keyword=query,
+                    search_type=search.SearchObjectType.VIDEO,
+                    page=page
+                )
+
+        # 預留一頁給被時長過濾掉的結果
+        pages = min(self.bilibili_max_pages, math.ceil(self.max_results / BILIBILI_PAGE_SIZE) + 1)
+        # 執行搜索
+        responses = await asyncio.gather(*(fetch_page(page) for page in range(1, pages + 1)),
+                                         return_exceptions=True)
+        if isinstance(responses[0], BaseException):
+            raise responses[0]
+
+        results = []
+        seen = set()
+        for page, search_result in enumerate(responses, start=1):
+            if isinstance(search_result, BaseException):
+                print(f"Bilibili search page {page} error: {str(search_result)}")
+                continue
+            for item in search_result.get('result') or []:
+                bvid = item.get('bvid') or str(item['aid'])
+                if bvid in seen:
+                    continue
+                seen.add(bvid)
+
                 # 獲取視頻詳細信息
-                duration = item['duration']  # 秒數
+                duration = self._parse_bilibili_duration(item['duration'])
                 
                 # 過濾視頻時長
                 if not (self.min_duration <= duration <= self.max_duration):
                     continue
 
+                thumbnail = item['pic']
                 results.append({
                     'platform': 'bilibili',
                     'id': str(item['aid']),
-                    'title': item['title'],
-                    'thumbnail': item['pic'],
+                    # 標題中的搜索關鍵字以 <em> 標記
+                    'title': html.unescape(HTML_TAG_PATTERN.sub('', item['title'])),
+                    'thumbnail': f'https:{thumbnail}' if thumbnail.startswith('//') else thumbnail,
                     'duration': duration,
                     'view_count': item['play'],
                     'url': f'https://www.bilibili.com/video/{item["bvid"]}'
                 })
+                if len(results) >= self.max_results:
+                    return results
+            if page >= search_result.get('numPages', page):
+                break
 
-            return results
-        except Exception as e:
-            print(f"Bilibili search error: {str(e)}")
-            return []
+        return results
 
     async def search_all(self, query: str) -> Dict[str, List[Dict]]:
-        """同時搜索 YouTube 和 Bilibili"""
-        # 創建搜索歷史記錄
-        from models import db, SearchHistory
-        search_history = SearchHistory(query=query)
-        db.session.add(search_history)
-        db.session.commit()
+        """同時搜索 YouTube 和 Bilibili
 
-        # 執行搜索
-        youtube_results = self.search_youtube(query)
-        bilibili_results = await self.search_bilibili(query)
+        應在長期運行的事件循環中執行，bilibili_api 的 HTTP 會話綁定在事件循環上，
+        同一個事件循環的搜索會共用連線。
+        """
+        key = self.cache_key(query)
+        cached, state = self.cache.lookup(key)
+        if state == 'fresh':
+            return cached
+        if state == 'stale':
+            # 先回傳舊結果，同時在背景重新搜索
+            self._refresh_in_background(key, query)
+            return cached
+        return await self._flight.do_async(key, lambda: self._search_and_store(key, query))
+
+    async def search_each(self, query: str, on_result: Callable[[str, List[Dict], Dict], None]) -> Dict:
+        """同時搜索各平台，每個平台完成時立即以 on_result(平台, 結果, 狀態) 回報
+
+        回傳與 search_all 相同格式的合併結果。快取命中或相同查詢正在進行時，
+        在結果可用後依序回報各平台。
+        """
+        key = self.cache_key(query)
+        cached, state = self.cache.lookup(key)
+        if state == 'stale':
+            self._refresh_in_background(key, query)
+        if state == 'miss':
+            if self._flight.in_flight(key):
+                results = await self._flight.do_async(key, lambda: self._search_and_store(key, query))
+            else:
+                return await self._flight.do_async(key, lambda: self._search_and_store(key, query, on_result))
+        else:
+            results = cached
+        for platform in PLATFORMS:
+            on_result(platform, results[platform], results['status'][platform])
+        return results
+
+    def cache_key(self, query: str) -> Tuple:
+        """以正規化後的查詢字串及影響結果的設定作為快取鍵"""
+        normalized = ' '.join(unicodedata.normalize('NFKC', query).lower().split())
+        return normalized, self.min_duration, self.max_duration, self.max_results
+
+    def cache_stats(self) -> Dict:
+        stats = self.cache.stats()
+        stats['coalesced'] = self._flight.shared
+        return stats
+
+    def _refresh_in_background(self, key: Tuple, query: str):
+        if self._flight.in_flight(key):
+            return
+
+        async def refresh():
+            await self._flight.do_async(key, lambda: self._search_and_store(key, query))
+
+        self.cache.record_refresh()
+        # 在同一個事件循環中執行，保留任務的參考以免被回收
+        task = asyncio.get_running_loop().create_task(refresh())
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    async def _search_and_store(self, key: Tuple, query: str, on_result: Optional[Callable] = None) -> Dict:
+        results = await self._search_providers(query, on_result)
+        # 只快取所有平台都成功的結果，逾時或失敗的部分結果不快取
+        if all(status['status'] == 'ok' for status in results['status'].values()):
+            self.cache.store(key, results)
+        return results
+
+    async def _search_providers(self, query: str, on_result: Optional[Callable] = None) -> Dict:
+        # 同時搜索兩個平台，各自受時限限制
+        loop = asyncio.get_running_loop()
+        (youtube_results, youtube_status), (bilibili_results, bilibili_status) = await asyncio.gather(
+            self._with_deadline('youtube', loop.run_in_executor(self._executor, self.search_youtube, query),
+                                self.youtube_timeout, on_result),
+            self._with_deadline('bilibili', self.search_bilibili(query), self.bilibili_timeout, on_result)
+        )
 
         return {
             'youtube': youtube_results,
-            'bilibili': bilibili_results
-        } 
\ No newline at end of file
+            'bilibili': bilibili_results,
+            'merged': self.merge_results({'youtube': youtube_results, 'bilibili': bilibili_results}),
+            'status': {
+                'youtube': youtube_status,
+                'bilibili': bilibili_status
+            }
+        }
+
+    def merge_results(self, results: Dict[str, List[Dict]]) -> List[Dict]:
+        """將各平台的結果合併成一個列表
+
+        分數由平台內的排名（平台本身的相關度）與觀看次數組成，觀看次數取對數
+        後以所有結果中的最大值正規化，避免單一熱門影片壓過相關度。
+        """
+        max_views = max((item.get('view_count') or 0 for items in results.values() for item in items), default=0)
+        max_popularity = math.log1p(max_views) or 1
+        merged = []
+        for items in results.values():
+            for rank, item in enumerate(items):
+                relevance = 1 - rank / len(items)
+                popularity = math.log1p(item.get('view_count') or 0) / max_popularity
+                score = RANK_WEIGHT * relevance + POPULARITY_WEIGHT * popularity
+                merged.append({**item, 'score': round(score, 4)})
+        merged.sort(key=lambda item: item['score'], reverse=True)
+        return merged
+
+    async def _with_deadline(self, platform: str, awaitable, timeout: float,
+                             on_result: Optional[Callable] = None) -> Tuple[List[Dict], Dict]:
+        """在時限內等待單一平台的搜索結果，逾時或失敗時回傳空結果與狀態"""
+        started = time.monotonic()
+        try:
+            results = await asyncio.wait_for(awaitable, timeout)
+            status = 'ok'
+        except asyncio.TimeoutError:
+            print(f"{platform} search timed out after {timeout}s")
+            results, status = [], 'timeout'
+        except Exception as e:
+            print(f"{platform} search error: {str(e)}")
+            results, status = [], 'error'
+        status = {'status': status, 'elapsed': round(time.monotonic() - started, 3)}
+        if on_result is not None:
+            on_result(platform, results, status)
+        return results, status
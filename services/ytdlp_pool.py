@@ -0,0 +1,306 @@
+import asyncio
+import json
+import multiprocessing
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+# 所有 YoutubeDL 實例共用的選項
+BASE_OPTIONS = {
+    'quiet': True,
+    'no_warnings': True,
+    'noprogress': True,
+    'noplaylist': True,
+}
+# 工作行程回報下載進度的最短間隔（秒），完成與錯誤時一定回報
+PROGRESS_INTERVAL = 0.25
+
+
+def start_method() -> str:
+    """建立工作行程的方式
+
+    主行程中有許多背景執行緒（轉送、預取、索引、下載排程等），fork 可能複製
+    其他執行緒持有中的鎖而讓工作行程死結；工作行程改由 forkserver（不支援時
+    為 spawn）從乾淨的行程建立。
+    """
+    return 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+
+class YtDlpError(RuntimeError):
+    """yt-dlp 執行失敗、逾時或工作行程異常結束"""
+
+
+# 以下在工作行程中執行：每個行程保留已載入 extractor 的 YoutubeDL 實例，以選項區分
+_instances: Dict[str, Any] = {}
+# 回報進度用的佇列，以及目前工作的進度鍵與上次回報時間；每個工作行程同時只執行一個工作
+_progress_queue = None
+_progress_key = None
+_progress_sent_at = 0.0
+
+
+def _youtube_dl(options: Dict):
+    import yt_dlp
+    key = json.dumps(options, sort_keys=True)
+    ydl = _instances.get(key)
+    if ydl is None:
+        ydl = yt_dlp.YoutubeDL({**BASE_OPTIONS, **options})
+        ydl.add_progress_hook(_progress_hook)
+        ydl.add_postprocessor_hook(_postprocessor_hook)
+        _instances[key] = ydl
+    return ydl
+
+
+def _report_progress(data: Dict, force: bool = False):
+    global _progress_sent_at
+    if _progress_queue is None or _progress_key is None:
+        return
+    now = time.monotonic()
+    if not force and now - _progress_sent_at < PROGRESS_INTERVAL:
+        return
+    _progress_sent_at = now
+    _progress_queue.put((_progress_key, data))
+
+
+def _progress_hook(progress: Dict):
+    # progress 中的 info_dict 很大且不一定能序列化，只傳回需要的欄位
+    _report_progress({
+        'status': progress.get('status'),
+        'downloaded_bytes': progress.get('downloaded_bytes'),
+        'total_bytes': progress.get('total_bytes') or progress.get('total_bytes_estimate'),
+        'speed': progress.get('speed'),
+        'eta': progress.get('eta'),
+    }, force=progress.get('status') != 'downloading')
+
+
+def _postprocessor_hook(progress: Dict):
+    if progress.get('status') == 'started':
+        _report_progress({'status': 'postprocessing', 'postprocessor': progress.get('postprocessor')}, force=True)
+
+
+def _init_worker(progress_queue=None):
+    """工作行程啟動時匯入 yt-dlp 並載入 YouTube extractor"""
+    global _progress_queue
+    _progress_queue = progress_queue
+    _youtube_dl({}).get_info_extractor('Youtube')
+
+
+def _extract_info(url: str, options: Dict, download: bool, progress_key: Any = None) -> Dict:
+    global _progress_key, _progress_sent_at
+    _progress_key, _progress_sent_at = progress_key, 0.0
+    try:
+        ydl = _youtube_dl(options)
+        info = ydl.extract_info(url, download=download)
+        return ydl.sanitize_info(info)
+    except Exception as e:
+        # yt-dlp 的例外可能無法序列化，轉成字串傳回主行程
+        raise YtDlpError(str(e)) from None
+    finally:
+        _progress_key = None
+
+
+def _warm():
+    return True
+
+
+class YtDlpPool:
+    """以 yt-dlp Python API 執行工作的常駐行程池
+
+    工作行程啟動時即匯入 yt-dlp 並載入 extractor，之後的請求只需等待網路。
+    每個工作行程由自己的單一行程 ProcessPoolExecutor 管理，同時執行的工作
+    數量以 workers 限制，其餘工作依序等待空閒的行程。每個工作有逾時限制，
+    逾時或異常結束時只重建執行該工作的行程，其他行程中的工作不受影響。
+    設定 on_progress 時，下載進度經由佇列傳回主行程，由背景執行緒呼叫
+    on_progress(progress_key, data)。
+    """
+
+    def __init__(self, workers: int = 2, timeout: float = 60, name: str = 'yt-dlp',
+                 on_progress: Optional[Callable[[Any, Dict], None]] = None):
+        self.workers = workers
+        self.timeout = timeout
+        self.name = name
+        self.on_progress = on_progress
+        self._executors: List[Optional[ProcessPoolExecutor]] = [None] * workers
+        self._idle = list(range(workers))
+        # 等待空閒行程的工作：(future, func, args)
+        self._pending: Deque[Tuple[Future, Callable, Tuple]] = deque()
+        # 執行中的工作 -> (行程編號, executor)
+        self._running: Dict[Future, Tuple[int, ProcessPoolExecutor]] = {}
+        self._lock = threading.Lock()
+        self.restarts = 0
+
+    def _ensure_executor(self, slot: int) -> ProcessPoolExecutor:
+        # 需持有 self._lock
+        executor = self._executors[slot]
+        if executor is None:
+            context = multiprocessing.get_context(start_method())
+            # 每個行程使用自己的進度佇列：被終止的工作行程可能讓佇列無法再使用
+            progress_queue = context.Queue() if self.on_progress else None
+            executor = ProcessPoolExecutor(max_workers=1, mp_context=context,
+                                           initializer=_init_worker, initargs=(progress_queue,))
+            self._executors[slot] = executor
+            if progress_queue is not None:
+                threading.Thread(target=self._forward_progress, args=(slot, executor, progress_queue),
+                                 name=f'{self.name} progress {slot}', daemon=True).start()
+        return executor
+
+    def _forward_progress(self, slot: int, executor: ProcessPoolExecutor, progress_queue):
+        while True:
+            try:
+                key, data = progress_queue.get(timeout=1)
+            except queue.Empty:
+                if self._executors[slot] is not executor:
+                    return
+                continue
+            except (EOFError, OSError):
+                return
+            try:
+                self.on_progress(key, data)
+            except Exception as e:
+                print(f"Error handling {self.name} progress: {str(e)}")
+
+    def warm(self):
+        """預先啟動所有工作行程"""
+        with self._lock:
+            executors = [self._ensure_executor(slot) for slot in range(self.workers)]
+        for executor in executors:
+            executor.submit(_warm)
+
+    def _restart_slot(self, slot: int, executor: ProcessPoolExecutor):
+        """終止一個工作行程並在下次使用時重建；executor 已被替換時不做任何事"""
+        with self._lock:
+            if self._executors[slot] is not executor:
+                return
+            self._executors[slot] = None
+            self.restarts += 1
+        self._terminate(executor)
+
+    @staticmethod
+    def _terminate(executor: ProcessPoolExecutor):
+        processes = list((getattr(executor, '_processes', None) or {}).values())
+        executor.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    def shutdown(self):
+        """終止所有工作行程，等待中的工作被取消"""
+        with self._lock:
+            executors, self._executors = self._executors, [None] * self.workers
+            pending, self._pending = list(self._pending), deque()
+        for future, _, _ in pending:
+            future.cancel()
+        for executor in executors:
+            if executor is not None:
+                self._terminate(executor)
+
+    def submit(self, func: Callable, *args) -> Future:
+        future = Future()
+        with self._lock:
+            self._pending.append((future, func, args))
+        self._dispatch()
+        return future
+
+    def _dispatch(self):
+        """把等待中的工作交給空閒的工作行程"""
+        while True:
+            with self._lock:
+                if not self._idle or not self._pending:
+                    return
+                future, func, args = self._pending.popleft()
+                if not future.set_running_or_notify_cancel():
+                    # 等待期間已被取消或逾時
+                    continue
+                slot = self._idle.pop()
+                executor = self._ensure_executor(slot)
+                self._running[future] = (slot, executor)
+            try:
+                job = executor.submit(func, *args)
+            except (BrokenProcessPool, RuntimeError) as e:
+                job = Future()
+                job.set_exception(BrokenProcessPool(str(e)))
+            job.add_done_callback(lambda job, future=future: self._finish(future, job))
+
+    def _finish(self, future: Future, job: Future):
+        with self._lock:
+            entry = self._running.pop(future, None)
+        if entry is None:
+            # 已因逾時而終止，結果由 kill() 處理
+            return
+        slot, executor = entry
+        error = None if job.cancelled() else job.exception()
+        if job.cancelled() or isinstance(error, BrokenProcessPool):
+            self._restart_slot(slot, executor)
+            error = YtDlpError(f'{self.name} worker exited unexpectedly')
+        with self._lock:
+            self._idle.append(slot)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(job.result())
+        self._dispatch()
+
+    def kill(self, future: Future, error: Exception) -> bool:
+        """中止 submit() 回傳的工作；執行中時只終止執行它的工作行程，回傳是否已中止"""
+        if future.cancel():
+            return True
+        with self._lock:
+            entry = self._running.pop(future, None)
+        if entry is None:
+            return False
+        slot, executor = entry
+        self._restart_slot(slot, executor)
+        with self._lock:
+            self._idle.append(slot)
+        future.set_exception(error)
+        self._dispatch()
+        return True
+
+    def call(self, func: Callable, *args, timeout: Optional[float] = None):
+        """在工作行程中執行 func 並等待結果"""
+        future = self.submit(func, *args)
+        try:
+            return future.result(timeout=timeout or self.timeout)
+        except TimeoutError:
+            # 執行中的工作無法取消，只能終止執行它的工作行程
+            error = YtDlpError(f'{self.name} job timed out')
+            self.kill(future, error)
+            raise error from None
+
+    async def call_async(self, func: Callable, *args, timeout: Optional[float] = None):
+        """call() 的非同步版本，等待時不阻塞事件循環；等待的任務被取消時同時中止工作"""
+        future = self.submit(func, *args)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            error = YtDlpError(f'{self.name} job timed out')
+            self.kill(future, error)
+            raise error from None
+        except asyncio.CancelledError:
+            self.kill(future, YtDlpError(f'{self.name} job cancelled'))
+            raise
+
+    def extract_info(self, url: str, flat: bool = False, timeout: Optional[float] = None) -> Dict:
+        """取得影片資訊，相當於 yt-dlp --dump-json；flat 時只列出播放列表的項目"""
+        options = {'extract_flat': 'in_playlist', 'noplaylist': False} if flat else {}
+        return self.call(_extract_info, url, options, False, timeout=timeout)
+
+    def audio_url(self, url: str, format_spec: str = 'bestaudio', timeout: Optional[float] = None) -> Dict:
+        """解析音訊串流網址，相當於 yt-dlp -f <format_spec> -g；http_headers 為下載該網址時應使用的標頭"""
+        info = self.call(_extract_info, url, {'format': format_spec}, False, timeout=timeout)
+        stream_url = info.get('url') or '\n'.join(f['url'] for f in info.get('requested_formats') or [])
+        if not stream_url:
+            raise YtDlpError('No audio stream found')
+        return {'id': info.get('id'), 'format_id': info.get('format_id'), 'url': stream_url,
+                'http_headers': info.get('http_headers') or {}}
+
+    async def download_async(self, url: str, options: Dict, timeout: Optional[float] = None,
+                             progress_key: Any = None) -> Dict:
+        """下載影片並回傳資訊，下載的檔案路徑在 filepath 欄位；下載進度以 progress_key 回報"""
+        info = await self.call_async(_extract_info, url, options, True, progress_key, timeout=timeout)
+        downloads = info.get('requested_downloads') or []
+        info['filepath'] = downloads[0].get('filepath') if downloads else None
+        return info
@@ -7,7 +7,7 @@ import shutil
 # 添加项目根目录到 Python 路径
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from app import app, db
+from app import app, db, library_indexer
 from models import Song, Playlist
 
 class TestBasicFunctionality(unittest.TestCase):
@@ -59,6 +59,9 @@ class TestBasicFunctionality(unittest.TestCase):
         print(f"File exists: {os.path.exists(self.test_music_file)}")
         print(f"Directory contents: {os.listdir(self.test_music_dir)}")
         
+        # 音樂列表只讀取資料庫，先由索引器同步音樂目錄
+        library_indexer.scan()
+
         response = self.client.get('/music')
         print(f"Response status: {response.status_code}")
         data = response.get_json()
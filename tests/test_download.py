@@ -11,6 +11,7 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from app import app, db, process_download
 from models import Song, DownloadQueue
+from services.content_index import find_local_copy
 
 class TestDownloadFunctionality(unittest.TestCase):
     def setUp(self):
@@ -44,21 +45,16 @@ class TestDownloadFunctionality(unittest.TestCase):
         self.assertEqual(data[0]['song']['title'], 'Test Song')
         self.assertEqual(data[0]['status'], 'pending')
 
-    @patch('subprocess.Popen')
-    def test_add_download_with_url(self, mock_popen):
+    @patch('app.ytdlp_pool.extract_info')
+    def test_add_download_with_url(self, mock_extract):
         """測試通過 URL 添加下載任務"""
         # 模擬 yt-dlp 輸出
-        mock_process = MagicMock()
-        mock_process.communicate.return_value = (
-            json.dumps({
-                'title': 'YouTube Test',
-                'id': 'test123',
-                'thumbnail': 'http://example.com/thumb.jpg',
-                'duration': 180
-            }).encode(),
-            b''
-        )
-        mock_popen.return_value = mock_process
+        mock_extract.return_value = {
+            'title': 'YouTube Test',
+            'id': 'test123',
+            'thumbnail': 'http://example.com/thumb.jpg',
+            'duration': 180
+        }
 
         response = self.client.post('/downloads', 
                                   json={'url': 'https://www.youtube.com/watch?v=test123'})
@@ -68,6 +64,52 @@ class TestDownloadFunctionality(unittest.TestCase):
         self.assertEqual(data['song']['title'], 'YouTube Test')
         self.assertEqual(data['status'], 'pending')
 
+    @patch('app.ytdlp_pool.extract_info')
+    def test_add_download_skips_local_copy(self, mock_extract):
+        """測試本地已有相同歌曲時不再下載"""
+        os.makedirs(app.config['MUSIC_DIR'], exist_ok=True)
+        local_path = os.path.join(app.config['MUSIC_DIR'], 'test_local_copy.mp3')
+        with open(local_path, 'wb') as f:
+            f.write(b'audio')
+        self.addCleanup(os.remove, local_path)
+        local_song = Song(title='Test Song', artist='Artist', duration=180,
+                          source='local', local_path=local_path)
+        db.session.add(local_song)
+        db.session.commit()
+
+        mock_extract.return_value = {
+            'title': 'Artist - Test Song (Official Video)',
+            'id': 'test123',
+            'duration': 181
+        }
+
+        response = self.client.post('/downloads',
+                                  json={'url': 'https://www.youtube.com/watch?v=test123'})
+        self.assertEqual(response.status_code, 200)
+
+        data = json.loads(response.data)
+        self.assertEqual(data['status'], 'skipped')
+        self.assertEqual(data['duplicate_of']['id'], local_song.id)
+        self.assertEqual(DownloadQueue.query.count(), 0)
+
+    def test_find_local_copy_requires_full_title_and_artist(self):
+        """測試只有部分標題相同或沒有歌手資訊的本地歌曲不視為相同音訊"""
+        os.makedirs(app.config['MUSIC_DIR'], exist_ok=True)
+        local_path = os.path.join(app.config['MUSIC_DIR'], 'test_intro.mp3')
+        with open(local_path, 'wb') as f:
+            f.write(b'audio')
+        self.addCleanup(os.remove, local_path)
+        db.session.add_all([
+            Song(title='Intro', artist='Local Band', duration=180, source='local', local_path=local_path),
+            Song(title='Love', duration=180, source='local', local_path=local_path)
+        ])
+        db.session.commit()
+
+        self.assertIsNone(find_local_copy('Other Artist - Intro (Official Video)', 180))
+        self.assertIsNone(find_local_copy('Love', 180))
+        self.assertIsNone(find_local_copy('Local Band - Intro Remix', 180))
+        self.assertEqual(find_local_copy('Local Band - Intro [Official Audio]', 181).title, 'Intro')
+
     def test_add_download_with_existing_song(self):
         """測試通過現有歌曲 ID 添加下載任務"""
         # 創建測試歌曲
@@ -114,15 +156,36 @@ class TestDownloadFunctionality(unittest.TestCase):
         data = json.loads(response.data)
         self.assertIn('Cannot cancel completed or failed download', data['error'])
 
+    def test_cancelled_during_download_removes_file(self):
+        """測試下載期間被取消的任務刪除已下載的檔案"""
+        os.makedirs(app.config['MUSIC_DIR'], exist_ok=True)
+        filepath = os.path.join(app.config['MUSIC_DIR'], 'Cancelled Song.mp3')
+        song = Song(title='Cancelled Song', source='youtube', url='https://youtube.com/watch?v=cancel')
+        download = DownloadQueue(song=song, status='pending')
+        db.session.add(download)
+        db.session.commit()
+
+        async def fake_download(url, options, progress_key=None):
+            with open(filepath, 'wb') as f:
+                f.write(b'audio')
+            # 下載完成前使用者取消任務
+            self.client.delete(f'/downloads/{progress_key}')
+            return {'id': 'cancel', 'filepath': filepath}
+
+        with patch('app.download_pool.download_async', fake_download):
+            asyncio.run(process_download(download.id))
+
+        self.assertFalse(os.path.exists(filepath))
+        db.session.expire_all()
+        self.assertEqual(db.session.get(DownloadQueue, download.id).status, 'cancelled')
+        self.assertIsNone(db.session.get(Song, song.id).local_path)
+
     @pytest.mark.asyncio
     async def test_process_download(self):
         """測試下載處理邏輯"""
         # 模擬下載過程
-        with patch('asyncio.create_subprocess_exec') as mock_exec:
-            mock_process = MagicMock()
-            mock_process.communicate = MagicMock(return_value=(b'', b''))
-            mock_process.returncode = 0
-            mock_exec.return_value = mock_process
+        with patch('app.download_pool.download_async') as mock_download:
+            mock_download.return_value = {'id': 'test123', 'filepath': None}
 
             # 創建測試數據
             song = Song(
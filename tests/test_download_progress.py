@@ -0,0 +1,126 @@
+import os
+import sys
+import json
+import time
+import unittest
+
+# 添加項目根目錄到 Python 路徑
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, db, download_progress
+from models import DownloadQueue, Song
+from services import ytdlp_pool as ytdlp_worker
+from services.download_progress import DownloadProgress
+from services.ytdlp_pool import YtDlpPool
+
+def report_progress(key):
+    """在工作行程中模擬 yt-dlp 的進度回呼"""
+    ytdlp_worker._progress_key = key
+    for downloaded in (25, 50, 75):
+        ytdlp_worker._progress_hook({'status': 'downloading', 'downloaded_bytes': downloaded,
+                                     'total_bytes': 100, 'speed': 10.0, 'eta': 3, 'info_dict': {}})
+    ytdlp_worker._progress_hook({'status': 'finished', 'downloaded_bytes': 100, 'total_bytes': 100})
+    ytdlp_worker._progress_key = None
+
+def read_event(iterator):
+    chunk = next(iterator)
+    chunk = chunk.decode() if isinstance(chunk, bytes) else chunk
+    event, data = chunk.strip().split('\n')
+    return event[len('event: '):], json.loads(data[len('data: '):])
+
+class TestDownloadProgress(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        self.app_context = app.app_context()
+        self.app_context.push()
+        self.client = app.test_client()
+        db.create_all()
+        song = Song(title='Progress Song', source='youtube', url='https://www.youtube.com/watch?v=progress')
+        self.download = DownloadQueue(song=song, status='downloading')
+        db.session.add(self.download)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_progress_from_worker_process(self):
+        """測試工作行程中的進度回報傳回主行程，並限制回報頻率"""
+        received = []
+        pool = YtDlpPool(workers=1, on_progress=lambda key, data: received.append((key, data)))
+        try:
+            pool.call(report_progress, 7)
+            deadline = time.monotonic() + 5
+            while (not received or received[-1][1]['status'] != 'finished') and time.monotonic() < deadline:
+                time.sleep(0.01)
+        finally:
+            pool.shutdown()
+        # 連續的 downloading 回報只送出第一筆，finished 一定送出
+        self.assertEqual([data['status'] for _, data in received], ['downloading', 'finished'])
+        self.assertEqual(received[0], (7, {'status': 'downloading', 'downloaded_bytes': 25, 'total_bytes': 100,
+                                           'speed': 10.0, 'eta': 3}))
+
+    def test_throttled_persistence(self):
+        """測試進度即時送給訂閱者，但只定期寫入資料庫"""
+        progress = DownloadProgress(app, persist_interval=60)
+        subscriber = progress.subscribe()
+        progress.update(self.download.id, 'downloading')
+        self.assertEqual(subscriber.get_nowait()['status'], 'downloading')
+        for downloaded in (10, 20, 30):
+            progress.on_ytdlp_progress(self.download.id, {'status': 'downloading', 'downloaded_bytes': downloaded,
+                                                          'total_bytes': 40, 'speed': 5.0, 'eta': 2})
+        self.assertEqual([subscriber.get_nowait()['percent'] for _ in range(3)], [25.0, 50.0, 75.0])
+        self.assertEqual(progress.get(self.download.id)['downloaded_bytes'], 30)
+
+        db.session.expire_all()
+        stored = db.session.get(DownloadQueue, self.download.id)
+        self.assertEqual((stored.progress, stored.downloaded_bytes, stored.total_bytes), (25.0, 10, 40))
+
+        progress.update(self.download.id, 'completed')
+        self.assertEqual(subscriber.get_nowait()['status'], 'completed')
+        self.assertIsNone(progress.get(self.download.id))
+        db.session.expire_all()
+        self.assertEqual(db.session.get(DownloadQueue, self.download.id).progress, 100.0)
+        progress.unsubscribe(subscriber)
+
+    def test_late_progress_after_finish_ignored(self):
+        """測試下載結束後才送達的進度不會讓下載以 pending 重新出現"""
+        progress = DownloadProgress(app, persist_interval=0)
+        progress.update(self.download.id, 'downloading')
+        progress.update(self.download.id, 'cancelled')
+        subscriber = progress.subscribe()
+        progress.on_ytdlp_progress(self.download.id, {'status': 'downloading', 'downloaded_bytes': 10, 'total_bytes': 40})
+        self.assertIsNone(progress.update(self.download.id, downloaded_bytes=20, total_bytes=40))
+        self.assertIsNone(progress.get(self.download.id))
+        self.assertEqual(progress.snapshot(), [])
+        self.assertTrue(subscriber.empty())
+        db.session.expire_all()
+        self.assertIsNone(db.session.get(DownloadQueue, self.download.id).progress)
+        progress.unsubscribe(subscriber)
+
+    def test_event_stream_and_list(self):
+        """測試 /downloads/events 推送進度，/downloads 包含進度欄位"""
+        download_progress.update(self.download.id, 'downloading')
+        response = self.client.get('/downloads/events')
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        events = iter(response.response)
+        event, data = read_event(events)
+        self.assertEqual(event, 'snapshot')
+        self.assertIn(self.download.id, [item['id'] for item in data])
+
+        download_progress.on_ytdlp_progress(self.download.id, {'status': 'downloading', 'downloaded_bytes': 512,
+                                                               'total_bytes': 1024})
+        event, data = read_event(events)
+        self.assertEqual(event, 'progress')
+        self.assertEqual((data['id'], data['percent'], data['phase']), (self.download.id, 50.0, 'downloading'))
+
+        listed = self.client.get('/downloads').get_json()
+        self.assertEqual(listed[0]['progress'], 50.0)
+        self.assertEqual(listed[0]['song']['title'], 'Progress Song')
+
+        response.close()
+        download_progress.update(self.download.id, 'cancelled')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,189 @@
+import os
+import sys
+import asyncio
+import time
+import unittest
+from collections import Counter
+from datetime import datetime, timedelta
+
+# 添加項目根目錄到 Python 路徑
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, db
+from models import sync_schema, DownloadQueue, Playlist, Song
+from services.download_scheduler import DownloadScheduler, PRIORITY_BULK, PRIORITY_USER, download_host
+
+class TestDownloadScheduler(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        self.app_context = app.app_context()
+        self.app_context.push()
+        self.client = app.test_client()
+        db.create_all()
+        self.order = []
+        self.running = Counter()
+        self.max_running = Counter()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def add_download(self, url, priority=PRIORITY_BULK, **kwargs):
+        song = Song(title=url, source='youtube', url=url)
+        download = DownloadQueue(song=song, status=kwargs.pop('status', 'pending'), priority=priority, **kwargs)
+        db.session.add(download)
+        db.session.commit()
+        return download.id
+
+    async def fake_download(self, download_id):
+        with app.app_context():
+            host = download_host(db.session.get(DownloadQueue, download_id).song.url)
+        self.order.append(download_id)
+        for key in (host, 'all'):
+            self.running[key] += 1
+            self.max_running[key] = max(self.max_running[key], self.running[key])
+        await asyncio.sleep(0.1)
+        for key in (host, 'all'):
+            self.running[key] -= 1
+        with app.app_context():
+            db.session.get(DownloadQueue, download_id).status = 'completed'
+            db.session.commit()
+
+    def run_scheduler(self, scheduler, count):
+        scheduler.start()
+        try:
+            deadline = time.monotonic() + 10
+            while len(self.order) < count or self.running['all']:
+                self.assertLess(time.monotonic(), deadline)
+                time.sleep(0.02)
+        finally:
+            scheduler.stop()
+
+    def test_download_host(self):
+        """測試同一服務的不同主機名稱視為同一主機"""
+        self.assertEqual(download_host('https://youtu.be/abc'), 'youtube.com')
+        self.assertEqual(download_host('https://m.youtube.com/watch?v=abc'), 'youtube.com')
+        self.assertEqual(download_host('https://www.bilibili.com/video/BV1'), 'bilibili.com')
+
+    def test_concurrency_and_host_limits(self):
+        """測試同時下載數量與每個主機的上限"""
+        for i in range(4):
+            self.add_download(f'https://www.youtube.com/watch?v=video{i}')
+            self.add_download(f'https://www.bilibili.com/video/BV{i}')
+        scheduler = DownloadScheduler(app, self.fake_download, concurrency=3, per_host=2, poll_interval=0.05)
+        self.run_scheduler(scheduler, 8)
+
+        self.assertEqual(self.max_running['all'], 3)
+        self.assertEqual(self.max_running['youtube.com'], 2)
+        self.assertEqual(self.max_running['bilibili.com'], 2)
+        db.session.expire_all()
+        self.assertEqual(db.session.query(DownloadQueue).filter_by(status='completed').count(), 8)
+        self.assertEqual(db.session.query(DownloadQueue).filter(DownloadQueue.lease_owner.isnot(None)).count(), 0)
+
+    def test_priority(self):
+        """測試使用者加入的下載優先於批次下載"""
+        bulk = [self.add_download(f'https://www.youtube.com/watch?v=bulk{i}') for i in range(3)]
+        user = self.add_download('https://www.youtube.com/watch?v=user', priority=PRIORITY_USER)
+        scheduler = DownloadScheduler(app, self.fake_download, concurrency=1, poll_interval=0.05)
+        self.run_scheduler(scheduler, 4)
+        self.assertEqual(self.order, [user] + bulk)
+
+    def test_cancel_running_download(self):
+        """測試取消執行中的下載時立即中止任務，不等待下載完成"""
+        download_id = self.add_download('https://www.youtube.com/watch?v=cancel')
+        started = []
+        cancelled = []
+
+        async def slow_download(download_id):
+            started.append(download_id)
+            try:
+                await asyncio.sleep(30)
+            except asyncio.CancelledError:
+                cancelled.append(download_id)
+                raise
+
+        scheduler = DownloadScheduler(app, slow_download, poll_interval=0.05)
+        scheduler.start()
+        try:
+            deadline = time.monotonic() + 10
+            while not started:
+                self.assertLess(time.monotonic(), deadline)
+                time.sleep(0.02)
+            scheduler.cancel(download_id)
+            while scheduler.stats()['running']:
+                self.assertLess(time.monotonic(), deadline)
+                time.sleep(0.02)
+        finally:
+            scheduler.stop()
+        self.assertEqual(cancelled, [download_id])
+        db.session.expire_all()
+        self.assertIsNone(db.session.get(DownloadQueue, download_id).lease_owner)
+
+    def test_candidates_use_index(self):
+        """測試選取任務時由索引排序，不必讀取所有 pending 任務再排序"""
+        scheduler = DownloadScheduler(app, self.fake_download)
+        sql = str(scheduler.candidates().statement.compile(db.engine, compile_kwargs={'literal_binds': True}))
+        plan = ' '.join(row[-1] for row in db.session.execute(db.text('EXPLAIN QUERY PLAN ' + sql)))
+        self.assertIn('ix_download_queue_pending_order', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_null_priority_backfilled(self):
+        """測試新增欄位前建立的任務補上預設優先順序"""
+        download_id = self.add_download('https://www.youtube.com/watch?v=old')
+        db.session.execute(db.text('UPDATE download_queue SET priority = NULL'))
+        db.session.commit()
+        sync_schema()
+        db.session.expire_all()
+        self.assertEqual(db.session.get(DownloadQueue, download_id).priority, PRIORITY_BULK)
+
+    def test_lease_is_exclusive(self):
+        """測試同一任務只會被一個排程器取得"""
+        download_id = self.add_download('https://www.youtube.com/watch?v=lease')
+        first = DownloadScheduler(app, self.fake_download)
+        second = DownloadScheduler(app, self.fake_download)
+        self.assertTrue(first._lease(download_id))
+        self.assertFalse(second._lease(download_id))
+        self.assertEqual(db.session.get(DownloadQueue, download_id).lease_owner, first.owner)
+
+    def test_recover_expired_leases(self):
+        """測試行程中斷後租約到期的下載回到隊列，次數過多時標記為失敗"""
+        expired = datetime.utcnow() - timedelta(minutes=5)
+        requeued = self.add_download('https://www.youtube.com/watch?v=a', status='downloading',
+                                     lease_owner='gone', lease_expires_at=expired, attempts=1)
+        failed = self.add_download('https://www.youtube.com/watch?v=b', status='downloading',
+                                   lease_owner='gone', lease_expires_at=expired, attempts=3)
+        active = self.add_download('https://www.youtube.com/watch?v=c', status='downloading',
+                                   lease_owner='alive', lease_expires_at=expired + timedelta(hours=1), attempts=1)
+        scheduler = DownloadScheduler(app, self.fake_download, max_attempts=3)
+        self.assertEqual(scheduler.recover_expired(), 2)
+
+        db.session.expire_all()
+        self.assertEqual(db.session.get(DownloadQueue, requeued).status, 'pending')
+        self.assertEqual(db.session.get(DownloadQueue, failed).status, 'failed')
+        self.assertEqual(db.session.get(DownloadQueue, active).status, 'downloading')
+
+    def test_download_playlist(self):
+        """測試將播放列表加入下載隊列"""
+        playlist = Playlist(name='Bulk')
+        songs = [Song(title=f'Bulk {i}', source='youtube', source_id=f'bulk{i}',
+                      url=f'https://www.youtube.com/watch?v=bulk{i}') for i in range(3)]
+        songs[0].local_path = '/music/bulk0.mp3'
+        db.session.add(playlist)
+        for song in songs:
+            playlist.songs.append(song)
+        db.session.commit()
+
+        response = self.client.post(f'/playlists/{playlist.id}/download')
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual(data['queued'], 2)
+        self.assertEqual(data['skipped'], 1)
+        self.assertEqual({d.priority for d in db.session.query(DownloadQueue)}, {PRIORITY_BULK})
+
+        # 已在隊列中的歌曲不重複加入
+        response = self.client.post(f'/playlists/{playlist.id}/download')
+        self.assertEqual(response.get_json()['queued'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
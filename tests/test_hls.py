@@ -0,0 +1,146 @@
+import os
+import sys
+import unittest
+from unittest.mock import patch
+import tempfile
+import shutil
+
+# 添加項目根目錄到 Python 路徑
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, db
+from models import Song
+from services.hls import HlsSegmenter
+from services.transcoder import DiskCache
+
+# 依序寫入每個分段的起始時間，寫完一段才建立下一段，並記錄每次編碼的範圍
+ENCODE_SCRIPT = '''
+import sys, time
+pattern, start, stop, duration, log = sys.argv[1], int(sys.argv[2]), int(sys.argv[3]), int(sys.argv[4]), sys.argv[5]
+open(log, "a").write(f"{start}-{stop}\\n")
+for index in range(start, stop):
+    with open(pattern % index, "w") as f:
+        f.write(f"segment@{index * duration}")
+    time.sleep(0.05)
+'''
+
+
+def fake_encode_command(self, src_path, dest_pattern, start, stop):
+    """以寫入分段起始時間代替 ffmpeg"""
+    return [sys.executable, '-c', ENCODE_SCRIPT, dest_pattern, str(start), str(stop),
+            str(self.segment_duration), self.encode_log]
+
+
+@patch.object(HlsSegmenter, 'build_encode_command', fake_encode_command)
+@patch.object(HlsSegmenter, 'probe_duration', lambda self, src_path: 20.0)
+class TestHlsFunctionality(unittest.TestCase):
+    def setUp(self):
+        self.test_music_dir = tempfile.mkdtemp()
+        self.cache_dir = tempfile.mkdtemp()
+        app.config['MUSIC_DIR'] = self.test_music_dir
+        app.config['TESTING'] = True
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+
+        self.source = os.path.join(self.test_music_dir, 'video.mkv')
+        with open(self.source, 'wb') as f:
+            f.write(b'video content')
+
+        self.segmenter = HlsSegmenter(DiskCache(self.cache_dir, max_bytes=1024 * 1024),
+                                      segment_duration=6, poll_interval=0.01)
+        self.segmenter.encode_log = os.path.join(self.test_music_dir, 'encodes.log')
+        self.segmenter_patch = patch('app.hls_segmenter', self.segmenter)
+        self.segmenter_patch.start()
+
+        self.app_context = app.app_context()
+        self.app_context.push()
+        self.client = app.test_client()
+        db.create_all()
+
+        self.song = Song(title='video.mkv', source='local', local_path=self.source)
+        db.session.add(self.song)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        self.segmenter_patch.stop()
+        shutil.rmtree(self.test_music_dir)
+        shutil.rmtree(self.cache_dir)
+
+    def test_playlist(self):
+        """測試產生 m3u8 播放清單"""
+        response = self.client.get(f'/hls/{self.song.id}/index.m3u8')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/vnd.apple.mpegurl')
+
+        lines = response.data.decode().splitlines()
+        self.assertEqual(lines[0], '#EXTM3U')
+        self.assertEqual([line for line in lines if line.endswith('.ts')],
+                         ['0.ts', '1.ts', '2.ts', '3.ts'])
+        self.assertIn('#EXTINF:2.000,', lines)
+        self.assertEqual(lines[-1], '#EXT-X-ENDLIST')
+
+    def encodes(self):
+        with open(self.segmenter.encode_log) as f:
+            return f.read().split()
+
+    def segment_names(self):
+        stat = os.stat(self.source)
+        return [self.segmenter.segment_name(self.source, stat.st_size, stat.st_mtime_ns, i) for i in range(4)]
+
+    def test_segments_from_one_continuous_encode(self):
+        """測試從請求的分段開始以一次連續編碼產生之後的所有分段"""
+        response = self.client.get(f'/hls/{self.song.id}/1.ts')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'video/mp2t')
+        self.assertEqual(response.data, b'segment@6')
+        response.close()
+
+        for index in (2, 3):
+            response = self.client.get(f'/hls/{self.song.id}/{index}.ts')
+            self.assertEqual(response.data, f'segment@{index * 6}'.encode())
+            response.close()
+        # 後續分段來自同一次編碼，播放位置之前的分段不會被產生
+        self.assertEqual(self.encodes(), ['1-4'])
+        self.assertIsNone(self.segmenter.cache.get(self.segment_names()[0]))
+        self.assertEqual([name for name in os.listdir(self.cache_dir) if name.endswith('.part')], [])
+
+    def test_seek_back_encodes_until_existing_encode(self):
+        """測試跳回前面的位置時只編碼到既有編碼的起點為止"""
+        self.assertEqual(self.client.get(f'/hls/{self.song.id}/2.ts').data, b'segment@12')
+        self.assertEqual(self.client.get(f'/hls/{self.song.id}/0.ts').data, b'segment@0')
+        self.assertEqual(self.client.get(f'/hls/{self.song.id}/1.ts').data, b'segment@6')
+        self.assertEqual(self.client.get(f'/hls/{self.song.id}/3.ts').data, b'segment@18')
+        self.assertEqual(self.encodes(), ['2-4', '0-2'])
+
+    def test_encode_failure(self):
+        """測試編碼失敗時回應錯誤"""
+        with patch.object(HlsSegmenter, 'build_encode_command',
+                          lambda *args: [sys.executable, '-c', 'import sys; sys.exit("bad input")']):
+            response = self.client.get(f'/hls/{self.song.id}/0.ts')
+        self.assertEqual(response.status_code, 500)
+        self.assertIn('bad input', response.get_json()['error'])
+
+    def test_duration_cache_bounded(self):
+        """測試檔案長度快取只保留每個檔案的最新版本，並限制數量"""
+        self.segmenter.max_durations = 2
+        for mtime_ns in range(3):
+            self.segmenter.duration(self.source, 1, mtime_ns)
+        self.assertEqual(len(self.segmenter._durations), 1)
+        for i in range(3):
+            self.segmenter.duration(f'{self.source}.{i}', 1, 0)
+        self.assertEqual(len(self.segmenter._durations), 2)
+
+    def test_segment_out_of_range(self):
+        """測試超出範圍的分段"""
+        response = self.client.get(f'/hls/{self.song.id}/4.ts')
+        self.assertEqual(response.status_code, 404)
+
+    def test_unknown_song(self):
+        """測試不存在的歌曲"""
+        response = self.client.get('/hls/9999/index.m3u8')
+        self.assertEqual(response.status_code, 404)
+
+if __name__ == '__main__':
+    unittest.main()
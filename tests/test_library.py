@@ -0,0 +1,273 @@
+import os
+import sys
+import unittest
+import tempfile
+import shutil
+import json
+import wave
+from unittest.mock import patch
+
+from mutagen.id3 import APIC, TIT2, TPE1
+from mutagen.wave import WAVE
+
+# 添加項目根目錄到 Python 路徑
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, db, library_indexer
+from models import Song, Playlist
+import services.library_indexer as library_indexer_module
+from services.ytdlp_pool import start_method
+
+class TestLibraryIndexer(unittest.TestCase):
+    def setUp(self):
+        self.test_music_dir = tempfile.mkdtemp()
+        self.cover_dir = tempfile.mkdtemp()
+        app.config['MUSIC_DIR'] = self.test_music_dir
+        app.config['COVER_DIR'] = self.cover_dir
+        self.cover_patch = patch.object(library_indexer, 'cover_dir', self.cover_dir)
+        self.cover_patch.start()
+        app.config['TESTING'] = True
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.app_context = app.app_context()
+        self.app_context.push()
+        self.client = app.test_client()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        self.cover_patch.stop()
+        shutil.rmtree(self.test_music_dir)
+        shutil.rmtree(self.cover_dir)
+
+    def _write(self, name, content=b'test content'):
+        path = os.path.join(self.test_music_dir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def test_scan_adds_new_files(self):
+        """測試掃描新增音樂檔案並忽略其他檔案"""
+        self._write('a.mp3')
+        self._write('b.flac')
+        self._write('notes.txt')
+
+        stats = library_indexer.scan()
+        self.assertEqual(stats['added'], 2)
+        titles = sorted(song.title for song in Song.query.filter_by(source='local'))
+        self.assertEqual(titles, ['a.mp3', 'b.flac'])
+
+        # 沒有變更時不寫入任何資料
+        stats = library_indexer.scan()
+        self.assertEqual((stats['added'], stats['updated'], stats['removed']), (0, 0, 0))
+
+    def test_scan_detects_changes_and_deletions(self):
+        """測試偵測修改與刪除的檔案"""
+        path_a = self._write('a.mp3')
+        path_b = self._write('b.mp3')
+        library_indexer.scan()
+
+        with open(path_a, 'ab') as f:
+            f.write(b'more')
+        os.remove(path_b)
+
+        stats = library_indexer.scan()
+        self.assertEqual(stats['updated'], 1)
+        self.assertEqual(stats['removed'], 1)
+        song = Song.query.filter_by(local_path=path_a).one()
+        self.assertEqual(song.file_size, os.path.getsize(path_a))
+        self.assertIsNone(Song.query.filter_by(local_path=path_b).first())
+
+    def test_deleted_file_removed_from_playlists(self):
+        """測試刪除的本地檔案同時從播放列表中移除"""
+        path = self._write('a.mp3')
+        library_indexer.scan()
+        song = Song.query.filter_by(local_path=path).one()
+        playlist = Playlist(name='Test Playlist')
+        playlist.songs.append(song)
+        db.session.add(playlist)
+        db.session.commit()
+
+        os.remove(path)
+        library_indexer.scan()
+        db.session.expire_all()
+        self.assertEqual(len(playlist.songs.all()), 0)
+
+    def test_deleted_download_keeps_song(self):
+        """測試下載歌曲的檔案被刪除時只清除本地路徑"""
+        path = self._write('downloaded.mp3')
+        song = Song(title='Downloaded', source='youtube', source_id='abc', local_path=path)
+        db.session.add(song)
+        db.session.commit()
+
+        library_indexer.scan()
+        self.assertEqual(Song.query.count(), 1)
+
+        os.remove(path)
+        library_indexer.scan()
+        db.session.expire_all()
+        self.assertIsNone(db.session.get(Song, song.id).local_path)
+
+    def test_missing_music_dir_keeps_songs(self):
+        """測試音樂目錄消失（例如磁碟未掛載）時不刪除任何歌曲與播放列表"""
+        path = self._write('a.mp3')
+        library_indexer.scan()
+        song = Song.query.filter_by(local_path=path).one()
+        playlist = Playlist(name='Test Playlist')
+        playlist.songs.append(song)
+        db.session.add(playlist)
+        db.session.commit()
+
+        shutil.rmtree(self.test_music_dir)
+        try:
+            stats = library_indexer.scan()
+            self.assertEqual(stats['removed'], 0)
+            self.assertIn('error', stats)
+            stats = library_indexer.scan_paths([path])
+            self.assertEqual(stats['removed'], 0)
+        finally:
+            os.makedirs(self.test_music_dir)
+        db.session.expire_all()
+        self.assertIsNotNone(db.session.get(Song, song.id))
+        self.assertEqual([s.id for s in playlist.songs], [song.id])
+
+    def test_unreadable_subdirectory_aborts_scan(self):
+        """測試子目錄無法讀取時放棄同步，不把其中的檔案當成已刪除"""
+        path = self._write('album/a.mp3')
+        library_indexer.scan()
+        original_scandir = os.scandir
+
+        def scandir(directory):
+            if directory.endswith('album'):
+                raise PermissionError(13, 'Permission denied', directory)
+            return original_scandir(directory)
+
+        with patch('os.scandir', scandir):
+            stats = library_indexer.scan()
+        self.assertEqual(stats['removed'], 0)
+        self.assertIsNotNone(Song.query.filter_by(local_path=path).first())
+
+    def test_scan_paths_only_touches_given_paths(self):
+        """測試增量更新只處理指定的檔案"""
+        path_a = self._write('a.mp3')
+        library_indexer.scan()
+        path_b = self._write('b.mp3')
+        os.remove(path_a)
+
+        stats = library_indexer.scan_paths([path_b])
+        self.assertEqual((stats['added'], stats['removed']), (1, 0))
+        self.assertIsNotNone(Song.query.filter_by(local_path=path_a).first())
+
+        stats = library_indexer.scan_paths([path_a])
+        self.assertEqual(stats['removed'], 1)
+
+    def _write_tagged_wav(self, name, title, artist, seconds=2):
+        path = os.path.join(self.test_music_dir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with wave.open(path, 'wb') as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(8000)
+            f.writeframes(b'\x00\x00' * 8000 * seconds)
+        audio = WAVE(path)
+        audio.add_tags()
+        audio.tags.add(TIT2(encoding=3, text=title))
+        audio.tags.add(TPE1(encoding=3, text=artist))
+        audio.tags.add(APIC(encoding=3, mime='image/jpeg', type=3, desc='cover', data=b'fake jpeg'))
+        audio.save()
+        return path
+
+    def test_recursive_scan_extracts_tags(self):
+        """測試遞迴掃描子目錄並讀取標籤、長度與封面"""
+        path = self._write_tagged_wav(os.path.join('Artist', 'Album', 'track.wav'), '歌名', '歌手')
+        self._write(os.path.join('.hidden.mp3'))
+
+        library_indexer.scan()
+        song = Song.query.filter_by(local_path=path).one()
+        self.assertEqual(song.title, '歌名')
+        self.assertEqual(song.artist, '歌手')
+        self.assertEqual(song.duration, 2)
+        self.assertEqual(song.bitrate, 128)
+        self.assertTrue(song.thumbnail_url.startswith('/covers/'))
+        self.assertEqual(Song.query.count(), 1)
+
+        response = self.client.get(song.thumbnail_url)
+        self.assertEqual(response.data, b'fake jpeg')
+        response.close()
+
+    def test_parallel_extraction(self):
+        """測試以工作行程平行讀取標籤"""
+        for i in range(4):
+            self._write_tagged_wav(f'track{i}.wav', f'Song {i}', 'Artist', seconds=1)
+
+        contexts = []
+        original_executor = library_indexer_module.ProcessPoolExecutor
+
+        def executor(*args, **kwargs):
+            contexts.append(kwargs.get('mp_context'))
+            return original_executor(*args, **kwargs)
+
+        with patch.object(library_indexer_module, 'PARALLEL_THRESHOLD', 1), \
+                patch.object(library_indexer, 'workers', 2), \
+                patch.object(library_indexer_module, 'ProcessPoolExecutor', executor):
+            stats = library_indexer.scan()
+        self.assertEqual(stats['added'], 4)
+        # 工作行程不以 fork 建立
+        self.assertEqual([context.get_start_method() for context in contexts], [start_method()])
+        titles = sorted(song.title for song in Song.query.all())
+        self.assertEqual(titles, [f'Song {i}' for i in range(4)])
+
+    def test_scan_progress_endpoint(self):
+        """測試掃描進度與速度"""
+        self._write('a.mp3')
+        library_indexer.scan()
+
+        response = self.client.get('/library/scan')
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data['state'], 'idle')
+        self.assertEqual(data['processed'], 1)
+        self.assertEqual(data['last_result']['added'], 1)
+        self.assertIn('files_per_second', data)
+
+    def test_duplicate_groups(self):
+        """測試以內容雜湊找出重複檔案"""
+        content = os.urandom(1024 * 1024)
+        self._write('a.mp3', content)
+        self._write(os.path.join('sub', 'b.mp3'), content)
+        self._write('c.mp3', content[:-1] + b'x')
+        library_indexer.scan()
+
+        response = self.client.get('/library/duplicates')
+        self.assertEqual(response.status_code, 200)
+        groups = json.loads(response.data)
+        self.assertEqual(len(groups), 1)
+        self.assertEqual(sorted(os.path.basename(song['local_path']) for song in groups[0]['songs']),
+                         ['a.mp3', 'b.mp3'])
+
+    def test_content_hash_backfilled_once(self):
+        """測試只為沒有雜湊的歌曲補算雜湊"""
+        path = self._write('a.mp3')
+        library_indexer.scan()
+        song = Song.query.filter_by(local_path=path).one()
+        self.assertIsNotNone(song.content_hash)
+
+        song.content_hash = None
+        db.session.commit()
+        self.assertEqual(library_indexer.scan()['updated'], 1)
+        self.assertEqual(library_indexer.scan()['updated'], 0)
+
+    def test_music_endpoint_reads_database(self):
+        """測試音樂列表不會在請求時掃描目錄"""
+        self._write('a.mp3')
+        response = self.client.get('/music')
+        self.assertEqual(json.loads(response.data), [])
+
+        library_indexer.scan()
+        response = self.client.get('/music')
+        self.assertEqual([song['title'] for song in json.loads(response.data)], ['a.mp3'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import os
+import sys
+import unittest
+import tempfile
+import shutil
+import json
+
+# 添加項目根目錄到 Python 路徑
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, db, library_indexer
+from models import Song, Playlist
+from services.library_search import build_match_query, rebuild_search_index
+
+class TestLocalSearch(unittest.TestCase):
+    def setUp(self):
+        self.test_music_dir = tempfile.mkdtemp()
+        app.config['MUSIC_DIR'] = self.test_music_dir
+        app.config['TESTING'] = True
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.app_context = app.app_context()
+        self.app_context.push()
+        self.client = app.test_client()
+        db.create_all()
+
+        db.session.add_all([
+            Song(title='晴天', artist='周杰倫', source='youtube', source_id='a'),
+            Song(title='夜に駆ける', artist='YOASOBI', source='youtube', source_id='b'),
+            Song(title='Bohemian Rhapsody', artist='Queen', source='youtube', source_id='c'),
+            Song(title='Queen of Hearts', artist='Someone', source='youtube', source_id='d'),
+            Playlist(name='周末歌單'),
+        ])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        shutil.rmtree(self.test_music_dir)
+
+    def _search(self, query):
+        response = self.client.get('/search/local', query_string={'q': query})
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.data)
+
+    def test_build_match_query(self):
+        """測試查詢字串的轉換"""
+        self.assertEqual(build_match_query('晴天 jay'), '"晴 天" AND "jay"*')
+        self.assertEqual(build_match_query('"*'), None)
+
+    def test_cjk_substring(self):
+        """測試中日文標題中間的字也能被搜索"""
+        self.assertEqual([s['title'] for s in self._search('杰倫')['songs']], ['晴天'])
+        self.assertEqual([s['title'] for s in self._search('駆ける')['songs']], ['夜に駆ける'])
+        # 不連續的字不算符合
+        self.assertEqual(self._search('晴倫')['songs'], [])
+
+    def test_prefix_and_ranking(self):
+        """測試前綴比對，標題符合的排在歌手符合之前"""
+        db.session.add_all([Song(title=f'Other {i}', source='youtube', source_id=f'o{i}') for i in range(4)])
+        db.session.commit()
+        songs = self._search('quee')['songs']
+        self.assertEqual([s['title'] for s in songs], ['Queen of Hearts', 'Bohemian Rhapsody'])
+        self.assertGreater(songs[0]['score'], songs[1]['score'])
+
+    def test_playlists(self):
+        """測試搜索播放列表名稱"""
+        data = self._search('周末')
+        self.assertEqual([p['name'] for p in data['playlists']], ['周末歌單'])
+
+    def test_index_follows_updates(self):
+        """測試修改與刪除歌曲後索引同步更新"""
+        song = Song.query.filter_by(source_id='c').first()
+        song.title = 'Radio Ga Ga'
+        db.session.commit()
+        self.assertEqual([s['title'] for s in self._search('radio')['songs']], ['Radio Ga Ga'])
+        self.assertEqual([s['title'] for s in self._search('bohemian')['songs']], [])
+
+        db.session.delete(song)
+        db.session.commit()
+        self.assertEqual(self._search('radio')['songs'], [])
+
+    def test_indexer_writes_are_indexed(self):
+        """測試掃描器批次寫入的歌曲也會被索引"""
+        with open(os.path.join(self.test_music_dir, '稻香.mp3'), 'wb') as f:
+            f.write(b'test content')
+        library_indexer.scan()
+        self.assertEqual([s['title'] for s in self._search('稻香')['songs']], ['稻香.mp3'])
+
+        os.remove(os.path.join(self.test_music_dir, '稻香.mp3'))
+        library_indexer.scan()
+        self.assertEqual(self._search('稻香')['songs'], [])
+
+    def test_rebuild(self):
+        """測試重建索引"""
+        rebuild_search_index()
+        self.assertEqual(len(self._search('queen')['songs']), 2)
+
+    def test_missing_query(self):
+        response = self.client.get('/search/local')
+        self.assertEqual(response.status_code, 400)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import os
+import sys
+import unittest
+import json
+
+# 添加項目根目錄到 Python 路徑
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, db
+from models import Song
+
+class TestMusicListPagination(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.app_context = app.app_context()
+        self.app_context.push()
+        self.client = app.test_client()
+        db.create_all()
+
+        # 建立測試歌曲，部分沒有歌手
+        artists = ['B', None, 'A', 'C', None, 'A', 'B']
+        for i, artist in enumerate(artists):
+            db.session.add(Song(title=f'Song {6 - i}', artist=artist, source='local',
+                                local_path=f'/music/{i}.mp3'))
+        db.session.add(Song(title='Online', source='youtube'))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def _fetch_all(self, **params):
+        """依游標逐頁取回所有歌曲"""
+        pages = []
+        cursor = None
+        while True:
+            query = dict(params)
+            if cursor:
+                query['after'] = cursor
+            response = self.client.get('/music', query_string=query)
+            self.assertEqual(response.status_code, 200)
+            pages.append(json.loads(response.data))
+            cursor = response.headers.get('X-Next-Cursor')
+            if not cursor:
+                return pages
+
+    def test_keyset_pagination_by_id(self):
+        """測試依 ID 分頁"""
+        pages = self._fetch_all(limit=3)
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        ids = [song['id'] for page in pages for song in page]
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(len(set(ids)), 7)
+
+        response = self.client.get('/music', query_string={'limit': 3, 'after': ids[2]})
+        self.assertEqual([song['id'] for song in json.loads(response.data)], ids[3:6])
+
+    def test_sort_by_title(self):
+        """測試依標題排序"""
+        pages = self._fetch_all(limit=2, sort='title')
+        titles = [song['title'] for page in pages for song in page]
+        self.assertEqual(titles, [f'Song {i}' for i in range(7)])
+
+    def test_sort_by_artist_with_nulls(self):
+        """測試依歌手排序（包含空值）並支援倒序"""
+        expected = sorted(Song.query.filter_by(source='local').all(),
+                          key=lambda s: (s.artist is not None, s.artist or '', s.id))
+        pages = self._fetch_all(limit=2, sort='artist')
+        self.assertEqual([song['id'] for page in pages for song in page], [s.id for s in expected])
+
+        pages = self._fetch_all(limit=2, sort='-artist')
+        self.assertEqual([song['id'] for page in pages for song in page],
+                         [s.id for s in reversed(expected)])
+
+    def test_sort_by_added_date(self):
+        """測試依加入時間倒序排序"""
+        pages = self._fetch_all(limit=4, sort='-added')
+        ids = [song['id'] for page in pages for song in page]
+        self.assertEqual(len(ids), 7)
+        self.assertEqual(ids, sorted(ids, reverse=True))
+
+    def test_field_projection(self):
+        """測試只回傳指定的欄位"""
+        response = self.client.get('/music', query_string={'fields': 'title,duration', 'limit': 1})
+        data = json.loads(response.data)
+        self.assertEqual(set(data[0].keys()), {'title', 'duration'})
+        self.assertIn('X-Next-Cursor', response.headers)
+
+    def test_invalid_parameters(self):
+        """測試無效的參數"""
+        self.assertEqual(self.client.get('/music?fields=password').status_code, 400)
+        self.assertEqual(self.client.get('/music?sort=rating').status_code, 400)
+        self.assertEqual(self.client.get('/music?sort=title&after=%%%').status_code, 400)
+
+if __name__ == '__main__':
+    unittest.main()
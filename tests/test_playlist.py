@@ -102,21 +102,16 @@ class TestPlaylistFunctionality(unittest.TestCase):
         self.assertEqual(len(playlist.songs.all()), 1)
         self.assertEqual(playlist.songs[0].title, 'Test Song')
 
-    @patch('subprocess.Popen')
-    def test_add_youtube_url_to_playlist(self, mock_popen):
+    @patch('app.ytdlp_pool.extract_info')
+    def test_add_youtube_url_to_playlist(self, mock_extract):
         """測試通過 YouTube URL 添加歌曲到播放列表"""
         # 模擬 yt-dlp 輸出
-        mock_process = MagicMock()
-        mock_process.communicate.return_value = (
-            json.dumps({
-                'title': 'YouTube Test',
-                'id': 'test123',
-                'thumbnail': 'http://example.com/thumb.jpg',
-                'duration': 180
-            }).encode(),
-            b''
-        )
-        mock_popen.return_value = mock_process
+        mock_extract.return_value = {
+            'title': 'YouTube Test',
+            'id': 'test123',
+            'thumbnail': 'http://example.com/thumb.jpg',
+            'duration': 180
+        }
 
         # 創建測試播放列表
         playlist = Playlist(name='Test Playlist')
@@ -148,23 +143,19 @@ class TestPlaylistFunctionality(unittest.TestCase):
         playlist = db.session.get(Playlist, playlist.id)
         self.assertEqual(len(playlist.songs.all()), 0)
 
-    @patch('subprocess.Popen')
-    def test_import_youtube_playlist(self, mock_popen):
+    @patch('app.ytdlp_pool.extract_info')
+    def test_import_youtube_playlist(self, mock_extract):
         """測試導入 YouTube 播放列表"""
         # 模擬 yt-dlp 輸出
-        mock_process = MagicMock()
-        mock_process.communicate.return_value = (
-            '\n'.join([
-                json.dumps({
-                    'title': f'Song {i}',
-                    'id': f'id{i}',
-                    'thumbnail': f'http://example.com/thumb{i}.jpg',
-                    'duration': 180
-                }) for i in range(3)
-            ]).encode(),
-            b''
-        )
-        mock_popen.return_value = mock_process
+        mock_extract.return_value = {
+            'id': 'test123',
+            'entries': [{
+                'title': f'Song {i}',
+                'id': f'id{i}',
+                'thumbnails': [{'url': f'http://example.com/thumb{i}.jpg'}],
+                'duration': 180
+            } for i in range(3)]
+        }
 
         response = self.client.post('/playlists/import', 
                                   json={
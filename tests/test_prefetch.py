@@ -0,0 +1,133 @@
+import os
+import sys
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+# 添加項目根目錄到 Python 路徑
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, db, prefetcher
+from models import Playlist, Song
+from services.prefetcher import Prefetcher
+
+class TestPrefetcher(unittest.TestCase):
+    def setUp(self):
+        self.warmed = []
+        self.released = []
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+        self.gate = threading.Event()
+
+    def warm(self, song, job):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        try:
+            self.gate.wait(2)
+            job.check()
+            self.warmed.append(song['id'])
+        finally:
+            with self.lock:
+                self.running -= 1
+
+    def wait_idle(self, prefetcher):
+        deadline = time.monotonic() + 5
+        while prefetcher.stats()['pending'] and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def test_prefetch_next_songs(self):
+        """測試預取接下來的歌曲，並限制同時執行的數量"""
+        prefetcher = Prefetcher(self.warm, depth=3, workers=2)
+        scheduled = prefetcher.now_playing('p', [{'id': i} for i in range(2, 7)], current_id=1)
+        self.assertEqual(scheduled, [2, 3, 4])
+        time.sleep(0.1)
+        self.gate.set()
+        self.wait_idle(prefetcher)
+        self.assertEqual(sorted(self.warmed), [2, 3, 4])
+        self.assertEqual(self.max_running, 2)
+
+        # 已預取的歌曲不重複處理
+        scheduled = prefetcher.now_playing('p', [{'id': i} for i in range(3, 7)], current_id=2)
+        self.assertEqual(scheduled, [5])
+        self.wait_idle(prefetcher)
+
+    def test_skip_cancels_and_releases(self):
+        """測試跳過歌曲時取消不再需要的預取並釋放資源"""
+        prefetcher = Prefetcher(self.warm, release=lambda song: self.released.append(song['id']),
+                                depth=2, workers=1)
+        prefetcher.now_playing('p', [{'id': 2}, {'id': 3}], current_id=1)
+        time.sleep(0.05)
+        # 使用者跳到第 2 首之後的第 5 首
+        prefetcher.now_playing('p', [{'id': 6}, {'id': 7}], current_id=5)
+        self.gate.set()
+        self.wait_idle(prefetcher)
+        self.assertEqual(sorted(self.released), [2, 3])
+        self.assertEqual(sorted(self.warmed), [6, 7])
+        self.assertEqual(prefetcher.stats()['cancelled'], 2)
+
+    def test_current_song_keeps_prefetch(self):
+        """測試開始播放已預取的歌曲時不釋放它的資源"""
+        self.gate.set()
+        prefetcher = Prefetcher(self.warm, release=lambda song: self.released.append(song['id']),
+                                depth=1, workers=1)
+        prefetcher.now_playing('p', [{'id': 2}], current_id=1)
+        self.wait_idle(prefetcher)
+        prefetcher.now_playing('p', [{'id': 3}], current_id=2)
+        self.wait_idle(prefetcher)
+        self.assertEqual(self.released, [])
+        self.assertEqual(self.warmed, [2, 3])
+
+class TestNowPlayingRoute(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        self.app_context = app.app_context()
+        self.app_context.push()
+        self.client = app.test_client()
+        db.create_all()
+        self.playlist = Playlist(name='Prefetch')
+        self.songs = [Song(title=f'Song {i}', source='youtube', source_id=f'video{i:06d}',
+                           url=f'https://www.youtube.com/watch?v=video{i:06d}') for i in range(5)]
+        db.session.add(self.playlist)
+        db.session.add_all(self.songs)
+        for song in self.songs:
+            self.playlist.songs.append(song)
+        db.session.commit()
+
+    def tearDown(self):
+        prefetcher.stop(self.playlist.id)
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    @patch('app.prefetch_song')
+    def test_now_playing(self, mock_prefetch):
+        """測試依播放列表順序預取接下來的歌曲"""
+        ids = [song.id for song in self.songs]
+        response = self.client.post(f'/playlists/{self.playlist.id}/now_playing', json={'song_id': ids[1]})
+        self.assertEqual(response.status_code, 202)
+        data = response.get_json()
+        self.assertEqual(data['upcoming'], ids[2:5])
+        self.assertEqual(data['prefetching'], ids[2:5])
+
+        time.sleep(0.1)
+        warmed = sorted(call.args[0]['url'] for call in mock_prefetch.call_args_list)
+        self.assertEqual(warmed, sorted(song.url for song in self.songs[2:5]))
+
+        response = self.client.post(f'/playlists/{self.playlist.id}/now_playing',
+                                    json={'song_id': ids[4], 'repeat': True})
+        self.assertEqual(response.get_json()['upcoming'], ids[0:3])
+
+    def test_now_playing_errors(self):
+        """測試缺少參數或歌曲不在播放列表中"""
+        response = self.client.post(f'/playlists/{self.playlist.id}/now_playing', json={})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(f'/playlists/{self.playlist.id}/now_playing', json={'song_id': 99999})
+        self.assertEqual(response.status_code, 404)
+        response = self.client.post('/playlists/99999/now_playing', json={'song_id': 1})
+        self.assertEqual(response.status_code, 404)
+
+if __name__ == '__main__':
+    unittest.main()
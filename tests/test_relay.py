@@ -0,0 +1,211 @@
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+# 添加項目根目錄到 Python 路徑
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, db
+from models import Song
+from services.relay import AudioRelay, RelayError
+from services.transcoder import DiskCache
+
+CONTENT = bytes(range(256)) * 1024
+
+class UpstreamHandler(BaseHTTPRequestHandler):
+    requests = 0
+    # 設定時送出 PAUSE_AT 個位元組後等待此事件，讓測試在傳輸途中發出請求
+    resume = None
+    PAUSE_AT = 128 * 1024
+
+    def do_GET(self):
+        type(self).requests += 1
+        self.send_response(200)
+        self.send_header('Content-Type', 'audio/webm')
+        self.send_header('Content-Length', str(len(CONTENT)))
+        self.end_headers()
+        # 分段慢慢送出，讓其他收聽者在傳輸途中加入
+        for i in range(0, len(CONTENT), 32 * 1024):
+            if i == self.PAUSE_AT and self.resume is not None:
+                self.resume.wait(10)
+            self.wfile.write(CONTENT[i:i + 32 * 1024])
+            self.wfile.flush()
+            time.sleep(0.02)
+
+    def log_message(self, *args):
+        pass
+
+class RelayTestCase(unittest.TestCase):
+    def setUp(self):
+        UpstreamHandler.requests = 0
+        UpstreamHandler.resume = None
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), UpstreamHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.upstream_url = f'http://127.0.0.1:{self.server.server_port}/audio'
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.cache_dir)
+
+    def resolve(self):
+        return {'url': self.upstream_url, 'http_headers': {}}
+
+class TestAudioRelay(RelayTestCase):
+    def test_listeners_share_upstream(self):
+        """測試同一首歌的收聽者共用一個上游連線"""
+        relay = AudioRelay(buffer_bytes=len(CONTENT) * 2)
+        results = []
+
+        def listen():
+            session = relay.open('song', self.resolve)
+            results.append(b''.join(session.iter_chunks()))
+
+        threads = [threading.Thread(target=listen) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+            time.sleep(0.05)
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [CONTENT] * 3)
+        self.assertEqual(UpstreamHandler.requests, 1)
+        self.assertEqual(relay.stats()['upstream_bytes'], len(CONTENT))
+
+    def test_finished_relay_is_cached(self):
+        """測試轉送完成後保存到磁碟快取，落後的收聽者從檔案讀取"""
+        relay = AudioRelay(DiskCache(self.cache_dir, 10 * len(CONTENT)), buffer_bytes=64 * 1024)
+        session = relay.open('song', self.resolve)
+        session.wait_ready(5)
+        first = b''.join(session.iter_chunks())
+        # 環形緩衝區已覆蓋開頭，仍可從磁碟讀取任意範圍
+        self.assertEqual(b''.join(session.iter_chunks(1000, 2000)), CONTENT[1000:2000])
+        self.assertEqual(first, CONTENT)
+        path, mimetype = relay.cached('song')
+        self.assertEqual(mimetype, 'audio/webm')
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), CONTENT)
+
+    def test_reopen_after_cancel(self):
+        """測試取消後立即重新開啟的轉送使用自己的暫存檔，並在完成後保存"""
+        relay = AudioRelay(DiskCache(self.cache_dir, 10 * len(CONTENT)), buffer_bytes=64 * 1024)
+        cancelled = relay.open('song', self.resolve)
+        cancelled.wait_ready(5)
+        self.assertTrue(relay.cancel('song'))
+        session = relay.open('song', self.resolve)
+        self.assertIsNot(session, cancelled)
+        self.assertNotEqual(session.spill_path, cancelled.spill_path)
+
+        first = b''.join(session.iter_chunks())
+        self.assertEqual(b''.join(session.iter_chunks(0, 1000)), CONTENT[:1000])
+        while not cancelled.done:
+            time.sleep(0.02)
+        self.assertEqual(first, CONTENT)
+        path, _ = relay.cached('song')
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), CONTENT)
+        self.assertEqual([name for name in os.listdir(self.cache_dir) if name.endswith('.part')], [])
+
+    def test_listener_behind_buffer_without_spill(self):
+        """測試沒有磁碟快取時，落後超出緩衝區的收聽者被中斷"""
+        relay = AudioRelay(buffer_bytes=64 * 1024)
+        session = relay.open('song', self.resolve)
+        while not session.done:
+            time.sleep(0.02)
+        with self.assertRaises(RelayError):
+            b''.join(session.iter_chunks())
+
+class TestRelayRoute(RelayTestCase):
+    def setUp(self):
+        super().setUp()
+        app.config['TESTING'] = True
+        self.app_context = app.app_context()
+        self.app_context.push()
+        self.client = app.test_client()
+        db.create_all()
+        song = Song(title='Relay Song', source='youtube', source_id='dQw4w9WgXcQ',
+                    url='https://www.youtube.com/watch?v=dQw4w9WgXcQ')
+        db.session.add(song)
+        db.session.commit()
+        self.song_id = song.id
+        self.relay = AudioRelay(DiskCache(self.cache_dir, 10 * len(CONTENT)))
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        super().tearDown()
+
+    def test_relay_and_cache(self):
+        """測試轉送音訊、Range 請求與完成後改由本地檔案回應"""
+        with patch('app.audio_relay', self.relay), \
+                patch('app.resolve_audio', return_value=self.resolve()) as mock_resolve:
+            response = self.client.get(f'/relay/{self.song_id}', headers={'Range': 'bytes=100-199'})
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(response.headers['Content-Range'], f'bytes 100-199/{len(CONTENT)}')
+            self.assertEqual(response.data, CONTENT[100:200])
+
+            response = self.client.get(f'/relay/{self.song_id}')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data, CONTENT)
+            self.assertEqual(response.mimetype, 'audio/webm')
+
+            session = self.relay.session('youtube:dQw4w9WgXcQ:bestaudio')
+            while session is not None and not session.done:
+                time.sleep(0.02)
+            response = self.client.get(f'/relay/{self.song_id}')
+            self.assertEqual(response.data, CONTENT)
+            response.close()
+        self.assertEqual(mock_resolve.call_count, 1)
+        self.assertEqual(UpstreamHandler.requests, 1)
+        self.assertEqual(self.relay.stats()['cache_hits'], 1)
+
+    def paused_session(self, relay):
+        """開始轉送並在上游送出 PAUSE_AT 個位元組後暫停，環形緩衝區已覆蓋開頭"""
+        UpstreamHandler.resume = threading.Event()
+        self.addCleanup(UpstreamHandler.resume.set)
+        session = relay.open('youtube:dQw4w9WgXcQ:bestaudio', self.resolve)
+        deadline = time.monotonic() + 5
+        while session.received < UpstreamHandler.PAUSE_AT:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+        return session
+
+    def test_range_before_buffer_from_spill(self):
+        """測試環形緩衝區已覆蓋的範圍由磁碟暫存檔回應"""
+        relay = AudioRelay(DiskCache(self.cache_dir, 10 * len(CONTENT)), buffer_bytes=64 * 1024)
+        self.paused_session(relay)
+        with patch('app.audio_relay', relay):
+            response = self.client.get(f'/relay/{self.song_id}', headers={'Range': 'bytes=0-99'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, CONTENT[:100])
+
+    def test_range_before_buffer_without_spill(self):
+        """測試沒有磁碟快取時，已被覆蓋的範圍回應 503 並要求稍後重試，不回應 416"""
+        relay = AudioRelay(buffer_bytes=64 * 1024)
+        self.paused_session(relay)
+        with patch('app.audio_relay', relay):
+            response = self.client.get(f'/relay/{self.song_id}', headers={'Range': 'bytes=0-99'})
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response.headers['Retry-After'], '5')
+            # 仍在緩衝區中的範圍照常回應
+            response = self.client.get(f'/relay/{self.song_id}', headers={'Range': 'bytes=100000-100099'})
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(response.data, CONTENT[100000:100100])
+            # 超出檔案長度的範圍才回應 416
+            response = self.client.get(f'/relay/{self.song_id}', headers={'Range': f'bytes={len(CONTENT)}-'})
+            self.assertEqual(response.status_code, 416)
+
+    def test_relay_unknown_song(self):
+        """測試不存在或沒有網址的歌曲"""
+        response = self.client.get('/relay/99999')
+        self.assertEqual(response.status_code, 404)
+
+if __name__ == '__main__':
+    unittest.main()
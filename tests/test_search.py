@@ -3,12 +3,16 @@ import sys
 import unittest
 from unittest.mock import patch, MagicMock
 import json
+import asyncio
+import time
+from datetime import datetime, timedelta
 
 # 添加項目根目錄到 Python 路徑
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from app import app, db
-from models import SearchHistory
+from app import app, db, video_search_service, search_history_writer, search_runtime
+from models import SearchHistory, SearchQueryStat
+from services.search_history import backfill_query_stats
 
 class TestSearchFunctionality(unittest.TestCase):
     def setUp(self):
@@ -18,8 +22,10 @@ class TestSearchFunctionality(unittest.TestCase):
         self.app_context.push()
         self.client = app.test_client()
         db.create_all()
+        video_search_service.cache.clear()
 
     def tearDown(self):
+        search_history_writer.flush()
         db.session.remove()
         db.drop_all()
         self.app_context.pop()
@@ -65,22 +71,281 @@ class TestSearchFunctionality(unittest.TestCase):
         self.assertEqual(bili_result['platform'], 'bilibili')
         self.assertEqual(bili_result['title'], '測試視頻')
 
+    @patch('services.video_search.VideoSearchService.search_youtube')
+    @patch('services.video_search.VideoSearchService.search_bilibili')
+    def test_search_providers_run_concurrently(self, mock_bilibili, mock_youtube):
+        """測試兩個平台同時搜索，延遲約等於較慢的平台"""
+        def slow_youtube(query):
+            time.sleep(0.3)
+            return [{'platform': 'youtube', 'title': 'YT'}]
+
+        async def slow_bilibili(query):
+            await asyncio.sleep(0.3)
+            return [{'platform': 'bilibili', 'title': 'BL'}]
+
+        mock_youtube.side_effect = slow_youtube
+        mock_bilibili.side_effect = slow_bilibili
+
+        started = time.monotonic()
+        response = self.client.get('/search?q=concurrent')
+        elapsed = time.monotonic() - started
+
+        data = json.loads(response.data)
+        self.assertEqual(len(data['youtube']), 1)
+        self.assertEqual(len(data['bilibili']), 1)
+        self.assertEqual(data['status']['youtube']['status'], 'ok')
+        self.assertLess(elapsed, 0.55)
+
+    @patch('services.video_search.VideoSearchService.search_youtube')
+    @patch('services.video_search.VideoSearchService.search_bilibili')
+    def test_search_provider_deadline(self, mock_bilibili, mock_youtube):
+        """測試單一平台逾時時回傳部分結果與狀態"""
+        def slow_youtube(query):
+            time.sleep(0.5)
+            return [{'platform': 'youtube', 'title': 'YT'}]
+
+        mock_youtube.side_effect = slow_youtube
+        mock_bilibili.return_value = [{'platform': 'bilibili', 'title': 'BL'}]
+
+        with patch.object(video_search_service, 'youtube_timeout', 0.1):
+            response = self.client.get('/search?q=deadline')
+        self.assertEqual(response.status_code, 200)
+
+        data = json.loads(response.data)
+        self.assertEqual(data['youtube'], [])
+        self.assertEqual(data['bilibili'][0]['title'], 'BL')
+        self.assertEqual(data['status']['youtube']['status'], 'timeout')
+        self.assertEqual(data['status']['bilibili']['status'], 'ok')
+
+    @patch('services.video_search.VideoSearchService.search_youtube')
+    def test_search_provider_error(self, mock_youtube):
+        """測試平台搜索失敗時回傳其他平台的結果與 error 狀態"""
+        async def search_by_type(keyword, search_type, page):
+            raise ConnectionError('network unreachable')
+
+        mock_youtube.return_value = [{'platform': 'youtube', 'title': 'YT'}]
+        with patch('bilibili_api.search.search_by_type', side_effect=search_by_type):
+            response = self.client.get('/search?q=provider error')
+        self.assertEqual(response.status_code, 200)
+
+        data = json.loads(response.data)
+        self.assertEqual(data['youtube'][0]['title'], 'YT')
+        self.assertEqual(data['bilibili'], [])
+        self.assertEqual(data['status']['youtube']['status'], 'ok')
+        self.assertEqual(data['status']['bilibili']['status'], 'error')
+
+    @patch('services.video_search.VideoSearchService.search_youtube')
+    @patch('services.video_search.VideoSearchService.search_bilibili')
+    def test_search_results_cached(self, mock_bilibili, mock_youtube):
+        """測試相同查詢由快取回傳，不再呼叫各平台"""
+        mock_youtube.return_value = [{'platform': 'youtube', 'title': 'YT'}]
+        mock_bilibili.return_value = [{'platform': 'bilibili', 'title': 'BL'}]
+
+        first = json.loads(self.client.get('/search?q=Cached  Query').data)
+        second = json.loads(self.client.get('/search?q=cached query').data)
+        self.assertEqual(first, second)
+        self.assertEqual(mock_youtube.call_count, 1)
+        self.assertEqual(mock_bilibili.call_count, 1)
+
+        # 快取命中時仍記錄搜索歷史
+        search_history_writer.flush()
+        self.assertEqual(db.session.query(SearchHistory).count(), 2)
+        stat = db.session.query(SearchQueryStat).one()
+        self.assertEqual((stat.query, stat.count), ('cached query', 2))
+
+        stats = json.loads(self.client.get('/search/cache').data)
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+
+    @patch('services.video_search.VideoSearchService.search_youtube')
+    @patch('services.video_search.VideoSearchService.search_bilibili')
+    def test_partial_results_not_cached(self, mock_bilibili, mock_youtube):
+        """測試有平台失敗時不快取結果"""
+        mock_youtube.side_effect = RuntimeError('quota exceeded')
+        mock_bilibili.return_value = []
+
+        self.client.get('/search?q=partial')
+        self.client.get('/search?q=partial')
+        self.assertEqual(mock_youtube.call_count, 2)
+
+    @patch('services.video_search.VideoSearchService.search_youtube')
+    def test_provider_failure_not_cached(self, mock_youtube):
+        """測試平台的網路錯誤不會以空結果寫入快取"""
+        calls = []
+
+        async def search_by_type(keyword, search_type, page):
+            calls.append(page)
+            if calls.count(1) == 1:  # 只有第一次搜索失敗
+                raise ConnectionError('network unreachable')
+            return {'numPages': 1, 'result': []}
+
+        mock_youtube.return_value = []
+        with patch('bilibili_api.search.search_by_type', side_effect=search_by_type):
+            first = json.loads(self.client.get('/search?q=blip').data)
+            second = json.loads(self.client.get('/search?q=blip').data)
+        self.assertEqual(first['status']['bilibili']['status'], 'error')
+        self.assertEqual(second['status']['bilibili']['status'], 'ok')
+        self.assertEqual(calls.count(1), 2)
+
+    @patch('services.video_search.VideoSearchService.search_youtube')
+    @patch('services.video_search.VideoSearchService.search_bilibili')
+    def test_stale_results_refreshed_in_background(self, mock_bilibili, mock_youtube):
+        """測試過期結果先回傳，並在背景重新搜索"""
+        mock_youtube.return_value = [{'platform': 'youtube', 'title': 'Old'}]
+        mock_bilibili.return_value = []
+
+        with patch.object(video_search_service.cache, 'ttl', 0):
+            self.client.get('/search?q=stale')
+            mock_youtube.return_value = [{'platform': 'youtube', 'title': 'New'}]
+            data = json.loads(self.client.get('/search?q=stale').data)
+            self.assertEqual(data['youtube'][0]['title'], 'Old')
+
+            deadline = time.monotonic() + 2
+            while mock_youtube.call_count < 2 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(mock_youtube.call_count, 2)
+            self.assertEqual(video_search_service.cache_stats()['refreshes'], 1)
+
+    @patch('services.video_search.VideoSearchService.search_youtube')
+    @patch('services.video_search.VideoSearchService.search_bilibili')
+    def test_searches_share_event_loop(self, mock_bilibili, mock_youtube):
+        """測試所有搜索在同一個長期運行的事件循環中執行"""
+        loops = []
+
+        async def bilibili(query):
+            loops.append(asyncio.get_running_loop())
+            return []
+
+        mock_youtube.return_value = []
+        mock_bilibili.side_effect = bilibili
+
+        self.client.get('/search?q=first')
+        self.client.get('/search?q=second')
+        self.assertEqual(len(loops), 2)
+        self.assertIs(loops[0], loops[1])
+        self.assertFalse(loops[0].is_closed())
+
+    @patch('services.video_search.VideoSearchService.search_youtube')
+    @patch('services.video_search.VideoSearchService.search_bilibili')
+    def test_search_stream(self, mock_bilibili, mock_youtube):
+        """測試串流搜索在每個平台完成時立即送出結果"""
+        async def slow_bilibili(query):
+            await asyncio.sleep(0.5)
+            return [{'platform': 'bilibili', 'title': 'BL'}]
+
+        mock_youtube.return_value = [{'platform': 'youtube', 'title': 'YT'}]
+        mock_bilibili.side_effect = slow_bilibili
+
+        started = time.monotonic()
+        response = self.client.get('/search/stream?q=streamed', buffered=False)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        chunks = iter(response.response)
+        first = next(chunks)
+        self.assertLess(time.monotonic() - started, 0.4)
+        events = [first] + list(chunks)
+        response.close()
+
+        parsed = []
+        for event in events:
+            name, data = event.decode().strip().split('\n')
+            parsed.append((name[len('event: '):], json.loads(data[len('data: '):])))
+        self.assertEqual([(name, data.get('platform')) for name, data in parsed],
+                         [('results', 'youtube'), ('results', 'bilibili'), ('done', None)])
+        self.assertEqual(parsed[0][1]['results'][0]['title'], 'YT')
+        self.assertEqual(parsed[2][1]['counts'], {'youtube': 1, 'bilibili': 1})
+
+        # 結果已快取，再次串流時直接送出
+        response = self.client.get('/search/stream?q=streamed')
+        self.assertEqual(response.data.decode().count('event: results'), 2)
+        self.assertEqual(mock_youtube.call_count, 1)
+
+    def test_bilibili_pages_fetched_concurrently(self):
+        """測試同時請求多頁 Bilibili 結果，去除重複並過濾時長"""
+        def item(bvid, duration, play=10):
+            return {'aid': int(bvid[2:]), 'bvid': bvid, 'title': f'<em class="keyword">歌</em> {bvid}',
+                    'pic': '//i0.hdslb.com/x.jpg', 'duration': duration, 'play': play}
+
+        pages = {
+            1: [item('BV1', '3:00'), item('BV2', '0:30'), item('BV3', '1:02:00')],
+            2: [item('BV3', '1:02:00'), item('BV4', '4:10')],
+            3: [item('BV5', '2:00')],
+        }
+        requested = []
+
+        async def search_by_type(keyword, search_type, page):
+            requested.append(page)
+            await asyncio.sleep(0.2)
+            return {'numPages': 3, 'result': pages[page]}
+
+        with patch('bilibili_api.search.search_by_type', side_effect=search_by_type), \
+                patch('services.video_search.BILIBILI_PAGE_SIZE', 2), \
+                patch.object(video_search_service, 'max_results', 3):
+            started = time.monotonic()
+            results = search_runtime.run(video_search_service.search_bilibili('歌'))
+            elapsed = time.monotonic() - started
+
+        self.assertLess(elapsed, 0.35)
+        self.assertEqual(sorted(requested), [1, 2, 3])
+        self.assertEqual([r['url'].rsplit('/', 1)[1] for r in results], ['BV1', 'BV4', 'BV5'])
+        self.assertEqual(results[0]['title'], '歌 BV1')
+        self.assertEqual(results[0]['duration'], 180)
+        self.assertEqual(results[0]['thumbnail'], 'https://i0.hdslb.com/x.jpg')
+
+    @patch('services.video_search.VideoSearchService.search_youtube')
+    @patch('services.video_search.VideoSearchService.search_bilibili')
+    def test_merged_ranking(self, mock_bilibili, mock_youtube):
+        """測試合併兩個平台的結果並依排名與觀看次數排序"""
+        mock_youtube.return_value = [
+            {'platform': 'youtube', 'title': 'YT1', 'view_count': 1000},
+            {'platform': 'youtube', 'title': 'YT2', 'view_count': 10},
+        ]
+        mock_bilibili.return_value = [
+            {'platform': 'bilibili', 'title': 'BL1', 'view_count': 1000000},
+            {'platform': 'bilibili', 'title': 'BL2', 'view_count': 5},
+        ]
+
+        data = json.loads(self.client.get('/search?q=merged').data)
+        self.assertEqual([r['title'] for r in data['merged']], ['BL1', 'YT1', 'YT2', 'BL2'])
+        scores = [r['score'] for r in data['merged']]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+
     def test_search_history(self):
-        # 創建一些搜索歷史
-        history1 = SearchHistory(query='test1')
-        history2 = SearchHistory(query='test2')
-        db.session.add(history1)
-        db.session.add(history2)
-        db.session.commit()
+        # 記錄一些搜索歷史並寫入資料庫
+        for query in ('test1', 'test2', 'Test1', 'test3'):
+            search_history_writer.record(query)
+        self.assertEqual(search_history_writer.flush(), 4)
+        self.assertEqual(search_history_writer.pending(), 0)
 
-        # 測試歷史記錄 API
+        # 測試歷史記錄 API，依最後搜索時間排序
         response = self.client.get('/search/history')
         self.assertEqual(response.status_code, 200)
         
         data = json.loads(response.data)
-        self.assertEqual(len(data), 2)
-        self.assertEqual(data[0]['query'], 'test2')
-        self.assertEqual(data[1]['query'], 'test1')
+        # 顯示使用者最近一次輸入的查詢，並保留 created_at 欄位
+        self.assertEqual([h['query'] for h in data], ['test3', 'Test1', 'test2'])
+        self.assertEqual([h['created_at'] for h in data], [h['last_seen'] for h in data])
+
+        # 依搜索次數排序
+        data = json.loads(self.client.get('/search/history?sort=popular').data)
+        self.assertEqual(data[0]['query'], 'Test1')
+        self.assertEqual(data[0]['count'], 2)
+
+        # 之後的批次累加到同一筆統計
+        search_history_writer.record('TEST1 ')
+        search_history_writer.flush()
+        stat = db.session.query(SearchQueryStat).filter_by(query='test1').one()
+        self.assertEqual((stat.count, stat.display), (3, 'TEST1'))
+        self.assertEqual(db.session.query(SearchHistory).count(), 5)
+
+    def test_backfill_query_stats(self):
+        """測試從既有的搜索記錄建立統計，顯示最近一次輸入的查詢"""
+        base = datetime(2024, 1, 1)
+        for minutes, query in enumerate(('hello world', 'Hello  World', 'other')):
+            db.session.add(SearchHistory(query=query, created_at=base + timedelta(minutes=minutes)))
+        db.session.commit()
+        backfill_query_stats()
+        stat = db.session.query(SearchQueryStat).filter_by(query='hello world').one()
+        self.assertEqual((stat.count, stat.display, stat.last_seen), (2, 'Hello  World', base + timedelta(minutes=1)))
 
     def test_search_without_query(self):
         # 測試沒有查詢參數的情況
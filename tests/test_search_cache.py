@@ -0,0 +1,90 @@
+import os
+import sys
+import unittest
+import threading
+import time
+
+# 添加項目根目錄到 Python 路徑
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.search_cache import SearchCache
+from services.single_flight import SingleFlight
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+class TestSearchCache(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = SearchCache(max_entries=2, ttl=10, stale_ttl=20, clock=self.clock)
+
+    def test_fresh_stale_and_expired(self):
+        """測試有效、過期可用與完全過期的狀態"""
+        self.cache.store('a', 1)
+        self.assertEqual(self.cache.lookup('a'), (1, 'fresh'))
+
+        self.clock.now = 15
+        self.assertEqual(self.cache.lookup('a'), (1, 'stale'))
+
+        self.clock.now = 31
+        self.assertEqual(self.cache.lookup('a'), (None, 'miss'))
+
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['stale_hits'], stats['misses']), (1, 1, 1))
+        self.assertEqual(stats['size'], 0)
+
+    def test_lru_eviction(self):
+        """測試超過容量時淘汰最久未使用的項目"""
+        self.cache.store('a', 1)
+        self.cache.store('b', 2)
+        self.cache.lookup('a')
+        self.cache.store('c', 3)
+
+        self.assertEqual(self.cache.lookup('b'), (None, 'miss'))
+        self.assertEqual(self.cache.lookup('a'), (1, 'fresh'))
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+class TestSingleFlight(unittest.TestCase):
+    def test_concurrent_calls_share_result(self):
+        """測試並行的相同請求只執行一次"""
+        flight = SingleFlight()
+        calls = []
+        started = threading.Event()
+
+        def work():
+            calls.append(1)
+            started.set()
+            time.sleep(0.2)
+            return 'result'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flight.do('key', work))) for _ in range(5)]
+        threads[0].start()
+        started.wait()
+        for thread in threads[1:]:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['result'] * 5)
+        self.assertEqual(flight.shared, 4)
+        self.assertFalse(flight.in_flight('key'))
+
+    def test_errors_are_shared_and_not_cached(self):
+        """測試錯誤會傳給所有等待者，之後的請求重新執行"""
+        flight = SingleFlight()
+
+        def fail():
+            raise ValueError('boom')
+
+        with self.assertRaises(ValueError):
+            flight.do('key', fail)
+        self.assertEqual(flight.do('key', lambda: 'ok'), 'ok')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+import os
+import sys
+import threading
+import time
+import unittest
+from unittest.mock import patch
+import json
+
+# 添加項目根目錄到 Python 路徑
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, db, init_db
+from models import sync_schema, Playlist, PlayHistory, Song
+from services.library_search import search_library
+from services.song_resolver import SongResolver, merge_duplicate_songs
+
+# 加入唯一索引與全文索引之前的資料表結構
+BASELINE_SCHEMA = (
+    'CREATE TABLE playlist (id INTEGER PRIMARY KEY, name VARCHAR(100) NOT NULL, description VARCHAR(500), '
+    'created_at DATETIME, updated_at DATETIME)',
+    'CREATE TABLE song (id INTEGER PRIMARY KEY, title VARCHAR(200) NOT NULL, artist VARCHAR(200), '
+    'duration INTEGER, source VARCHAR(20), source_id VARCHAR(100), thumbnail_url VARCHAR(500), '
+    'url VARCHAR(500), created_at DATETIME, local_path VARCHAR(500))',
+    'CREATE TABLE playlist_songs (playlist_id INTEGER NOT NULL REFERENCES playlist (id), '
+    'song_id INTEGER NOT NULL REFERENCES song (id), PRIMARY KEY (playlist_id, song_id))',
+    'CREATE TABLE search_history (id INTEGER PRIMARY KEY, query VARCHAR(200) NOT NULL, created_at DATETIME)',
+    'CREATE TABLE play_history (id INTEGER PRIMARY KEY, song_id INTEGER NOT NULL REFERENCES song (id), '
+    'played_at DATETIME)',
+    'CREATE TABLE download_queue (id INTEGER PRIMARY KEY, song_id INTEGER NOT NULL REFERENCES song (id), '
+    'status VARCHAR(20), created_at DATETIME, completed_at DATETIME, error_message VARCHAR(500))',
+)
+
+class TestSongResolver(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        self.app_context = app.app_context()
+        self.app_context.push()
+        self.client = app.test_client()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_concurrent_requests_create_one_song(self):
+        """測試同一部影片的並行請求只取得一次資訊並建立一首歌曲"""
+        calls = []
+
+        def fetch_info(platform, video_id, url):
+            calls.append(url)
+            time.sleep(0.2)
+            return {'video_id': video_id, 'title': 'Concurrent Song', 'duration': 200}
+
+        resolver = SongResolver(app, fetch_info)
+        urls = ['https://www.youtube.com/watch?v=dQw4w9WgXcQ', 'https://youtu.be/dQw4w9WgXcQ',
+                'https://m.youtube.com/watch?v=dQw4w9WgXcQ&t=5', 'https://www.youtube.com/shorts/dQw4w9WgXcQ']
+        results = []
+        threads = [threading.Thread(target=lambda url=url: results.append(resolver.ensure_song(url)))
+                   for url in urls]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(set(results)), 1)
+        self.assertEqual(db.session.query(Song).count(), 1)
+        song = db.session.get(Song, results[0])
+        self.assertEqual(song.url, 'https://www.youtube.com/watch?v=dQw4w9WgXcQ')
+        # 不經過 ORM 寫入的歌曲也在全文索引中
+        self.assertEqual([item['id'] for item in search_library('Concurrent')['songs']], [song.id])
+
+    def test_unsupported_url(self):
+        """測試不支援的網址"""
+        resolver = SongResolver(app, lambda *args: self.fail('should not fetch'))
+        with self.assertRaises(ValueError):
+            resolver.ensure_song('https://example.com/video.mp4')
+
+    @patch('app.ytdlp_pool.extract_info')
+    def test_import_reuses_existing_songs(self, mock_extract):
+        """測試導入播放列表時使用已存在的歌曲，並忽略重複的項目"""
+        existing = Song(title='Existing', source='youtube', source_id='id1')
+        db.session.add(existing)
+        db.session.commit()
+        mock_extract.return_value = {
+            'id': 'list',
+            'entries': [{'title': f'Song {i}', 'id': f'id{i}', 'duration': 180} for i in (0, 1, 2, 1)]
+        }
+
+        response = self.client.post('/playlists/import', json={
+            'name': 'Imported', 'url': 'https://www.youtube.com/playlist?list=list'
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['song_count'], 3)
+        self.assertEqual(db.session.query(Song).count(), 3)
+        self.assertEqual(db.session.get(Song, existing.id).title, 'Existing')
+
+        # 再次導入不會建立新的歌曲
+        response = self.client.post('/playlists/import', json={
+            'name': 'Again', 'url': 'https://www.youtube.com/playlist?list=list'
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(db.session.query(Song).count(), 3)
+
+    def test_merge_duplicate_songs(self):
+        """測試合併唯一索引建立前的重複歌曲"""
+        db.session.execute(db.text('DROP INDEX uq_song_source_source_id'))
+        first = Song(title='Dup', source='youtube', source_id='dup')
+        downloaded = Song(title='Dup', source='youtube', source_id='dup', local_path='/music/dup.mp3')
+        playlist = Playlist(name='Merge')
+        db.session.add_all([first, downloaded, playlist])
+        db.session.flush()
+        playlist.songs.append(first)
+        playlist.songs.append(downloaded)
+        db.session.add(PlayHistory(song_id=first.id))
+        db.session.commit()
+
+        self.assertEqual(merge_duplicate_songs(), 1)
+        sync_schema()
+        db.session.expire_all()
+        self.assertEqual([song.id for song in db.session.query(Song)], [downloaded.id])
+        self.assertEqual([song.id for song in playlist.songs], [downloaded.id])
+        self.assertEqual(db.session.query(PlayHistory).one().song_id, downloaded.id)
+
+    def test_upgrade_with_duplicate_songs(self):
+        """測試從沒有唯一索引與全文索引的舊版資料庫升級時合併重複歌曲"""
+        db.drop_all()
+        with db.engine.begin() as conn:
+            for statement in BASELINE_SCHEMA:
+                conn.exec_driver_sql(statement)
+            conn.exec_driver_sql("INSERT INTO song (id, title, source, source_id) VALUES "
+                                 "(1, 'Dup', 'youtube', 'dup'), (2, 'Dup', 'youtube', 'dup')")
+            conn.exec_driver_sql("INSERT INTO playlist (id, name) VALUES (1, 'Imported')")
+            conn.exec_driver_sql("INSERT INTO playlist_songs (playlist_id, song_id) VALUES (1, 1), (1, 2)")
+
+        init_db()
+        db.session.expire_all()
+        self.assertEqual([song.id for song in db.session.query(Song)], [1])
+        self.assertEqual([song.id for song in db.session.get(Playlist, 1).songs], [1])
+        self.assertEqual([song['id'] for song in search_library('Dup')['songs']], [1])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,22 @@
+import os
+import sys
+import subprocess
+import unittest
+
+# 添加項目根目錄到 Python 路徑
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+class TestStartup(unittest.TestCase):
+    def test_import_defers_provider_clients(self):
+        """測試匯入 app 時不載入平台客戶端"""
+        script = (
+            'import sys, app\n'
+            'print(sorted(m for m in ("bilibili_api", "googleapiclient.discovery") if m in sys.modules))\n'
+        )
+        result = subprocess.run([sys.executable, '-c', script], cwd=ROOT, capture_output=True, text=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.strip().splitlines()[-1], '[]')
+
+if __name__ == '__main__':
+    unittest.main()
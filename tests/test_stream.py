@@ -0,0 +1,102 @@
+import os
+import sys
+import unittest
+import tempfile
+import shutil
+
+# 添加項目根目錄到 Python 路徑
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, db
+
+class TestStreamFunctionality(unittest.TestCase):
+    def setUp(self):
+        self.test_music_dir = tempfile.mkdtemp()
+        app.config['MUSIC_DIR'] = self.test_music_dir
+        app.config['TESTING'] = True
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+
+        # 創建測試音樂檔案
+        self.content = bytes(range(256)) * 64
+        with open(os.path.join(self.test_music_dir, 'song.flac'), 'wb') as f:
+            f.write(self.content)
+
+        self.app_context = app.app_context()
+        self.app_context.push()
+        self.client = app.test_client()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        shutil.rmtree(self.test_music_dir)
+
+    def test_stream_full_file(self):
+        """測試完整串流"""
+        response = self.client.get('/stream/song.flac')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'audio/flac')
+        self.assertEqual(response.data, self.content)
+        response.close()
+
+    def test_stream_range_request(self):
+        """測試 Range 請求回傳 206 部分內容"""
+        response = self.client.get('/stream/song.flac', headers={'Range': 'bytes=100-199'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.headers['Content-Range'], f'bytes 100-199/{len(self.content)}')
+        self.assertEqual(response.data, self.content[100:200])
+        response.close()
+
+        # 再次跳轉到檔案尾端
+        response = self.client.get('/stream/song.flac', headers={'Range': 'bytes=-10'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, self.content[-10:])
+        response.close()
+
+    def test_stream_unsatisfiable_range(self):
+        """測試超出範圍的 Range 請求"""
+        response = self.client.get('/stream/song.flac',
+                                   headers={'Range': f'bytes={len(self.content) + 10}-'})
+        self.assertEqual(response.status_code, 416)
+        response.close()
+
+    def test_stream_conditional_get(self):
+        """測試 ETag / Last-Modified 驗證與 304 回應"""
+        response = self.client.get('/stream/song.flac')
+        etag = response.headers['ETag']
+        last_modified = response.headers['Last-Modified']
+        self.assertIn('max-age', response.headers['Cache-Control'])
+        response.close()
+
+        response = self.client.get('/stream/song.flac', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+
+        response = self.client.get('/stream/song.flac', headers={'If-Modified-Since': last_modified})
+        self.assertEqual(response.status_code, 304)
+
+    def test_stream_etag_changes_with_file(self):
+        """測試檔案變更後 ETag 失效"""
+        response = self.client.get('/stream/song.flac')
+        etag = response.headers['ETag']
+        response.close()
+
+        path = os.path.join(self.test_music_dir, 'song.flac')
+        with open(path, 'ab') as f:
+            f.write(b'more')
+        os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 10**9))
+
+        response = self.client.get('/stream/song.flac', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertEqual(response.data, self.content + b'more')
+        response.close()
+
+    def test_stream_rejects_path_traversal(self):
+        """測試拒絕音樂目錄以外的路徑"""
+        response = self.client.get('/stream/../etc/passwd')
+        self.assertEqual(response.status_code, 404)
+
+if __name__ == '__main__':
+    unittest.main()
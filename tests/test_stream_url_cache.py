@@ -0,0 +1,111 @@
+import os
+import sys
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+# 添加項目根目錄到 Python 路徑
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, stream_url_cache
+from services.stream_url_cache import StreamUrlCache, parse_expire
+
+class FakeClock:
+    def __init__(self, now=1_700_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+class TestStreamUrlCache(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = StreamUrlCache(max_entries=2, safety_margin=600, default_ttl=1800, clock=self.clock)
+        self.calls = 0
+
+    def resolver(self, url):
+        def resolve():
+            self.calls += 1
+            return {'id': 'abc', 'url': url}
+        return resolve
+
+    def test_parse_expire(self):
+        """測試從查詢參數與路徑中取得到期時間"""
+        self.assertEqual(parse_expire('https://r1.googlevideo.com/videoplayback?expire=1700003600&id=1'), 1700003600)
+        self.assertEqual(parse_expire('https://r1.googlevideo.com/videoplayback/expire/1700003600/id/1'), 1700003600)
+        self.assertIsNone(parse_expire('https://example.com/audio.m4a'))
+
+    def test_honors_expire_with_safety_margin(self):
+        """測試到期前 safety_margin 秒內重新解析"""
+        url = f'https://r1.googlevideo.com/videoplayback?expire={int(self.clock.now) + 3600}'
+        self.cache.get('a', self.resolver(url))
+        self.clock.now += 2900
+        self.cache.get('a', self.resolver(url))
+        self.assertEqual(self.calls, 1)
+        self.clock.now += 200
+        self.cache.get('a', self.resolver(url))
+        self.assertEqual(self.calls, 2)
+        stats = self.cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['expired'], 1)
+
+    def test_default_ttl_and_lru(self):
+        """測試沒有 expire 參數時使用預設有效時間，超過容量時淘汰最久未使用的項目"""
+        self.cache.get('a', self.resolver('https://example.com/a'))
+        self.cache.get('b', self.resolver('https://example.com/b'))
+        self.cache.get('a', self.resolver('https://example.com/a'))
+        self.cache.get('c', self.resolver('https://example.com/c'))
+        self.cache.get('a', self.resolver('https://example.com/a'))
+        self.assertEqual(self.calls, 3)
+        self.cache.get('b', self.resolver('https://example.com/b'))
+        self.assertEqual(self.calls, 4)
+        self.clock.now += 1801
+        self.cache.get('b', self.resolver('https://example.com/b'))
+        self.assertEqual(self.calls, 5)
+
+    def test_concurrent_misses_resolve_once(self):
+        """測試同時請求同一部影片只解析一次"""
+        started = threading.Event()
+
+        def resolve():
+            self.calls += 1
+            started.set()
+            time.sleep(0.2)
+            return {'url': 'https://example.com/a'}
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.cache.get('a', resolve)))
+                   for _ in range(4)]
+        threads[0].start()
+        started.wait(1)
+        for thread in threads[1:]:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(len(results), 4)
+        self.assertEqual(self.cache.stats()['coalesced'], 3)
+
+class TestPlayYoutubeCache(unittest.TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+        stream_url_cache.clear()
+
+    @patch('app.ytdlp_pool.audio_url')
+    def test_play_youtube_uses_cache(self, mock_audio_url):
+        """測試同一部影片的不同網址形式共用已解析的串流網址"""
+        mock_audio_url.return_value = {'id': 'dQw4w9WgXcQ', 'format_id': '251',
+                                       'url': f'https://r1.googlevideo.com/videoplayback?expire={int(time.time()) + 21600}'}
+        for url in ('https://www.youtube.com/watch?v=dQw4w9WgXcQ', 'https://youtu.be/dQw4w9WgXcQ'):
+            response = self.client.post('/play_youtube', json={'url': url})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.get_json()['audioUrl'], mock_audio_url.return_value['url'])
+        self.assertEqual(mock_audio_url.call_count, 1)
+
+        stats = self.client.get('/play_youtube/cache').get_json()
+        self.assertGreaterEqual(stats['hits'], 1)
+        self.assertIn('time_saved_seconds', stats)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import os
+import sys
+import unittest
+from unittest.mock import patch
+import json
+import time
+from datetime import datetime, UTC
+
+# 添加項目根目錄到 Python 路徑
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, db, search_history_writer
+from models import Song, SearchQueryStat
+from services.suggest_index import SuggestIndex
+
+class TestSuggest(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.app_context = app.app_context()
+        self.app_context.push()
+        self.client = app.test_client()
+        db.create_all()
+
+        db.session.add_all([
+            Song(title='Yesterday', artist='The Beatles', source='local'),
+            Song(title='Yellow Submarine', artist='The Beatles', source='local'),
+            Song(title='晴天', artist='周杰倫', source='youtube'),
+            SearchQueryStat(query='yellow', count=2, last_seen=datetime.now(UTC)),
+        ])
+        db.session.commit()
+
+        self.index = SuggestIndex(app, max_entries=100, refresh_interval=3600)
+        self.index.refresh()
+        self.index_patch = patch('app.suggest_index', self.index)
+        self.index_patch.start()
+
+    def tearDown(self):
+        self.index_patch.stop()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def _suggest(self, prefix):
+        response = self.client.get('/search/suggest', query_string={'prefix': prefix})
+        self.assertEqual(response.status_code, 200)
+        return [item['text'] for item in json.loads(response.data)]
+
+    def test_ranked_prefix_suggestions(self):
+        """測試依前綴回傳建議，搜索過的查詢排在前面"""
+        self.assertEqual(self._suggest('ye'), ['yellow', 'Yesterday', 'Yellow Submarine'])
+        self.assertEqual(self._suggest('the b'), ['The Beatles'])
+        self.assertEqual(self._suggest('周'), ['周杰倫'])
+        self.assertEqual(self._suggest('zzz'), [])
+        self.assertEqual(self._suggest(''), [])
+
+    def test_incremental_updates(self):
+        """測試新的搜索與歌曲加入索引"""
+        with patch('services.video_search.VideoSearchService.search_youtube', return_value=[]), \
+                patch('services.video_search.VideoSearchService.search_bilibili', return_value=[]):
+            self.client.get('/search?q=Yeah Yeah Yeahs')
+        self.assertEqual(self._suggest('yeah'), ['Yeah Yeah Yeahs'])
+
+        db.session.add(Song(title='Yes It Is', source='local'))
+        db.session.commit()
+        self.index.refresh()
+        self.assertIn('Yes It Is', self._suggest('yes'))
+        search_history_writer.flush()
+
+    def test_memory_bound(self):
+        """測試項目超過上限時淘汰分數最低的項目"""
+        index = SuggestIndex(app, max_entries=10)
+        for i in range(20):
+            index.record_query(f'query {i:02d}')
+        index.record_query('query 05')
+        index.refresh()
+        self.assertLessEqual(len(index), 10)
+        self.assertEqual(index.suggest('query 05'), [{'text': 'query 05', 'score': 6}])
+
+    def test_short_prefix_ranks_whole_range(self):
+        """測試很短的前綴也會考慮排序在數千個項目之後的熱門項目，分數降低時重新排序"""
+        index = SuggestIndex(app, max_entries=10000)
+        with index._lock:
+            new_keys = []
+            for i in range(3000):
+                index._add(f'a{i:04d}', occurrences=1, new_keys=new_keys)
+            index._keys = sorted(new_keys)
+        for _ in range(5):
+            index.record_query('Azure')
+        self.assertEqual(index.suggest('a', limit=1), [{'text': 'Azure', 'score': 15}])
+        self.assertEqual(index.suggest('azu')[0]['text'], 'Azure')
+
+        with index._lock:
+            index._add('Azure', searches=0, replace=True)
+        self.assertEqual(index.suggest('a', limit=1)[0]['score'], 1)
+
+    def test_lookup_speed(self):
+        """測試十萬個項目時的查詢時間"""
+        index = SuggestIndex(app, max_entries=200000)
+        with index._lock:
+            new_keys = []
+            for i in range(100000):
+                index._add(f'song {i}', occurrences=1, new_keys=new_keys)
+            index._keys = sorted(new_keys)
+
+        started = time.perf_counter()
+        for prefix in ('s', 'song 1', 'song 12345'):
+            self.assertTrue(index.suggest(prefix))
+        self.assertLess((time.perf_counter() - started) / 3, 0.005)
+
+if __name__ == '__main__':
+    unittest.main()
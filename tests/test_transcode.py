@@ -0,0 +1,135 @@
+import os
+import sys
+import unittest
+from unittest.mock import patch
+import tempfile
+import shutil
+
+# 添加項目根目錄到 Python 路徑
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, db
+from services.transcoder import DiskCache, Transcoder
+
+COPY_SCRIPT = 'import shutil, sys; shutil.copyfile(sys.argv[1], sys.argv[2])'
+
+
+def fake_build_command(self, src_path, dest_path, preset):
+    """以複製檔案代替 ffmpeg"""
+    return [sys.executable, '-c', COPY_SCRIPT, src_path, dest_path]
+
+
+class TestDiskCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def _put(self, cache, name, size):
+        temp_path = cache.temp_path(name)
+        with open(temp_path, 'wb') as f:
+            f.write(b'x' * size)
+        return cache.put(name, temp_path)
+
+    def test_lru_eviction_by_bytes(self):
+        """測試超出容量時淘汰最久未使用的檔案"""
+        cache = DiskCache(self.cache_dir, max_bytes=250)
+        self._put(cache, 'a', 100)
+        self._put(cache, 'b', 100)
+        # 使用 a，讓 b 成為最久未使用
+        self.assertIsNotNone(cache.get('a'))
+        self._put(cache, 'c', 100)
+
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('c'))
+        self.assertEqual(cache.total_bytes, 200)
+        self.assertFalse(os.path.exists(os.path.join(self.cache_dir, 'b')))
+
+    def test_load_existing_entries(self):
+        """測試重新啟動後載入既有快取並清除半成品"""
+        cache = DiskCache(self.cache_dir, max_bytes=1000)
+        self._put(cache, 'a', 100)
+        with open(os.path.join(self.cache_dir, 'b.part'), 'wb') as f:
+            f.write(b'partial')
+
+        cache = DiskCache(self.cache_dir, max_bytes=1000)
+        self.assertEqual(cache.total_bytes, 100)
+        self.assertIsNotNone(cache.get('a'))
+        self.assertFalse(os.path.exists(os.path.join(self.cache_dir, 'b.part')))
+
+
+@patch.object(Transcoder, 'build_command', fake_build_command)
+class TestTranscodeStream(unittest.TestCase):
+    def setUp(self):
+        self.test_music_dir = tempfile.mkdtemp()
+        self.cache_dir = tempfile.mkdtemp()
+        app.config['MUSIC_DIR'] = self.test_music_dir
+        app.config['TESTING'] = True
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+
+        self.content = os.urandom(200 * 1024)
+        self.source = os.path.join(self.test_music_dir, 'song.flac')
+        with open(self.source, 'wb') as f:
+            f.write(self.content)
+
+        self.transcoder = Transcoder(DiskCache(self.cache_dir, max_bytes=10 * 1024 * 1024))
+        self.transcoder_patch = patch('app.transcoder', self.transcoder)
+        self.transcoder_patch.start()
+
+        self.app_context = app.app_context()
+        self.app_context.push()
+        self.client = app.test_client()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        self.transcoder_patch.stop()
+        shutil.rmtree(self.test_music_dir)
+        shutil.rmtree(self.cache_dir)
+
+    def test_transcode_then_serve_from_cache(self):
+        """測試首次請求邊轉碼邊傳送，第二次請求直接由快取提供"""
+        response = self.client.get('/stream/song.flac?quality=opus96')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'audio/ogg')
+        self.assertEqual(response.data, self.content)
+        # 轉碼中的回應可能不完整，不帶驗證資訊
+        self.assertNotIn('ETag', response.headers)
+        self.assertNotIn('Last-Modified', response.headers)
+        response.close()
+
+        with patch.object(Transcoder, 'build_command', side_effect=AssertionError('should use cache')):
+            response = self.client.get('/stream/song.flac?quality=opus96',
+                                       headers={'Range': 'bytes=0-99'})
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(response.data, self.content[:100])
+            etag = response.headers['ETag']
+            response.close()
+
+            # 快取中的完整變體可以重新驗證
+            response = self.client.get('/stream/song.flac?quality=opus96', headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 304)
+
+    def test_concurrent_requests_share_job(self):
+        """測試相同變體的並行請求共用同一個轉碼工作"""
+        stat = os.stat(self.source)
+        _, job1 = self.transcoder.open(self.source, stat.st_size, stat.st_mtime_ns, 'aac160')
+        _, job2 = self.transcoder.open(self.source, stat.st_size, stat.st_mtime_ns, 'aac160')
+        self.assertIs(job1, job2)
+        self.assertEqual(b''.join(job1.iter_chunks()), self.content)
+
+        cached_path, job3 = self.transcoder.open(self.source, stat.st_size, stat.st_mtime_ns, 'aac160')
+        self.assertIsNone(job3)
+        self.assertTrue(os.path.exists(cached_path))
+
+    def test_unsupported_quality(self):
+        """測試不支援的轉碼規格"""
+        response = self.client.get('/stream/song.flac?quality=lossless9000')
+        self.assertEqual(response.status_code, 400)
+
+if __name__ == '__main__':
+    unittest.main()
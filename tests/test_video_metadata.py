@@ -0,0 +1,113 @@
+import os
+import sys
+import unittest
+from unittest.mock import patch, MagicMock, PropertyMock
+import json
+from datetime import datetime
+
+# 添加項目根目錄到 Python 路徑
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, db, get_youtube_info, video_search_service
+from models import Playlist, VideoMetadata
+from services.video_metadata import parse_video_url
+from services.video_search import VideoSearchService
+
+def youtube_video(video_id, duration='PT3M'):
+    return {
+        'id': video_id,
+        'snippet': {'title': f'Video {video_id}', 'thumbnails': {'high': {'url': f'http://img/{video_id}.jpg'}}},
+        'contentDetails': {'duration': duration},
+        'statistics': {'viewCount': '42'}
+    }
+
+class TestVideoMetadata(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.app_context = app.app_context()
+        self.app_context.push()
+        self.client = app.test_client()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_parse_video_url(self):
+        """測試從網址取得平台與影片 ID"""
+        self.assertEqual(parse_video_url('https://www.youtube.com/watch?v=dQw4w9WgXcQ&t=1'), ('youtube', 'dQw4w9WgXcQ'))
+        self.assertEqual(parse_video_url('https://youtu.be/dQw4w9WgXcQ'), ('youtube', 'dQw4w9WgXcQ'))
+        self.assertEqual(parse_video_url('https://m.youtube.com/shorts/dQw4w9WgXcQ'), ('youtube', 'dQw4w9WgXcQ'))
+        self.assertEqual(parse_video_url('https://www.bilibili.com/video/BV1xx411c7mD/'), ('bilibili', 'BV1xx411c7mD'))
+        self.assertIsNone(parse_video_url('https://www.youtube.com/playlist?list=PL123'))
+        self.assertIsNone(parse_video_url('https://example.com/watch?v=dQw4w9WgXcQ'))
+
+    @patch('app.ytdlp_pool.extract_info')
+    def test_add_url_uses_stored_metadata(self, mock_extract):
+        """測試同一影片的不同網址只執行一次 yt-dlp"""
+        mock_extract.return_value = {
+            'title': 'Stored Song',
+            'id': 'dQw4w9WgXcQ',
+            'thumbnail': 'http://example.com/thumb.jpg',
+            'duration': 212,
+            'view_count': 1000
+        }
+        playlist = Playlist(name='Test Playlist')
+        db.session.add(playlist)
+        db.session.commit()
+
+        response = self.client.post(f'/playlists/{playlist.id}/songs',
+                                    json={'url': 'https://www.youtube.com/watch?v=dQw4w9WgXcQ'})
+        self.assertEqual(response.status_code, 200)
+        response = self.client.post('/downloads', json={'url': 'https://youtu.be/dQw4w9WgXcQ'})
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data['song']['title'], 'Stored Song')
+        self.assertEqual(data['song']['duration'], 212)
+        self.assertEqual(mock_extract.call_count, 1)
+
+        # 已有歌曲時直接使用，不需要影片資訊
+        response = self.client.post(f'/playlists/{playlist.id}/songs',
+                                    json={'url': 'https://youtube.com/watch?v=dQw4w9WgXcQ&list=x'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['id'], data['song']['id'])
+        self.assertEqual(mock_extract.call_count, 1)
+
+        # 過期的資訊會重新取得
+        db.session.query(VideoMetadata).update({'fetched_at': datetime(2000, 1, 1)})
+        db.session.commit()
+        self.assertEqual(get_youtube_info('https://youtu.be/dQw4w9WgXcQ')['title'], 'Stored Song')
+        self.assertEqual(mock_extract.call_count, 2)
+
+    def test_search_only_fetches_unknown_ids(self):
+        """測試搜索只查詢未保存的影片詳細信息"""
+        client = MagicMock()
+        requested = []
+
+        def videos_list(id, part):
+            requested.append(id.split(','))
+            request = MagicMock()
+            request.execute.return_value = {'items': [youtube_video(video_id) for video_id in id.split(',')]}
+            return request
+
+        client.videos.return_value.list.side_effect = videos_list
+        with patch.object(VideoSearchService, 'youtube', new_callable=PropertyMock, return_value=client):
+            client.search.return_value.list.return_value.execute.return_value = {
+                'items': [{'id': {'videoId': 'aaaaaaaaaaa'}}, {'id': {'videoId': 'bbbbbbbbbbb'}}]
+            }
+            first = video_search_service.search_youtube('first')
+            client.search.return_value.list.return_value.execute.return_value = {
+                'items': [{'id': {'videoId': 'bbbbbbbbbbb'}}, {'id': {'videoId': 'ccccccccccc'}}]
+            }
+            second = video_search_service.search_youtube('second')
+
+        self.assertEqual(requested, [['aaaaaaaaaaa', 'bbbbbbbbbbb'], ['ccccccccccc']])
+        self.assertEqual([r['id'] for r in second], ['bbbbbbbbbbb', 'ccccccccccc'])
+        self.assertEqual(second[0], first[1])
+        self.assertEqual(second[0]['view_count'], 42)
+        self.assertEqual(db.session.query(VideoMetadata).count(), 3)
+
+if __name__ == '__main__':
+    unittest.main()
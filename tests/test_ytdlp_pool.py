@@ -0,0 +1,82 @@
+import os
+import sys
+import time
+import unittest
+
+# 添加項目根目錄到 Python 路徑
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.ytdlp_pool import YtDlpPool, YtDlpError
+
+def echo(value):
+    return value, os.getpid()
+
+def sleep(seconds):
+    time.sleep(seconds)
+
+def crash():
+    os._exit(1)
+
+def slow_echo(value, seconds):
+    time.sleep(seconds)
+    return value, os.getpid()
+
+class TestYtDlpPool(unittest.TestCase):
+    def setUp(self):
+        self.pool = YtDlpPool(workers=1, timeout=10)
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    def test_workers_are_reused(self):
+        """測試工作在常駐的工作行程中執行"""
+        self.pool.warm()
+        _, first_pid = self.pool.call(echo, 1)
+        value, second_pid = self.pool.call(echo, 2)
+        self.assertEqual(value, 2)
+        self.assertEqual(first_pid, second_pid)
+        self.assertNotEqual(first_pid, os.getpid())
+
+    def test_extract_error(self):
+        """測試 yt-dlp 的錯誤轉換為 YtDlpError"""
+        with self.assertRaises(YtDlpError):
+            self.pool.extract_info('not a url')
+
+    def test_timeout_restarts_pool(self):
+        """測試逾時的工作被終止，之後的工作仍可執行"""
+        with self.assertRaises(YtDlpError):
+            self.pool.call(sleep, 30, timeout=0.5)
+        self.assertEqual(self.pool.restarts, 1)
+        self.assertEqual(self.pool.call(echo, 'ok')[0], 'ok')
+
+    def test_timeout_only_restarts_its_worker(self):
+        """測試逾時只終止執行該工作的行程，其他行程中的工作正常完成"""
+        pool = YtDlpPool(workers=2, timeout=10)
+        try:
+            pool.warm()
+            other = pool.submit(slow_echo, 'other', 1.5)
+            with self.assertRaises(YtDlpError):
+                pool.call(sleep, 30, timeout=0.5)
+            self.assertEqual(pool.restarts, 1)
+            self.assertEqual(other.result(timeout=10)[0], 'other')
+            self.assertEqual(pool.call(echo, 'ok')[0], 'ok')
+        finally:
+            pool.shutdown()
+
+    def test_jobs_wait_for_idle_worker(self):
+        """測試超過行程數量的工作依序等待空閒的行程，等待中逾時的工作不終止行程"""
+        running = self.pool.submit(slow_echo, 'first', 1)
+        with self.assertRaises(YtDlpError):
+            self.pool.call(echo, 'waiting', timeout=0.2)
+        self.assertEqual(self.pool.restarts, 0)
+        self.assertEqual(running.result(timeout=10)[0], 'first')
+        self.assertEqual(self.pool.call(echo, 'next')[0], 'next')
+
+    def test_crash_is_isolated(self):
+        """測試工作行程異常結束不影響之後的工作"""
+        with self.assertRaises(YtDlpError):
+            self.pool.call(crash)
+        self.assertEqual(self.pool.call(echo, 'ok')[0], 'ok')
+
+if __name__ == '__main__':
+    unittest.main()